@@ -0,0 +1,37 @@
+"""Compare summing a column of parts against in batches of columns.
+
+Usage: python3 benchmarks/columns.py [LINES]
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+PYLI = [sys.executable, "-c", "import pyli; pyli.script_entry_point()"]
+PROGRAMS = [
+    ("parts", ["sum(float(r[2]) for r in parts)"]),
+    ("cols", ["sum(cols[2])", "--combine", "sum(results)"]),
+]
+
+
+def run():
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "numbers.txt")
+        with open(path, "w") as f:
+            for i in range(lines):
+                f.write("{} {} {}.5\n".format(i, i % 7, i % 13))
+        for name, args in PROGRAMS:
+            with open(path) as stdin:
+                start = time.perf_counter()
+                subprocess.run(
+                    PYLI + args, stdin=stdin, stdout=subprocess.DEVNULL, check=True
+                )
+                elapsed = time.perf_counter() - start
+            print("{:<10} {:>12,.0f} lines/sec".format(name, lines / elapsed))
+
+
+if __name__ == "__main__":
+    run()
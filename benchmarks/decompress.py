@@ -0,0 +1,49 @@
+"""Compare piping compressed logs through zcat/bzcat/xzcat against
+letting pyli decompress them.
+
+Usage: python3 benchmarks/decompress.py [LINES]
+"""
+
+import bz2
+import gzip
+import lzma
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+PYLI = [sys.executable, "-c", "import pyli; pyli.script_entry_point()"]
+PROGRAM = ["len(l.split())"]
+FORMATS = [
+    ("gz", gzip.open, "zcat"),
+    ("bz2", bz2.open, "bzcat"),
+    ("xz", lzma.open, "xzcat"),
+]
+
+
+def bench(name, command, lines):
+    start = time.perf_counter()
+    subprocess.run(command, shell=True, stdout=subprocess.DEVNULL, check=True)
+    elapsed = time.perf_counter() - start
+    print("{:<16} {:>12,.0f} lines/sec".format(name, lines / elapsed))
+
+
+def run():
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    pyli = shlex.join(PYLI + PROGRAM)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for extension, open_compressed, cat in FORMATS:
+            path = os.path.join(tmp_dir, "log." + extension)
+            with open_compressed(path, "wt") as f:
+                for i in range(lines):
+                    f.write("{} GET /index.html 200 {}\n".format(i, i % 977))
+            if shutil.which(cat):
+                bench("{} |".format(cat), "{} {} | {}".format(cat, path, pyli), lines)
+            bench("< log." + extension, "{} < {}".format(pyli, path), lines)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,58 @@
+"""Compare ways of splitting wide lines into fields, including only
+splitting off the first few (like for `p[0] + p[2]`).
+
+Usage: python3 benchmarks/fields.py [LINES] [COLUMNS]
+"""
+
+import csv
+import os
+import sys
+import tempfile
+import time
+
+from pyli.stream import read_lines, read_parts
+
+
+def split_per_line(stream):
+    for line in read_lines(stream):
+        yield line.rstrip("\n").split(",")
+
+
+def csv_per_line(stream):
+    # What a per-line program has to do itself to handle quoting.
+    for line in read_lines(stream):
+        yield next(csv.reader([line]))
+
+
+def bench(name, fn, path, lines):
+    with open(path) as stream:
+        start = time.perf_counter()
+        for _ in fn(stream):
+            pass
+        elapsed = time.perf_counter() - start
+    print("{:<24} {:>12,.0f} lines/sec".format(name, lines / elapsed))
+
+
+def run():
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    columns = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "wide.csv")
+        with open(path, "w") as f:
+            row = ",".join('"field {}"'.format(i) for i in range(columns))
+            for _ in range(lines):
+                f.write(row + "\n")
+        bench("split per line", split_per_line, path, lines)
+        bench("--sep ,", lambda s: read_parts(s, sep=","), path, lines)
+        bench(
+            "--sep , p[0] + p[2]",
+            lambda s: read_parts(s, sep=",", maxsplit=3),
+            path,
+            lines,
+        )
+        bench("csv.reader per line", csv_per_line, path, lines)
+        bench("--csv", lambda s: read_parts(s, dialect="excel"), path, lines)
+
+
+if __name__ == "__main__":
+    run()
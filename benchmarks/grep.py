@@ -0,0 +1,45 @@
+"""Compare filtering lines in the program against the --fixed and
+--grep prefilters, for a range of selectivities (the share of lines
+that match).
+
+Usage: python3 benchmarks/grep.py [LINES]
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+PYLI = [sys.executable, "-c", "import pyli; pyli.script_entry_point()"]
+SELECTIVITIES = [0.001, 0.01, 0.1, 0.5]
+PROGRAMS = [
+    ("in program", ["l if 'ERROR' in l else None"]),
+    ("--fixed", ["--fixed", "ERROR", "l"]),
+    ("--grep", ["--grep", "ERROR [0-9]+", "l"]),
+]
+
+
+def run():
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for selectivity in SELECTIVITIES:
+            path = os.path.join(tmp_dir, "log.txt")
+            every = round(1 / selectivity)
+            with open(path, "w") as f:
+                for i in range(lines):
+                    level = "ERROR" if i % every == 0 else "INFO"
+                    f.write("2024-01-01 12:00:00 {} {} request done\n".format(level, i))
+            print("{:.1%} of lines match".format(selectivity))
+            for name, args in PROGRAMS:
+                with open(path) as stdin:
+                    start = time.perf_counter()
+                    subprocess.run(
+                        PYLI + args, stdin=stdin, stdout=subprocess.DEVNULL, check=True
+                    )
+                    elapsed = time.perf_counter() - start
+                print("  {:<12} {:>12,.0f} lines/sec".format(name, lines / elapsed))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,40 @@
+"""Compare a `record` program against decoding and encoding each line
+of JSON Lines by hand.
+
+Usage: python3 benchmarks/jsonl.py [LINES]
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+PYLI = [sys.executable, "-c", "import pyli; pyli.script_entry_point()"]
+PROGRAMS = [
+    ("by hand", ["r = json.loads(l); r['n'] += 1; json.dumps(r)"]),
+    ("record", ["r = record; r['n'] += 1; r"]),
+]
+
+
+def run():
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "records.jsonl")
+        with open(path, "w") as f:
+            for i in range(lines):
+                record = {"n": i, "name": "item {}".format(i), "tags": ["a", "b"]}
+                f.write(json.dumps(record) + "\n")
+        for name, args in PROGRAMS:
+            with open(path) as stdin:
+                start = time.perf_counter()
+                subprocess.run(
+                    PYLI + args, stdin=stdin, stdout=subprocess.DEVNULL, check=True
+                )
+                elapsed = time.perf_counter() - start
+            print("{:<10} {:>12,.0f} lines/sec".format(name, lines / elapsed))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,41 @@
+"""Compare eager and lazy auto-imports, for a program that only uses
+heavy modules on a path that's never taken.
+
+Usage: python3 benchmarks/lazy.py [RUNS]
+"""
+
+import subprocess
+import sys
+import time
+
+PYLI = [sys.executable, "-c", "import pyli; pyli.script_entry_point()"]
+PROGRAM = """
+if l.startswith("!"):
+    asyncio.run(email.message_from_string(l)); decimal.Decimal(l); http.server
+l
+"""
+
+
+def best_time(args, runs):
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            PYLI + args + [PROGRAM],
+            input="a\nb\nc\n",
+            text=True,
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    for name, args in [("eager", []), ("--lazy-imports", ["--lazy-imports"])]:
+        print("{:<16} {:>8.1f} ms".format(name, best_time(args, runs) * 1000))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,51 @@
+"""Compare the per-line overhead of running the per-line loop as a
+module (with --no-optimize) against in a function, where its variables
+are fast locals. None of the programs have anything to hoist.
+
+Usage: python3 benchmarks/locals.py [LINES]
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+PYLI = [sys.executable, "-c", "import pyli; pyli.script_entry_point()"]
+PROGRAMS = [
+    ("line", ["l"]),
+    ("temporaries", ["x = len(l); y = x * 2 + 1; y if x > 3 else None"]),
+    ("counter", ["--begin", "c = 0", "c += len(l)", "--end", "c"]),
+]
+
+
+def bench(args, path):
+    with open(path) as stdin:
+        start = time.perf_counter()
+        subprocess.run(PYLI + args, stdin=stdin, stdout=subprocess.DEVNULL, check=True)
+        return time.perf_counter() - start
+
+
+def run():
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "lines.txt")
+        with open(path, "w") as f:
+            for i in range(lines):
+                f.write("{} some text\n".format(i))
+        empty = os.path.join(tmp_dir, "empty.txt")
+        open(empty, "w").close()
+        for name, args in PROGRAMS:
+            for label, extra in [("module", ["--no-optimize"]), ("function", [])]:
+                # Take out starting up, to leave the time per line.
+                startup = bench(extra + args, empty)
+                elapsed = bench(extra + args, path) - startup
+                print(
+                    "{:<12} {:<9} {:>8.0f} ns/line".format(
+                        name, label, elapsed / lines * 1e9
+                    )
+                )
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,47 @@
+"""Compare per-line programs with work that's the same for every line,
+with and without hoisting it out of the loop.
+
+Usage: python3 benchmarks/optimize.py [LINES]
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+PYLI = [sys.executable, "-c", "import pyli; pyli.script_entry_point()"]
+PROGRAMS = [
+    ("regex", ["re.search('(?i)id=([0-9]+) (?:ok|done)$', l)"]),
+    ("flags", ["re.sub('[aeiou]', '', l, flags=re.I)"]),
+    ("variable", ["int(p[1]) > int(threshold) * 2", "--threshold=500"]),
+]
+
+
+def run():
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "log.txt")
+        with open(path, "w") as f:
+            for i in range(lines):
+                f.write("id={} {} done\n".format(i, i % 2000))
+        for name, args in PROGRAMS:
+            for label, extra in [("--no-optimize", ["--no-optimize"]), ("", [])]:
+                with open(path) as stdin:
+                    start = time.perf_counter()
+                    subprocess.run(
+                        PYLI + extra + args,
+                        stdin=stdin,
+                        stdout=subprocess.DEVNULL,
+                        check=True,
+                    )
+                    elapsed = time.perf_counter() - start
+                print(
+                    "{:<10} {:<14} {:>12,.0f} lines/sec".format(
+                        name, label, lines / elapsed
+                    )
+                )
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,46 @@
+"""Compare the output sink against calling print() per result.
+
+Usage: python3 benchmarks/output.py [RESULTS]
+"""
+
+import contextlib
+import os
+import sys
+import time
+
+from pyli.output import OutputSink
+
+
+def print_results(stream, count):
+    with contextlib.redirect_stdout(stream):
+        for i in range(count):
+            print(i)
+
+
+def sink_results(stream, count, background=False):
+    with contextlib.redirect_stdout(stream):
+        with OutputSink(stream, background=background) as sink:
+            write = sink.write
+            for i in range(count):
+                write(i)
+
+
+def bench(name, fn, count):
+    with open(os.devnull, "w") as devnull:
+        start = time.perf_counter()
+        fn(devnull, count)
+        elapsed = time.perf_counter() - start
+    print("{:<20} {:>12,.0f} results/sec".format(name, count / elapsed))
+
+
+def run():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000
+    bench("print()", print_results, count)
+    bench("OutputSink", sink_results, count)
+    bench(
+        "OutputSink (thread)", lambda s, c: sink_results(s, c, background=True), count
+    )
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,51 @@
+"""Compare reading a bursty pipe (a producer that writes a batch of
+lines, then stalls) with and without --prefetch, for a program that
+does some work per line.
+
+Usage: python3 benchmarks/prefetch.py [BURSTS] [STALL_MS]
+"""
+
+import subprocess
+import sys
+import time
+
+PYLI = [sys.executable, "-c", "import pyli; pyli.script_entry_point()"]
+PRODUCER = """
+import sys, time
+line = b"x" * 63 + b"\\n"
+for _ in range({bursts}):
+    sys.stdout.buffer.write(line * 4096)
+    sys.stdout.buffer.flush()
+    time.sleep({stall})
+"""
+PROGRAM = "sum(ord(c) for c in l)"
+
+
+def bench(args, bursts, stall):
+    producer = subprocess.Popen(
+        [sys.executable, "-c", PRODUCER.format(bursts=bursts, stall=stall)],
+        stdout=subprocess.PIPE,
+    )
+    start = time.perf_counter()
+    subprocess.run(
+        PYLI + args + [PROGRAM],
+        stdin=producer.stdout,
+        stdout=subprocess.DEVNULL,
+        check=True,
+    )
+    elapsed = time.perf_counter() - start
+    producer.stdout.close()
+    producer.wait()
+    return elapsed
+
+
+def run():
+    bursts = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    stall = (float(sys.argv[2]) if len(sys.argv) > 2 else 50) / 1000
+    for name, args in [("plain", []), ("--prefetch", ["--prefetch"])]:
+        elapsed = bench(args, bursts, stall)
+        print("{:<12} {:>8.2f} s".format(name, elapsed))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,51 @@
+"""Compare the block line reader against the old readline() generator.
+
+Usage: python3 benchmarks/readers.py [LINES] [BLOCK_SIZE]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from pyli.stream import DEFAULT_BLOCK_SIZE, read_lines
+
+
+def readline_generator(stream):
+    # The generator pyli used to emit for line/lines.
+    while True:
+        li = stream.readline()
+        if not li:
+            break
+        yield li.rstrip("\n")
+
+
+def bench(name, reader, path, count):
+    with open(path) as stream:
+        start = time.perf_counter()
+        seen = sum(1 for _ in reader(stream))
+        elapsed = time.perf_counter() - start
+    assert seen == count, (name, seen)
+    print("{:<20} {:>12,.0f} lines/sec".format(name, count / elapsed))
+
+
+def run():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000
+    block_size = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_BLOCK_SIZE
+    with tempfile.NamedTemporaryFile("w", delete=False) as f:
+        for i in range(count):
+            f.write("{} GET /index.html 200 {}\n".format(i, i * 7 % 1000))
+    try:
+        bench("readline()", readline_generator, f.name, count)
+        bench(
+            "read_lines({})".format(block_size),
+            lambda s: read_lines(s, block_size),
+            f.name,
+            count,
+        )
+    finally:
+        os.unlink(f.name)
+
+
+if __name__ == "__main__":
+    run()
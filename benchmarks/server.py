@@ -0,0 +1,67 @@
+"""Compare the latency of cold runs against runs on a pre-warmed server.
+
+Usage: python3 benchmarks/server.py [RUNS] [PRELOAD]
+
+PRELOAD is a comma separated list of modules for the server to import
+(and the program to use), like numpy,pandas. Defaults to json.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+PYLI = [sys.executable, "-c", "import pyli; pyli.script_entry_point()"]
+
+
+def latency(program, env, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            PYLI + [program],
+            input="",
+            text=True,
+            stdout=subprocess.DEVNULL,
+            env=env,
+            check=True,
+        )
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times[len(times) // 2], times[0]
+
+
+def run():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    preload = sys.argv[2] if len(sys.argv) > 2 else "json"
+    program = "; ".join("{}.__name__".format(name) for name in preload.split(","))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        socket_path = os.path.join(tmp_dir, "pyli.sock")
+        env = dict(os.environ)
+        env.pop("PYLI_SOCKET", None)
+        server = subprocess.Popen(
+            PYLI + ["--server", "--socket", socket_path, "--preload", preload],
+            env=env,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            while not os.path.exists(socket_path):
+                time.sleep(0.01)
+            for name, run_env in [
+                ("cold", env),
+                ("warm", dict(env, PYLI_SOCKET=socket_path)),
+            ]:
+                median, best = latency(program, run_env, runs)
+                print(
+                    "{:<6} median {:>7.1f} ms  best {:>7.1f} ms".format(
+                        name, median * 1000, best * 1000
+                    )
+                )
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,75 @@
+"""Measure pyli's startup: wall time of short runs, and what gets
+imported (from `python -X importtime`).
+
+Usage: python3 benchmarks/startup.py [RUNS]
+"""
+
+import subprocess
+import sys
+import time
+
+CASES = [
+    ("--version", ["--version"], ""),
+    ("print 1", ["1"], ""),
+    ("per-line", ["line.upper()"], "a\nb\nc\n"),
+]
+
+
+def pyli_command(args):
+    return [sys.executable, "-c", "import pyli; pyli.script_entry_point()"] + args
+
+
+def wall_time(command, stdin, runs):
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            command,
+            input=stdin,
+            text=True,
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def import_times(args, stdin):
+    """Cumulative import time in microseconds of each top level import."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime"] + pyli_command(args)[1:],
+        input=stdin,
+        text=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit() and not name.startswith("  "):
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def run():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    interpreter = wall_time([sys.executable, "-c", "pass"], "", runs)
+    print("{:<12} {:>8.1f} ms".format("python", interpreter * 1000))
+    for name, args, stdin in CASES:
+        elapsed = wall_time(pyli_command(args), stdin, runs)
+        times = import_times(args, stdin)
+        slowest = sorted(times.items(), key=lambda item: -item[1])[:3]
+        print(
+            "{:<12} {:>8.1f} ms  (slowest imports: {})".format(
+                name,
+                elapsed * 1000,
+                ", ".join("{} {:.1f}ms".format(n, t / 1000) for n, t in slowest),
+            )
+        )
+
+
+if __name__ == "__main__":
+    run()
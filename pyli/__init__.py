@@ -18,12 +18,18 @@
 #  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 #  THE SOFTWARE.
 
-import logging
+import os
 import sys
-from pyli.main import main
+
+# Startup time matters for a CLI tool, so only import the rest of pyli
+# (and the logging and typing machinery) once we know we're going to
+# run a program, and not just print the --version or --help.
 
 __version__ = (2, 0, 1)
 
+# Environment variable pointing the client at a server (see pyli.server).
+SOCKET_VARIABLE = "PYLI_SOCKET"
+
 # Any sane person would use argparse; however, we want to accept
 # arbitrary switches, so unfortunately argparse is not an option.
 
@@ -35,68 +41,271 @@ pyli is a utility to make using python in conjunction with other CLI tools easie
  - print the last line automatically (if not None)
  - provides command line options as variables (other than those listed
    below)
+ - reads any files given after `--` instead of stdin, running the
+   program once per file (with fn/filename set to its name)
 
 Special switches include:
  -v, -vv, --debug  Outputs debug information useful when developing pyli.
  --help            Outputs this message.
  -pp, --pprint     Uses pprint.pprint() instead of python's builtin print.
  --version         Outputs the current version of pyli.
+ --block-size N    Read stdin in blocks of N bytes (default {block_size}),
+                   which is also the size of each chunk.
+ -j N, --jobs N    Run per-line programs on N processes, in batches of lines
+                   (or any program on one file at a time, with files).
+ --threads N       Run per-line programs on N threads, for I/O bound work.
+ --batch-size N    Lines per batch when running in parallel (default
+                   {batch_size} with --jobs, {thread_batch_size} with --threads), or
+                   per batch of cols (default {column_batch_size}).
+ --combine EXPR    Print EXPR over the `results` of each batch of cols,
+                   instead of each result.
+ --begin CODE      Run CODE before the program (say, to set up counters).
+ --end CODE        Run CODE after the program, and only print its last
+                   statement.
+ --unordered       Write parallel results as they finish, not in input order.
+ --concurrency N   Run up to N lines at once for per-line programs that
+                   use await (default {concurrency}).
+ --output-thread   Encode and write output on a background thread.
+ --no-cache        Don't use the compiled code cache (in $XDG_CACHE_HOME/pyli).
+ --lazy-imports    Only import automatically imported modules when first used.
+ --sep SEP         Split part/parts on SEP instead of a single space.
+ --whitespace      Split part/parts on runs of whitespace.
+ --csv, --tsv      Parse part/parts as CSV/TSV (with quoting), where --sep
+                   changes the delimiter.
+ --binary          Read line/parts/contents as bytes, and write bytes results
+                   as they are (followed by a newline per line or part).
+ --decompress      Decompress gzip/bzip2/xz input (the default, except with
+                   --binary).
+ --no-decompress   Don't decompress gzip/bzip2/xz input.
+ --limit N         Stop after writing N lines of results or printed output
+                   (without reading any further, or running the --end block).
+ --skip N          Skip the first N lines of input (of each file, with files).
+ --grep PATTERN    Only read lines matching the regex PATTERN, searching the
+                   raw input before decoding or splitting it.
+ --fixed STRING    Only read lines containing STRING, like --grep.
+ --no-optimize     Don't hoist work that's the same for every line (like
+                   compiling a constant regex) out of the per-line loop, or
+                   run the loop in a function.
+ --prefetch        Read stdin ahead on a background thread, for slow pipes
+                   and network filesystems (-vv shows how long each side
+                   waited).
+ --server          Start a server that runs programs with the --preload
+                   modules already imported, for clients with {socket_variable}
+                   set to its --socket path.
+ --preload M,...   Modules for the server to import up front.
+ --socket PATH     Unix socket for the server to listen on.
 
 Check out https://github.com/thenoviceoof/pyli for more details!
 """
 
 
+def pop_option(args: list[str], name: str) -> "str | None":
+    """Remove a switch that takes a value (`--name=value` or `--name
+    value`) from the arguments, and return the value."""
+    for i, arg in enumerate(args):
+        if arg == name and i + 1 < len(args):
+            value = args[i + 1]
+            del args[i : i + 2]
+            return value
+        if arg.startswith(name + "="):
+            del args[i]
+            return arg[len(name) + 1 :]
+    return None
+
+
 # TODO: add a --debug-out switch to provide an alternative for debug
 # info than stderr.
 def script_entry_point():
     if len(sys.argv) == 1 or "--help" in sys.argv:
-        print(HELP_MSG.format(sys.argv[0]))
+        from pyli.parallel import (
+            DEFAULT_BATCH_SIZE,
+            DEFAULT_CONCURRENCY,
+            DEFAULT_THREAD_BATCH_SIZE,
+        )
+        from pyli.stream import DEFAULT_BLOCK_SIZE, DEFAULT_COLUMN_BATCH_SIZE
+
+        print(
+            HELP_MSG.format(
+                block_size=DEFAULT_BLOCK_SIZE,
+                batch_size=DEFAULT_BATCH_SIZE,
+                thread_batch_size=DEFAULT_THREAD_BATCH_SIZE,
+                concurrency=DEFAULT_CONCURRENCY,
+                column_batch_size=DEFAULT_COLUMN_BATCH_SIZE,
+                socket_variable=SOCKET_VARIABLE,
+            )
+        )
     elif "--version" in sys.argv:
         version_string = ".".join(str(v) for v in __version__)
         print(version_string)
-    else:
+    elif "--server" in sys.argv:
+        from pyli.server import default_socket_path, serve
+
         args = sys.argv[1:]
-        debug = logging.ERROR
-        pprint = False
-        # strip out any switches
-        if "-v" in args:
-            args.remove("-v")
-            debug = logging.WARNING
-        if "-vv" in args:
-            args.remove("-vv")
-            debug = logging.INFO
-        if "--debug" in args:
-            args.remove("--debug")
-            debug = logging.DEBUG
-        if "--pprint" in args:
-            args.remove("--pprint")
-            pprint = True
-        if "-pp" in args:
-            args.remove("-pp")
-            pprint = True
-        # pass everything else as a variable
-        commands = []
-        kwargs: dict[str, str | bool] = {}
-        while args:
-            if args[0][0] == "-":
-                if "=" in args[0]:
-                    name, val = args[0].split("=", 1)
-                    name = name.lstrip("-")
-                    kwargs[name] = val
-                    args = args[1:]
-                elif len(args) > 1 and args[1][0] != "-":
-                    name, val = args[:2]
-                    name = name.lstrip("-")
-                    kwargs[name] = val
-                    args = args[2:]
-                else:
-                    # treat as a boolean switch
-                    name = args[0].strip("-")
-                    kwargs[name] = True
-                    args = args[1:]
+        args.remove("--server")
+        path = (
+            pop_option(args, "--socket")
+            or os.environ.get(SOCKET_VARIABLE)
+            or default_socket_path()
+        )
+        preload = pop_option(args, "--preload")
+        serve(path, preload.split(",") if preload else [])
+    else:
+        path = os.environ.get(SOCKET_VARIABLE)
+        if path:
+            from pyli.server import run_client
+
+            status = run_client(path, sys.argv[1:])
+            # Without a server, just run the program ourselves.
+            if status is not None:
+                sys.exit(status)
+        run(sys.argv[1:])
+
+
+def run(args: list[str]) -> None:
+    """Parse the (non-help/version/server) arguments and run the program."""
+    import logging
+    from pyli.main import main
+    from pyli.parallel import DEFAULT_CONCURRENCY
+    from pyli.stream import DEFAULT_BLOCK_SIZE, WHITESPACE
+
+    # Everything after a -- is a file to read instead of stdin.
+    files = None
+    if "--" in args:
+        split = args.index("--")
+        args, files = args[:split], args[split + 1 :]
+    debug = logging.ERROR
+    pprint = False
+    # strip out any switches
+    if "-v" in args:
+        args.remove("-v")
+        debug = logging.WARNING
+    if "-vv" in args:
+        args.remove("-vv")
+        debug = logging.INFO
+    if "--debug" in args:
+        args.remove("--debug")
+        debug = logging.DEBUG
+    if "--pprint" in args:
+        args.remove("--pprint")
+        pprint = True
+    if "-pp" in args:
+        args.remove("-pp")
+        pprint = True
+    block_size = int(pop_option(args, "--block-size") or DEFAULT_BLOCK_SIZE)
+    jobs = int(pop_option(args, "--jobs") or pop_option(args, "-j") or 1)
+    threads = int(pop_option(args, "--threads") or 1)
+    batch_size_option = pop_option(args, "--batch-size")
+    batch_size = int(batch_size_option) if batch_size_option else None
+    concurrency = int(pop_option(args, "--concurrency") or DEFAULT_CONCURRENCY)
+    limit_option = pop_option(args, "--limit")
+    limit = int(limit_option) if limit_option else None
+    skip = int(pop_option(args, "--skip") or 0)
+    grep = pop_option(args, "--grep")
+    fixed = False
+    fixed_string = pop_option(args, "--fixed")
+    if fixed_string is not None:
+        grep = fixed_string
+        fixed = True
+    optimize = True
+    if "--no-optimize" in args:
+        args.remove("--no-optimize")
+        optimize = False
+    cache = True
+    if "--no-cache" in args:
+        args.remove("--no-cache")
+        cache = False
+    dialect = None
+    if "--csv" in args:
+        args.remove("--csv")
+        dialect = "excel"
+    if "--tsv" in args:
+        args.remove("--tsv")
+        dialect = "excel-tab"
+    if "--whitespace" in args:
+        args.remove("--whitespace")
+        dialect = WHITESPACE
+    sep = pop_option(args, "--sep")
+    binary = False
+    if "--binary" in args:
+        args.remove("--binary")
+        binary = True
+    decompress = None
+    if "--decompress" in args:
+        args.remove("--decompress")
+        decompress = True
+    if "--no-decompress" in args:
+        args.remove("--no-decompress")
+        decompress = False
+    prefetch = False
+    if "--prefetch" in args:
+        args.remove("--prefetch")
+        prefetch = True
+    combine = pop_option(args, "--combine")
+    begin = pop_option(args, "--begin")
+    end = pop_option(args, "--end")
+    lazy_imports = False
+    if "--lazy-imports" in args:
+        args.remove("--lazy-imports")
+        lazy_imports = True
+    output_thread = False
+    if "--output-thread" in args:
+        args.remove("--output-thread")
+        output_thread = True
+    ordered = True
+    if "--unordered" in args:
+        args.remove("--unordered")
+        ordered = False
+    # pass everything else as a variable
+    commands = []
+    kwargs: dict[str, str | bool] = {}
+    while args:
+        if args[0][0] == "-":
+            if "=" in args[0]:
+                name, val = args[0].split("=", 1)
+                name = name.lstrip("-")
+                kwargs[name] = val
+                args = args[1:]
+            elif len(args) > 1 and args[1][0] != "-":
+                name, val = args[:2]
+                name = name.lstrip("-")
+                kwargs[name] = val
+                args = args[2:]
             else:
-                commands.append(args[0])
+                # treat as a boolean switch
+                name = args[0].strip("-")
+                kwargs[name] = True
                 args = args[1:]
+        else:
+            commands.append(args[0])
+            args = args[1:]
 
-        program = "\n".join(commands)
-        main(program, debug=debug, pprint_opt=pprint, variables=kwargs)
+    program = "\n".join(commands)
+    main(
+        program,
+        debug=debug,
+        pprint_opt=pprint,
+        variables=kwargs,
+        block_size=block_size,
+        jobs=jobs,
+        threads=threads,
+        batch_size=batch_size,
+        ordered=ordered,
+        concurrency=concurrency,
+        output_thread=output_thread,
+        cache=cache,
+        lazy_imports=lazy_imports,
+        sep=sep,
+        dialect=dialect,
+        combine=combine,
+        begin=begin,
+        end=end,
+        binary=binary,
+        decompress=decompress,
+        files=files,
+        prefetch=prefetch,
+        limit=limit,
+        skip=skip,
+        grep=grep,
+        fixed=fixed,
+        optimize=optimize,
+    )
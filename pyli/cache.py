@@ -0,0 +1,136 @@
+#  Copyright (c) <2014> <thenoviceoof>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+#  THE SOFTWARE.
+
+# On-disk cache of compiled programs.
+#
+# pyli often gets run over and over with the same program (in shell
+# loops, from `find -exec`, ...), so we keep the final code object
+# around under $XDG_CACHE_HOME/pyli, and skip straight to executing it
+# next time. Entries are evicted least recently used first, once the
+# cache grows past a size limit.
+
+import hashlib
+import logging
+import marshal
+import os
+import sys
+from typing import Any, Optional
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 32 * 1024 * 1024
+SUFFIX = ".marshal"
+
+
+def cache_dir() -> str:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "pyli")
+
+
+def source_stamp() -> list[tuple[str, int]]:
+    """Modification times of pyli's own modules, so that editing pyli
+    without bumping the version doesn't use stale code."""
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    return sorted(
+        (entry.name, entry.stat().st_mtime_ns)
+        for entry in os.scandir(package_dir)
+        if entry.name.endswith(".py")
+    )
+
+
+def environment_stamp() -> list[tuple[str, int]]:
+    """Modification times of everything on sys.path, which change
+    when packages are installed or removed."""
+    stamp = [(sys.executable, 0)]
+    for entry in sys.path:
+        try:
+            stamp.append((entry, os.stat(entry or ".").st_mtime_ns))
+        except OSError:
+            stamp.append((entry, -1))
+    return stamp
+
+
+def cache_key(*parts: Any) -> str:
+    """Hash everything that goes into compiling a program, along with
+    the pyli and python versions."""
+    from pyli import __version__
+
+    key = repr((__version__, sys.version, source_stamp(), parts))
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def load_cached(key: str) -> Optional[Any]:
+    path = os.path.join(cache_dir(), key + SUFFIX)
+    try:
+        with open(path, "rb") as f:
+            value = marshal.load(f)
+        # Mark the entry as recently used.
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    except (OSError, EOFError, ValueError, TypeError) as e:
+        LOG.warning("Ignoring unreadable cache entry {}: {}".format(path, e))
+        return None
+    return value
+
+
+def store_cached(key: str, value: Any, max_size: int = DEFAULT_CACHE_SIZE) -> None:
+    import tempfile
+
+    directory = cache_dir()
+    try:
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temporary file first, so concurrent invocations
+        # never see a partial entry.
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                marshal.dump(value, f)
+            os.replace(tmp_path, os.path.join(directory, key + SUFFIX))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        evict(directory, max_size)
+    except OSError as e:
+        # Caching is only an optimization.
+        LOG.warning("Unable to write to the cache: {}".format(e))
+
+
+def evict(directory: str, max_size: int) -> None:
+    """Remove the least recently used entries until the cache fits."""
+    entries = []
+    total = 0
+    for entry in os.scandir(directory):
+        if entry.name.endswith(SUFFIX):
+            stat = entry.stat()
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+            total += stat.st_size
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_size:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            # Someone else got to it first.
+            pass
+        total -= size
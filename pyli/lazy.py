@@ -0,0 +1,71 @@
+#  Copyright (c) <2014> <thenoviceoof>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+#  THE SOFTWARE.
+
+# Lazy stand-ins for auto-imported modules (with --lazy-imports).
+#
+# A module only used on a rarely taken path (error handling, an `if`
+# that never fires) still gets imported up front by the usual imports.
+# Instead, the name can be bound to a proxy, which imports the same
+# modules (already resolved at compile time, see resolve_import) the
+# first time it's used, and then replaces itself with the real module.
+
+from typing import Any
+
+
+class LazyModule:
+    """Stand-in for the top level module `name`, which imports each of
+    the dotted paths when first used."""
+
+    __slots__ = ("_pyli_name", "_pyli_paths", "_pyli_namespace", "_pyli_module")
+
+    def __init__(
+        self, name: str, paths: list[tuple[str, ...]], namespace: dict[str, Any]
+    ):
+        object.__setattr__(self, "_pyli_name", name)
+        object.__setattr__(self, "_pyli_paths", paths)
+        object.__setattr__(self, "_pyli_namespace", namespace)
+        object.__setattr__(self, "_pyli_module", None)
+
+    def _pyli_load(self) -> Any:
+        module = self._pyli_module
+        if module is None:
+            for path in self._pyli_paths:
+                __import__(".".join(path))
+            module = __import__(self._pyli_name)
+            object.__setattr__(self, "_pyli_module", module)
+            # Skip the proxy from now on.
+            if self._pyli_namespace.get(self._pyli_name) is self:
+                self._pyli_namespace[self._pyli_name] = module
+        return module
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._pyli_load(), name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._pyli_load(), name, value)
+
+    def __delattr__(self, name: str) -> None:
+        delattr(self._pyli_load(), name)
+
+    def __dir__(self) -> list[str]:
+        return dir(self._pyli_load())
+
+    def __repr__(self) -> str:
+        return repr(self._pyli_load())
@@ -18,69 +18,462 @@
 #  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 #  THE SOFTWARE.
 
-import ast
-from pyli.refs import find_free_references
-from pyli.preamble import create_imports
-from pyli.spec import handle_special_variables
-from pyli.util import var_base_difference, var_base_intersection
+from pyli.cache import cache_key, environment_stamp, load_cached, store_cached
+from pyli.output import OutputLimitReached, OutputSink
+from pyli.parallel import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_CONCURRENCY,
+    DEFAULT_THREAD_BATCH_SIZE,
+    run_processes,
+    run_threads,
+)
+from pyli.stream import (
+    DEFAULT_BLOCK_SIZE,
+    DEFAULT_COLUMN_BATCH_SIZE,
+    WHITESPACE,
+    read_lines,
+    read_parts,
+    read_records,
+    readable_files,
+)
+from pyli.util import PREFIX
 import logging
+import os
 import sys
+from types import CodeType
+from collections.abc import Iterator
+from typing import Any, Optional
 
 LOG = logging.getLogger(__name__)
 
+# The exit status of a process killed by SIGPIPE, like most tools are
+# when what they write to is closed.
+EXIT_BROKEN_PIPE = 128 + 13
+
 
 def main(
     code: str,
     debug: int = logging.ERROR,
     pprint_opt: bool = False,
     variables: dict = {},
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    jobs: int = 1,
+    threads: int = 1,
+    batch_size: Optional[int] = None,
+    ordered: bool = True,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    output_thread: bool = False,
+    cache: bool = False,
+    lazy_imports: bool = False,
+    sep: Optional[str] = None,
+    dialect: Optional[str] = None,
+    combine: Optional[str] = None,
+    begin: Optional[str] = None,
+    end: Optional[str] = None,
+    binary: bool = False,
+    decompress: Optional[bool] = None,
+    files: Optional[list[str]] = None,
+    prefetch: bool = False,
+    limit: Optional[int] = None,
+    skip: int = 0,
+    grep: Optional[str] = None,
+    fixed: bool = False,
+    optimize: bool = True,
 ) -> None:
     # Set logging verbosity.
     logging.basicConfig(level=debug)
 
+    if jobs > 1 and threads > 1:
+        LOG.error("Conflicting use of processes and threads.")
+        sys.exit(2)
+    if binary and dialect is not None and dialect != WHITESPACE:
+        LOG.error("Conflicting use of binary mode and csv parsing.")
+        sys.exit(2)
+
+    # Binary input is passed through as it is, unless asked otherwise.
+    if decompress is None:
+        decompress = not binary
+
+    parallel = jobs > 1 or threads > 1
+    if parallel and limit is not None:
+        LOG.warning("Parallel batches can't stop at a --limit, running serially")
+        parallel = False
+
+    # Everything that changes the generated code.
+    options: dict[str, Any] = dict(
+        pprint_opt=pprint_opt,
+        block_size=block_size,
+        parallel=parallel,
+        concurrency=concurrency,
+        lazy_imports=lazy_imports,
+        sep=sep,
+        dialect=dialect,
+        column_batch_size=batch_size or DEFAULT_COLUMN_BATCH_SIZE,
+        combine=combine,
+        begin=begin,
+        end=end,
+        binary=binary,
+        decompress=decompress,
+        files=files is not None,
+        prefetch=prefetch,
+        skip=skip,
+        limited=limit is not None,
+        grep=grep,
+        fixed=fixed,
+        optimize=optimize,
+    )
+    # Debug runs always go through the whole process, so there's
+    # something to look at.
+    use_cache = cache and debug == logging.ERROR
+    compiled = None
+    if use_cache:
+        # Which modules exist (see resolve_import) depends on the
+        # environment too.
+        environment = environment_stamp()
+        key = cache_key(
+            code, sorted(variables.keys()), sorted(options.items()), environment
+        )
+        compiled = load_cached(key)
+    if compiled is None:
+        index: dict[str, tuple[str, ...]] = {}
+        if use_cache:
+            index_key = cache_key("imports", environment)
+            index = load_cached(index_key) or {}
+        index_size = len(index)
+        compiled = compile_program(
+            code, set(variables.keys()), debug, index=index, **options
+        )
+        if use_cache:
+            store_cached(key, compiled)
+            if len(index) != index_size:
+                store_cached(index_key, index)
+    else:
+        LOG.info("Using cached compiled code...")
+    bytecode, source, coroutine, maxsplit = compiled
+
+    if limit == 0:
+        return
+
+    LOG.info("Executing code...")
+    # Files that couldn't be read (see read_files).
+    failed: list[str] = []
+    if files is not None:
+        variables = dict(variables, **{PREFIX + "failed_files": failed})
+    try:
+        if source is not None:
+            if source == PREFIX + "files":
+                # Each file is a task of its own, and worker processes
+                # can't tell us about files they couldn't read.
+                assert files is not None
+                items: Iterator = (
+                    readable_files(files, failed) if jobs > 1 else iter(files)
+                )
+                batch_size = 1
+            elif source == PREFIX + "lines":
+                items = read_lines(
+                    sys.stdin, block_size, decompress, prefetch, skip, grep, fixed
+                )
+            elif source == PREFIX + "records":
+                items = read_records(
+                    sys.stdin, block_size, decompress, prefetch, skip, grep, fixed
+                )
+            else:
+                items = read_parts(
+                    sys.stdin,
+                    block_size,
+                    sep,
+                    dialect,
+                    maxsplit,
+                    decompress,
+                    prefetch,
+                    skip,
+                    grep,
+                    fixed,
+                )
+            if jobs > 1:
+                run_processes(
+                    bytecode,
+                    variables,
+                    source,
+                    items,
+                    jobs,
+                    batch_size=batch_size or DEFAULT_BATCH_SIZE,
+                    ordered=ordered,
+                )
+            else:
+                run_threads(
+                    bytecode,
+                    variables,
+                    source,
+                    items,
+                    threads,
+                    batch_size=batch_size or DEFAULT_THREAD_BATCH_SIZE,
+                    ordered=ordered,
+                )
+            if failed:
+                sys.exit(1)
+            return
+        # Create a clean context, since test cases might leak the default
+        # arg dict across runs.
+        context = dict(**variables)
+        if files is not None:
+            context[PREFIX + "files"] = files
+        # Since we're executing inside of main(), any imports are actually
+        # locals. Providing a globals dict prevents leaking any dev
+        # environment leaks, and is used as a locals, meaning that any
+        # "local" imports end up in the "globals" namespace.
+        # See https://stackoverflow.com/a/12505166
+        if coroutine:
+            import asyncio
+
+            # Top level awaits make the module a coroutine.
+            asyncio.run(eval(bytecode, context))
+        else:
+            try:
+                with OutputSink(
+                    sys.stdout, background=output_thread, binary=binary, limit=limit
+                ) as sink:
+                    context[PREFIX + "emit"] = sink.write
+                    context[PREFIX + "emit_json"] = sink.write_json
+                    context[PREFIX + "emit_pretty"] = sink.write_pretty
+                    context[PREFIX + "emit_bytes"] = sink.write_bytes
+                    context[PREFIX + "emit_raw"] = sink.write_raw
+                    exec(
+                        bytecode,
+                        context,  # Globals
+                        # If not locals dict is given, globals=locals.
+                    )
+            except OutputLimitReached:
+                LOG.info("Output limit reached, stopping...")
+        if failed:
+            sys.exit(1)
+    except BrokenPipeError:
+        # Whatever was reading our output is gone (like `| head`).
+        LOG.info("Output closed, stopping...")
+        discard_stdout()
+        sys.exit(EXIT_BROKEN_PIPE)
+
+
+def discard_stdout() -> None:
+    """Send anything still buffered for stdout nowhere, since Python
+    flushes it on the way out (which would fail all over again)."""
+    try:
+        fd = sys.stdout.fileno()
+    except (AttributeError, OSError, ValueError):
+        return
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, fd)
+    os.close(devnull)
+
+
+def compile_program(
+    code: str,
+    variable_names: set[str],
+    debug: int,
+    pprint_opt: bool,
+    block_size: int,
+    parallel: bool,
+    concurrency: int,
+    lazy_imports: bool,
+    sep: Optional[str],
+    dialect: Optional[str],
+    column_batch_size: int,
+    combine: Optional[str],
+    begin: Optional[str],
+    end: Optional[str],
+    binary: bool,
+    decompress: bool,
+    files: bool,
+    prefetch: bool,
+    skip: int,
+    limited: bool,
+    grep: Optional[str],
+    fixed: bool,
+    optimize: bool,
+    index: Optional[dict[str, tuple[str, ...]]] = None,
+) -> tuple[CodeType, Optional[str], bool, int]:
+    """Compile a program, returning the code, the name of the variable
+    to bind to batches of items if the program should run in parallel
+    (see per_item_source, or the files with file operands), whether the
+    code is a coroutine, and how many times to split lines into parts
+    (see parts_maxsplit).
+
+    The index remembers which modules exist, see resolve_import."""
+    # Compiling is skipped entirely when the code is cached, so only
+    # pay for importing the compiler machinery here.
+    import ast
+    import inspect
+    from pyli.optimize import hoist_invariants, localize_loops
+    from pyli.preamble import create_imports
+    from pyli.refs import (
+        find_free_references,
+        find_references,
+        find_top_level_await,
+    )
+    from pyli.spec import (
+        SPEC_COLUMNS,
+        SPEC_LINE_GEN,
+        SPEC_LINENO,
+        SPEC_PARTS_GEN,
+        SPEC_PER_LINE,
+        SPEC_PER_PART,
+        SPEC_PER_RECORD,
+        handle_file_variables,
+        handle_special_variables,
+        parts_maxsplit,
+        per_item_source,
+    )
+    from pyli.util import var_base_difference, var_base_intersection
+
     # Parse the code.
     tree = ast.parse(code)
     LOG.debug("Initial parse tree...")
-    LOG.debug(ast.dump(tree, indent=4))
+    if LOG.isEnabledFor(logging.DEBUG):
+        LOG.debug(ast.dump(tree, indent=4))
+
+    # BEGIN and END blocks run before and after the program, and share
+    # its state.
+    begin_body = ast.parse(begin).body if begin else []
+    end_body = ast.parse(end).body if end else []
+    # Look at everything together, so that say a counter set up in
+    # BEGIN isn't taken for a module.
+    whole = ast.Module(body=begin_body + tree.body + end_body, type_ignores=[])
+    # Names set up by BEGIN or read by END are shared with the program.
+    shared, _ = find_references(ast.Module(body=begin_body, type_ignores=[]))
+    end_bound, end_refs = find_references(ast.Module(body=end_body, type_ignores=[]))
+    shared |= end_bound | {ref[0] for ref in end_refs}
 
     # Find the free variables.
-    free_vars = find_free_references(tree)
+    free_vars = find_free_references(whole)
     LOG.debug("Free variables found: {}".format(free_vars))
+    # We will pass in command line variables via exec, and they win
+    # over special variables of the same name.
+    free_vars = var_base_difference(free_vars, variable_names)
     if pprint_opt:
         free_vars.add(("pprint",))
 
+    # The combine step of columnar programs sees the batch `results`.
+    combine_tree = None
+    if combine is not None:
+        if not var_base_intersection(free_vars, SPEC_COLUMNS):
+            LOG.warning("Only columnar programs (using cols) can be combined")
+        else:
+            combine_tree = ast.parse(combine)
+            combine_vars = find_free_references(combine_tree)
+            free_vars |= var_base_difference(combine_vars, {"results"} | variable_names)
+
     if debug != logging.ERROR and var_base_intersection(free_vars, {"stderr"}):
         LOG.error("Conflictng use of debug logging and writing to stderr.")
         sys.exit(2)
 
+    # Per-line programs that await run concurrently on an event loop instead.
+    awaits = find_top_level_await(tree)
+    any_awaits = find_top_level_await(whole)
+    if any_awaits and parallel:
+        LOG.error("Conflicting use of await and parallel execution.")
+        sys.exit(2)
+    if any_awaits and binary:
+        LOG.error("Conflicting use of await and binary mode.")
+        sys.exit(2)
+    if any_awaits and limited:
+        LOG.error("Conflicting use of await and --limit.")
+        sys.exit(2)
+    if parallel and binary:
+        LOG.warning("Binary mode can't run in parallel, running serially")
+        parallel = False
+    if parallel and (begin_body or end_body):
+        LOG.warning("BEGIN/END blocks can't share state in parallel, running serially")
+        parallel = False
+    # Per-line programs can be run over batches of lines in parallel,
+    # in which case we read stdin ourselves. With file operands, any
+    # program can run on each file in parallel instead.
+    source = per_item_source(free_vars) if parallel else None
+    if parallel and files:
+        source = PREFIX + "files"
+    elif parallel and source is None:
+        LOG.warning("Only per-line programs can run in parallel, running serially")
+    elif source is not None and var_base_intersection(free_vars, SPEC_LINENO):
+        LOG.warning("Line numbers can't be counted across batches, running serially")
+        source = None
+    # Results are batched up in an output sink, unless they need to be
+    # captured per batch/task.
+    emit = source is None and not any_awaits
+
+    line_based = (
+        SPEC_PER_LINE
+        | SPEC_LINE_GEN
+        | SPEC_PER_PART
+        | SPEC_PARTS_GEN
+        | SPEC_COLUMNS
+        | SPEC_PER_RECORD
+    )
+    if (skip or grep is not None) and not var_base_intersection(free_vars, line_based):
+        LOG.warning("Only programs that read lines can skip or filter them")
+    if grep is not None and var_base_intersection(free_vars, SPEC_LINENO):
+        LOG.error("Conflicting use of --grep and line numbers.")
+        sys.exit(2)
+    per_item = SPEC_PER_LINE | SPEC_PER_PART | SPEC_PER_RECORD
+    if var_base_intersection(free_vars, SPEC_LINENO) and not var_base_intersection(
+        free_vars, per_item
+    ):
+        # Otherwise n/lineno would be taken for a module.
+        LOG.error("Only per-line, per-part and per-record programs have line numbers.")
+        sys.exit(2)
+
+    # Programs that only look at the first few parts don't need to
+    # split the rest of the line.
+    maxsplit = parts_maxsplit(whole, free_vars)
+
     # Handle any special variables and output on a case-by-case basis.
-    free_vars = handle_special_variables(tree, free_vars, pprint_opt)
-    # We will pass in command line variables via exec.
-    free_vars = var_base_difference(free_vars, {k for k in variables.keys()})
+    free_vars = handle_special_variables(
+        tree,
+        free_vars,
+        pprint_opt,
+        block_size=block_size,
+        read_stdin=source is None or files,
+        concurrency=concurrency if awaits else None,
+        emit=emit,
+        sep=sep,
+        dialect=dialect,
+        maxsplit=maxsplit,
+        column_batch_size=column_batch_size,
+        combine=combine_tree.body if combine_tree is not None else None,
+        end=end_body,
+        shared=shared,
+        binary=binary,
+        decompress=decompress,
+        prefetch=prefetch,
+        skip=skip,
+        grep=grep,
+        fixed=fixed,
+    )
+    free_vars = handle_file_variables(tree, free_vars, files)
+    tree.body = begin_body + tree.body + end_body
+    if optimize:
+        hoist_invariants(tree, variable_names)
+
+    if optimize:
+        # Lazy imports only bind proxies, which replace themselves.
+        module_names = set() if lazy_imports else {var[0] for var in free_vars}
+        localize_loops(tree, variable_names, module_names)
 
     # Add imports for the rest of the free variables.
-    create_imports(tree, free_vars)
+    create_imports(tree, free_vars, lazy=lazy_imports, index=index)
 
-    # Compile and execute the code.
+    # Compile the code.
     ast.fix_missing_locations(tree)
     LOG.debug("Final parse tree...")
-    LOG.debug(ast.dump(tree, indent=4))
-    LOG.info("Compiling and executing code...")
+    if LOG.isEnabledFor(logging.DEBUG):
+        LOG.debug(ast.dump(tree, indent=4))
+    LOG.info("Compiling code...")
     bytecode = compile(
         tree,
         "<generated code>",  # "filename", used in tracebacks
         "exec",  # Mode, multiple statements (instead of expr)
+        # Allow awaiting outside of the per-line task, like `for l in
+        # lines: await ...`.
+        flags=ast.PyCF_ALLOW_TOP_LEVEL_AWAIT if any_awaits else 0,
     )
-    # Create a clean context, since test cases might leak the default
-    # arg dict across runs.
-    context = dict(**variables)
-    # Since we're executing inside of main(), any imports are actually
-    # locals. Providing a globals dict prevents leaking any dev
-    # environment leaks, and is used as a locals, meaning that any
-    # "local" imports end up in the "globals" namespace.
-    # See https://stackoverflow.com/a/12505166
-    exec(
-        bytecode,
-        context,  # Globals
-        # If not locals dict is given, globals=locals.
-    )
+    # Top level awaits make the module a coroutine.
+    coroutine = bool(bytecode.co_flags & inspect.CO_COROUTINE)
+    return bytecode, source, coroutine, maxsplit
@@ -0,0 +1,601 @@
+#  Copyright (c) <2014> <thenoviceoof>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+#  THE SOFTWARE.
+
+# Optimizations of the generated per-item loops.
+#
+# Loop-invariant hoisting:
+#
+# The body of a per-line program runs once per line, so anything in it
+# that comes out the same every time (compiling a regex, turning a
+# command line variable into a number) is worth working out once,
+# before the loop. Only calls to a short list of pure functions, over
+# constants and command line variables that are never assigned, are
+# hoisted: anything else might change from one line to the next, or
+# have side effects.
+#
+# Hoisting mustn't change what happens when the expression fails, or
+# is never reached (say, in an `if` that never fires), so the value is
+# worked out in a try, as a 1-tuple (or an empty one if that failed),
+# and the loop falls back to the original expression without it.
+#
+# Local variables:
+#
+# Generated code runs as a module, where every name is a dict lookup
+# (LOAD_NAME/STORE_NAME). Wrapping a loop in a function makes the names
+# it assigns fast locals instead, except for the ones used outside of
+# the loop (like counters set up by --begin, or read by --end), which
+# are declared global. Builtins, modules and command line variables that
+# are never assigned are passed in as default arguments, so they are
+# locals too.
+
+import ast
+import builtins
+import copy
+import logging
+import sys
+from typing import Optional
+from pyli.util import PREFIX
+
+LOG = logging.getLogger(__name__)
+
+# Builtins without side effects, which return immutable values given
+# immutable arguments, no bigger than those arguments. (Not bytes, as
+# bytes(n) allocates n bytes.)
+PURE_BUILTINS = {
+    "abs",
+    "bin",
+    "bool",
+    "chr",
+    "complex",
+    "divmod",
+    "float",
+    "frozenset",
+    "hex",
+    "int",
+    "len",
+    "max",
+    "min",
+    "oct",
+    "ord",
+    "round",
+    "str",
+    "tuple",
+}
+PURE_REGEX_FUNCTIONS = {"compile", "escape"}
+# re functions which compiled patterns have as methods, with how many
+# positional arguments they take after the pattern (before the flags).
+REGEX_METHODS = {
+    "search": 1,
+    "match": 1,
+    "fullmatch": 1,
+    "findall": 1,
+    "finditer": 1,
+    "split": 2,
+    "sub": 3,
+    "subn": 3,
+}
+# Programs using any of these could change anything behind our back.
+DYNAMIC_NAMES = {"eval", "exec", "globals", "locals", "vars", "builtins"}
+# Operators whose result can be arbitrarily bigger than their operands.
+UNBOUNDED_OPERATORS = (ast.Mult, ast.MatMult, ast.Pow, ast.LShift)
+# Statements that can't be moved into a (plain) function.
+FUNCTION_ONLY = (
+    ast.Await,
+    ast.AsyncFor,
+    ast.AsyncWith,
+    ast.Yield,
+    ast.YieldFrom,
+    ast.Return,
+)
+
+
+def hoist_invariants(tree: ast.Module, variable_names: set[str]) -> int:
+    """Hoist loop invariants out of the generated per-item loops, and
+    return how many were hoisted."""
+    assigned = find_assigned_names(tree)
+    if DYNAMIC_NAMES & {
+        node.id for node in ast.walk(tree) if isinstance(node, ast.Name)
+    }:
+        LOG.info("Not hoisting anything out of a program that uses eval() and co")
+        return 0
+    # Command line variables shadow builtins.
+    invariant_names = (
+        variable_names | ((PURE_BUILTINS | {"re"}) - variable_names)
+    ) - assigned
+    hoister = Hoister(invariant_names, variable_names)
+    for node in list(ast.walk(tree)):
+        for field in ("body", "orelse", "finalbody"):
+            stmts = getattr(node, field, None)
+            if not isinstance(stmts, list):
+                continue
+            hoisted: list[ast.stmt] = []
+            for stmt in stmts:
+                if is_item_loop(stmt):
+                    assert isinstance(stmt, ast.For)
+                    hoister.start_loop()
+                    stmt.body = [hoister.visit(s) for s in stmt.body]
+                    for hoisted_stmt in hoister.statements:
+                        hoisted.append(ast.copy_location(hoisted_stmt, stmt))
+                hoisted.append(stmt)
+            stmts[:] = hoisted
+    LOG.info("Hoisted {} loop invariants".format(hoister.count))
+    return hoister.count
+
+
+def is_item_loop(stmt: ast.stmt) -> bool:
+    """Check whether a statement is a per-item loop of generated code
+    (see pyli.spec.create_item_loop)."""
+    return (
+        isinstance(stmt, ast.For)
+        and isinstance(stmt.target, ast.Name)
+        and stmt.target.id.startswith(PREFIX)
+        and isinstance(stmt.iter, ast.Name)
+        and stmt.iter.id.startswith(PREFIX)
+    )
+
+
+def find_assigned_names(tree: ast.AST) -> set[str]:
+    """Find every name that is (or might be) assigned anywhere, in any
+    scope, including modules that have attributes assigned."""
+    names = set()
+    for node in ast.walk(tree):
+        names |= assigned_names(node)
+    return names
+
+
+def assigned_names(node: ast.AST) -> set[str]:
+    """Find the names a node (but not its children) assigns."""
+    names = set()
+    if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+        names.add(node.id)
+    elif isinstance(node, ast.Attribute) and not isinstance(node.ctx, ast.Load):
+        base = node.value
+        while isinstance(base, ast.Attribute):
+            base = base.value
+        if isinstance(base, ast.Name):
+            names.add(base.id)
+    elif (
+        isinstance(node, ast.FunctionDef)
+        or isinstance(node, ast.AsyncFunctionDef)
+        or isinstance(node, ast.ClassDef)
+    ):
+        names.add(node.name)
+    elif isinstance(node, ast.alias):
+        names.add(node.asname or node.name.split(".")[0])
+    elif isinstance(node, ast.Global) or isinstance(node, ast.Nonlocal):
+        names.update(node.names)
+    elif isinstance(node, ast.ExceptHandler) and node.name:
+        names.add(node.name)
+    elif isinstance(node, ast.arg):
+        names.add(node.arg)
+    elif sys.version_info >= (3, 10, 0) and (
+        isinstance(node, ast.MatchAs)  # type: ignore
+        or isinstance(node, ast.MatchStar)  # type: ignore
+        or isinstance(node, ast.MatchMapping)  # type: ignore
+    ):
+        name = getattr(node, "name", None) or getattr(node, "rest", None)
+        if name:
+            names.add(name)
+    return names
+
+
+class Hoister(ast.NodeTransformer):
+    """Replace the invariant expressions in a loop body with references
+    to values worked out before the loop (in statements)."""
+
+    def __init__(self, invariant_names: set[str], variable_names: set[str]):
+        self.invariant_names = invariant_names
+        self.variable_names = variable_names
+        # Whether re is the (never assigned) module.
+        self.regex_invariant = "re" in invariant_names - variable_names
+        self.count = 0
+        self.start_loop()
+
+    def start_loop(self) -> None:
+        self.statements: list[ast.stmt] = []
+        # Reuse the value of an expression that shows up again.
+        self.hoisted: dict[str, str] = {}
+
+    # New scopes can rebind anything, so leave them alone, except
+    # for the first iterable of a comprehension, which is evaluated
+    # outside of it.
+    def visit_FunctionDef(self, node: ast.FunctionDef) -> ast.AST:
+        return node
+
+    def visit_AsyncFunctionDef(self, node: ast.AsyncFunctionDef) -> ast.AST:
+        return node
+
+    def visit_ClassDef(self, node: ast.ClassDef) -> ast.AST:
+        return node
+
+    def visit_Lambda(self, node: ast.Lambda) -> ast.AST:
+        return node
+
+    def visit_comprehension_node(self, node: ast.AST) -> ast.AST:
+        generators = getattr(node, "generators")
+        generators[0].iter = self.visit(generators[0].iter)
+        return node
+
+    visit_ListComp = visit_comprehension_node
+    visit_SetComp = visit_comprehension_node
+    visit_DictComp = visit_comprehension_node
+    visit_GeneratorExp = visit_comprehension_node
+
+    def visit_Call(self, node: ast.Call) -> ast.AST:
+        if self.is_invariant(node):
+            return self.hoist(node, node)
+        pattern = self.regex_pattern(node)
+        if pattern is not None:
+            return self.hoist_regex(node, pattern)
+        return self.generic_visit(node)
+
+    def generic_visit(self, node: ast.AST) -> ast.AST:
+        # Nested loops are seen twice, leave what was already hoisted.
+        if is_hoisted(node):
+            return node
+        # Hoist the biggest invariant expressions, so that say
+        # `int(x) + 2` is only worked out once.
+        if isinstance(node, ast.expr) and not isinstance(node, ast.Call):
+            if self.is_invariant(node) and contains_call(node):
+                return self.hoist(node, node)
+        return super().generic_visit(node)
+
+    def is_invariant(self, node: ast.AST) -> bool:
+        """Check whether an expression always has the same (immutable)
+        value, without side effects."""
+        if isinstance(node, ast.Constant):
+            return True
+        elif isinstance(node, ast.Name):
+            return isinstance(node.ctx, ast.Load) and node.id in self.invariant_names
+        elif isinstance(node, ast.Attribute):
+            # Only module constants, like re.IGNORECASE.
+            return (
+                isinstance(node.value, ast.Name)
+                and node.value.id == "re"
+                and self.regex_invariant
+                and node.attr.isupper()
+            )
+        elif isinstance(node, ast.Tuple):
+            return all(self.is_invariant(elt) for elt in node.elts)
+        elif isinstance(node, ast.BinOp):
+            # Working these out early could build something huge (say
+            # "x" * int(n)) that the loop never asks for.
+            if isinstance(node.op, UNBOUNDED_OPERATORS):
+                return False
+            return self.is_invariant(node.left) and self.is_invariant(node.right)
+        elif isinstance(node, ast.UnaryOp):
+            return self.is_invariant(node.operand)
+        elif isinstance(node, ast.BoolOp):
+            return all(self.is_invariant(value) for value in node.values)
+        elif isinstance(node, ast.Compare):
+            return self.is_invariant(node.left) and all(
+                self.is_invariant(c) for c in node.comparators
+            )
+        elif isinstance(node, ast.IfExp):
+            return (
+                self.is_invariant(node.test)
+                and self.is_invariant(node.body)
+                and self.is_invariant(node.orelse)
+            )
+        elif isinstance(node, ast.Subscript):
+            return self.is_invariant(node.value) and self.is_invariant(node.slice)
+        elif isinstance(node, ast.Slice):
+            return all(
+                part is None or self.is_invariant(part)
+                for part in (node.lower, node.upper, node.step)
+            )
+        elif isinstance(node, ast.JoinedStr):
+            return all(self.is_invariant(value) for value in node.values)
+        elif isinstance(node, ast.FormattedValue):
+            return self.is_invariant(node.value) and (
+                node.format_spec is None or self.is_invariant(node.format_spec)
+            )
+        elif isinstance(node, ast.Call):
+            return self.is_pure_function(node.func) and self.has_invariant_arguments(
+                node
+            )
+        return False
+
+    def is_pure_function(self, func: ast.expr) -> bool:
+        if isinstance(func, ast.Name):
+            return (
+                func.id in PURE_BUILTINS
+                and func.id in self.invariant_names
+                and func.id not in self.variable_names
+            )
+        return (
+            isinstance(func, ast.Attribute)
+            and isinstance(func.value, ast.Name)
+            and func.value.id == "re"
+            and self.regex_invariant
+            and func.attr in PURE_REGEX_FUNCTIONS
+        )
+
+    def has_invariant_arguments(self, node: ast.Call) -> bool:
+        return all(
+            not isinstance(arg, ast.Starred) and self.is_invariant(arg)
+            for arg in node.args
+        ) and all(
+            keyword.arg is not None and self.is_invariant(keyword.value)
+            for keyword in node.keywords
+        )
+
+    def regex_pattern(self, node: ast.Call) -> Optional[ast.Call]:
+        """If the call is like `re.search(pattern, line)`, with an
+        invariant pattern (and flags), return the call compiling it."""
+        func = node.func
+        if not (
+            isinstance(func, ast.Attribute)
+            and isinstance(func.value, ast.Name)
+            and func.value.id == "re"
+            and self.regex_invariant
+            and func.attr in REGEX_METHODS
+        ):
+            return None
+        args = node.args
+        if not args or any(isinstance(arg, ast.Starred) for arg in args):
+            return None
+        # Positional flags would be taken for a position.
+        if len(args) - 1 > REGEX_METHODS[func.attr]:
+            return None
+        if not self.is_invariant(args[0]):
+            return None
+        flags = []
+        for keyword in node.keywords:
+            if keyword.arg is None or keyword.arg == "pattern":
+                return None
+            if keyword.arg == "flags":
+                if not self.is_invariant(keyword.value):
+                    return None
+                flags.append(keyword.value)
+        return ast.Call(
+            func=ast.Attribute(
+                value=ast.Name(id="re", ctx=ast.Load()), attr="compile", ctx=ast.Load()
+            ),
+            args=[args[0]] + flags,
+            keywords=[],
+        )
+
+    def hoist(self, node: ast.expr, fallback: ast.expr) -> ast.expr:
+        """Work out the value of node before the loop, and return an
+        expression using it (or fallback, if that failed)."""
+        key = ast.dump(node)
+        name = self.hoisted.get(key)
+        if name is None:
+            name = "{}hoisted_{}".format(PREFIX, self.count)
+            self.count += 1
+            self.hoisted[key] = name
+            self.statements.append(create_guarded_assignment(name, node))
+        value = ast.Subscript(
+            value=ast.Name(id=name, ctx=ast.Load()),
+            slice=ast.Constant(value=0),
+            ctx=ast.Load(),
+        )
+        return self.with_fallback(name, value, fallback)
+
+    def hoist_regex(self, node: ast.Call, pattern: ast.Call) -> ast.expr:
+        """Call the method of a pattern compiled before the loop, instead
+        of the re function which compiles (or looks up) it each time."""
+        assert isinstance(node.func, ast.Attribute)
+        fallback = copy.deepcopy(node)
+        compiled = self.hoist(pattern, pattern)
+        assert isinstance(compiled, ast.IfExp)
+        method_call = ast.Call(
+            func=ast.Attribute(
+                value=compiled.body, attr=node.func.attr, ctx=ast.Load()
+            ),
+            args=[self.visit(arg) for arg in node.args[1:]],
+            keywords=[
+                ast.keyword(arg=keyword.arg, value=self.visit(keyword.value))
+                for keyword in node.keywords
+                if keyword.arg != "flags"
+            ],
+        )
+        test = compiled.test
+        return ast.copy_location(
+            ast.IfExp(test=test, body=method_call, orelse=fallback), node
+        )
+
+    def with_fallback(self, name: str, value: ast.expr, fallback: ast.expr) -> ast.expr:
+        return ast.copy_location(
+            ast.IfExp(
+                test=ast.Name(id=name, ctx=ast.Load()),
+                body=value,
+                orelse=copy.deepcopy(fallback),
+            ),
+            fallback,
+        )
+
+
+def is_hoisted(node: ast.AST) -> bool:
+    return (
+        isinstance(node, ast.IfExp)
+        and isinstance(node.test, ast.Name)
+        and node.test.id.startswith(PREFIX + "hoisted_")
+    )
+
+
+def contains_call(node: ast.AST) -> bool:
+    return any(isinstance(child, ast.Call) for child in ast.walk(node))
+
+
+def strip_location(node: ast.AST) -> None:
+    for attribute in ("lineno", "col_offset", "end_lineno", "end_col_offset"):
+        if attribute in node.__dict__:
+            delattr(node, attribute)
+
+
+def create_guarded_assignment(name: str, node: ast.expr) -> ast.stmt:
+    """Create `name = (node,)`, or `name = ()` if that fails."""
+    code = """
+try:
+    {name} = (None,)
+except Exception:
+    {name} = ()
+    """.format(name=name)
+    try_node = ast.parse(code).body[0]
+    assert isinstance(try_node, ast.Try)
+    # Take the location of the loop instead (see hoist_invariants).
+    for template_node in ast.walk(try_node):
+        strip_location(template_node)
+    assign = try_node.body[0]
+    assert isinstance(assign, ast.Assign)
+    assign.value = ast.Tuple(elts=[copy.deepcopy(node)], ctx=ast.Load())
+    return try_node
+
+
+def localize_loops(
+    tree: ast.Module, variable_names: set[str], module_names: set[str]
+) -> int:
+    """Wrap the generated per-item loops (outside of any function) in
+    functions, so that the names they use become locals, and return how
+    many were wrapped. Modules are the names the imports will bind."""
+    names = {node.id for node in ast.walk(tree) if isinstance(node, ast.Name)}
+    if names & (DYNAMIC_NAMES | {"dir"}) or any(
+        isinstance(node, ast.Global) or isinstance(node, ast.Nonlocal)
+        for node in ast.walk(tree)
+    ):
+        LOG.info("Not making locals of a program that uses global or eval() and co")
+        return 0
+    localizer = Localizer(tree, variable_names, module_names)
+    localizer.visit_statements(tree.body)
+    LOG.info("Wrapped {} loops in functions".format(localizer.count))
+    return localizer.count
+
+
+class Localizer:
+    """Replace the per-item loops of a module with calls to functions
+    running them."""
+
+    def __init__(
+        self, tree: ast.Module, variable_names: set[str], module_names: set[str]
+    ):
+        self.tree = tree
+        self.variable_names = variable_names
+        self.module_names = module_names
+        self.assigned = find_assigned_names(tree)
+        self.count = 0
+
+    def visit_statements(self, stmts: list[ast.stmt]) -> None:
+        for stmt in list(stmts):
+            if is_item_loop(stmt) and can_move_to_function(stmt):
+                assert isinstance(stmt, ast.For)
+                position = stmts.index(stmt)
+                stmts[position : position + 1] = self.wrap(stmt)
+                continue
+            # Loops in functions already have locals.
+            if (
+                isinstance(stmt, ast.FunctionDef)
+                or isinstance(stmt, ast.AsyncFunctionDef)
+                or isinstance(stmt, ast.ClassDef)
+            ):
+                continue
+            for field in ("body", "orelse", "finalbody"):
+                nested = getattr(stmt, field, None)
+                if isinstance(nested, list):
+                    self.visit_statements(nested)
+            for handler in getattr(stmt, "handlers", []):
+                self.visit_statements(handler.body)
+
+    def wrap(self, loop: ast.For) -> list[ast.stmt]:
+        """Create a function running the loop, and a call to it."""
+        outside = find_names_outside(self.tree, loop)
+        inside = {node.id for node in ast.walk(loop) if isinstance(node, ast.Name)}
+        assigned_inside = find_assigned_names(loop)
+        # Assigning the names used anywhere else has to stay global, as
+        # does assigning a name that's otherwise a builtin or module
+        # (which a local would hide, even before being assigned).
+        shared = assigned_inside & (
+            outside | self.variable_names | self.module_names | set(dir(builtins))
+        )
+        # Names that always have the same value can be bound up front,
+        # as long as they aren't assigned anywhere.
+        constant = (
+            (self.variable_names | self.module_names | set(dir(builtins)))
+            - self.assigned
+            - shared
+        )
+        # And so can the callbacks from the context (see main), and the
+        # values hoisted out of the loop (see hoist_invariants).
+        for name in inside:
+            if name.startswith(PREFIX + "hoisted_"):
+                if name not in assigned_inside:
+                    constant.add(name)
+            elif name.startswith(PREFIX) and name not in self.assigned:
+                constant.add(name)
+        bound = sorted(
+            name
+            for name in inside & constant
+            if not (name.startswith("__") and name.endswith("__"))
+        )
+        name = "{}loop_{}".format(PREFIX, self.count)
+        self.count += 1
+        code = """
+def {name}():
+    pass
+{name}()
+        """.format(name=name)
+        nodes = ast.parse(code).body
+        # Take the location of the loop instead.
+        for node in nodes:
+            for template_node in ast.walk(node):
+                strip_location(template_node)
+            ast.copy_location(node, loop)
+        function = nodes[0]
+        assert isinstance(function, ast.FunctionDef)
+        function.args.args = [ast.arg(arg=arg) for arg in bound]
+        function.args.defaults = [ast.Name(id=arg, ctx=ast.Load()) for arg in bound]
+        function.body = [loop]
+        if shared:
+            function.body.insert(0, ast.Global(names=sorted(shared)))
+        return nodes
+
+
+def can_move_to_function(loop: ast.stmt) -> bool:
+    """Check whether the loop does anything that would mean something
+    else in a function (like awaiting, outside of a coroutine)."""
+    pending: list[ast.AST] = [loop]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, FUNCTION_ONLY):
+            return False
+        if (
+            isinstance(node, ast.FunctionDef)
+            or isinstance(node, ast.AsyncFunctionDef)
+            or isinstance(node, ast.Lambda)
+        ):
+            continue
+        pending.extend(ast.iter_child_nodes(node))
+    return True
+
+
+def find_names_outside(tree: ast.AST, loop: ast.stmt) -> set[str]:
+    """Find the names used or assigned anywhere but in the loop."""
+    names = set()
+    pending: list[ast.AST] = [tree]
+    while pending:
+        node = pending.pop()
+        if node is loop:
+            continue
+        if isinstance(node, ast.Name):
+            names.add(node.id)
+        pending.extend(ast.iter_child_nodes(node))
+        names |= assigned_names(node)
+    return names
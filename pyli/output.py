@@ -0,0 +1,344 @@
+#  Copyright (c) <2014> <thenoviceoof>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+#  THE SOFTWARE.
+
+# Output sink for the automatically printed results.
+#
+# Calling print() once per result pays for argument handling and two
+# trips through the text layer every time. Instead, the generated code
+# appends results to a sink, which joins, encodes and writes them to
+# the underlying binary buffer in large batches.
+#
+# To keep output in order when the program writes to stdout itself
+# (print(), sys.stdout.write(), ...), sys.stdout is replaced with a
+# proxy that flushes the sink before passing any writes through (and
+# so does its buffer).
+#
+# With a limit, the sink stops the program once enough results have
+# been written, by raising OutputLimitReached out of the generated
+# code (so no more input is read). Lines the program writes to stdout
+# itself count towards the limit too.
+
+import queue
+import sys
+import threading
+from typing import Any, Callable, Optional, Union
+
+DEFAULT_OUTPUT_BATCH_SIZE = 4096
+
+
+class OutputLimitReached(BaseException):
+    """Raised once the sink has written as many results as its limit.
+
+    Like SystemExit, this isn't an Exception, so that it isn't caught
+    by the program itself.
+    """
+
+
+class OutputSink:
+    """Collect results, and write them to a text stream in batches.
+
+    Use as a context manager, which installs the sys.stdout proxy, and
+    makes sure everything is written on the way out (even if there was
+    an exception). Optionally, the encoding and writing can happen on a
+    background thread. In binary mode, bytes results can be written as
+    they are, instead of their repr(). Given a limit, OutputLimitReached
+    is raised once that many results have been written.
+    """
+
+    def __init__(
+        self,
+        stream: Any,
+        batch_size: int = DEFAULT_OUTPUT_BATCH_SIZE,
+        background: bool = False,
+        binary: bool = False,
+        limit: Optional[int] = None,
+    ):
+        self._stream = stream
+        self._buffer = getattr(stream, "buffer", None)
+        self._encoding = getattr(stream, "encoding", None) or "utf-8"
+        self._errors = getattr(stream, "errors", None) or "strict"
+        # Text results, or bytes (with their own newlines) in binary mode.
+        self._pending: list[Union[str, bytes]] = []
+        self._binary = binary
+        # Someone is probably watching an interactive stream, so don't
+        # hold anything back.
+        interactive = getattr(stream, "line_buffering", False) or (
+            hasattr(stream, "isatty") and stream.isatty()
+        )
+        self._batch_size = 1 if interactive else batch_size
+        # Results left to write, if there's a limit. Batches are cut
+        # short so that the last one is flushed as soon as it's full.
+        self._remaining = limit
+        if limit is not None:
+            self._batch_size = max(1, min(self._batch_size, limit))
+        self._queue: Optional[queue.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+        self._error: Optional[BaseException] = None
+        self._encode_json: Optional[Callable[[Any], str]] = None
+        if background:
+            # Keep the queue short, so a slow reader pushes back on us.
+            self._queue = queue.Queue(maxsize=4)
+            self._thread = threading.Thread(target=self._write_queued, daemon=True)
+            self._thread.start()
+
+    def write(self, value: Any) -> None:
+        """Print a result (followed by a newline)."""
+        self._pending.append(str(value))
+        if len(self._pending) >= self._batch_size:
+            self.flush()
+
+    def write_json(self, value: Any) -> None:
+        """Print a result, as compact JSON if it's a dict or a list."""
+        if isinstance(value, dict) or isinstance(value, list):
+            # Only pay for importing json when it's used.
+            if self._encode_json is None:
+                self._encode_json = json_encoder()
+            value = self._encode_json(value)
+        self._pending.append(str(value))
+        if len(self._pending) >= self._batch_size:
+            self.flush()
+
+    def write_pretty(self, value: Any) -> None:
+        """Print a result the way pprint.pprint() would."""
+        import pprint
+
+        self.write(pprint.pformat(value))
+
+    def write_bytes(self, value: Any) -> None:
+        """Print a result followed by a newline, writing bytes as they
+        are (in binary mode)."""
+        if isinstance(value, bytes) or isinstance(value, bytearray):
+            self._pending.append(bytes(value) + b"\n")
+            if len(self._pending) >= self._batch_size:
+                self.flush()
+        else:
+            self.write(value)
+
+    def write_raw(self, value: Any) -> None:
+        """Print a result, writing bytes as they are without a newline
+        (in binary mode)."""
+        if isinstance(value, bytes) or isinstance(value, bytearray):
+            self._pending.append(bytes(value))
+            if len(self._pending) >= self._batch_size:
+                self.flush()
+        else:
+            self.write(value)
+
+    def flush(self) -> None:
+        """Hand off any pending results to be written."""
+        if self._pending:
+            data: Union[str, bytes]
+            if self._binary:
+                data = b"".join(
+                    (
+                        item
+                        if isinstance(item, bytes)
+                        else (item + "\n").encode(self._encoding, self._errors)
+                    )
+                    for item in self._pending
+                )
+            else:
+                data = "\n".join(self._pending) + "\n"  # type: ignore
+            written = len(self._pending)
+            self._pending = []
+            if self._queue is None:
+                self._write(data)
+            else:
+                self._check_error()
+                self._queue.put(data)
+            if self._remaining is not None:
+                self._remaining -= written
+                if self._remaining <= 0:
+                    raise OutputLimitReached()
+                self._batch_size = min(self._batch_size, self._remaining)
+
+    def take_lines(self, data: Any) -> Any:
+        """Count the lines the program writes to stdout itself (text or
+        bytes) against the limit, returning as much as fits under it."""
+        if self._remaining is None:
+            return data
+        if not isinstance(data, str):
+            data = bytes(data)
+        newline = "\n" if isinstance(data, str) else b"\n"
+        count = data.count(newline)
+        if count < self._remaining:
+            self._remaining -= count
+            self._batch_size = max(1, min(self._batch_size, self._remaining))
+            return data
+        end = -1
+        for _ in range(self._remaining):
+            end = data.find(newline, end + 1)
+        self._remaining = 0
+        return data[: end + 1]
+
+    def check_limit(self) -> None:
+        """Stop the program, if the limit was reached (see take_lines)."""
+        if self._remaining is not None and self._remaining <= 0:
+            raise OutputLimitReached()
+
+    def sync(self) -> None:
+        """Write out everything, including anything on the background
+        thread."""
+        self.flush()
+        if self._queue is not None:
+            self._queue.join()
+            self._check_error()
+
+    def close(self) -> None:
+        try:
+            self.sync()
+        finally:
+            if self._thread is not None:
+                assert self._queue is not None
+                self._queue.put(None)
+                self._thread.join()
+                self._thread = None
+        self._stream.flush()
+
+    def _write(self, data: Union[str, bytes]) -> None:
+        if self._buffer is None:
+            # Something like io.StringIO, which can only take text.
+            if isinstance(data, bytes):
+                data = data.decode(self._encoding, self._errors)
+            self._stream.write(data)
+            return
+        # Anything still in the text layer was written first.
+        self._stream.flush()
+        if isinstance(data, str):
+            data = data.encode(self._encoding, self._errors)
+        self._buffer.write(data)
+
+    def _write_queued(self) -> None:
+        assert self._queue is not None
+        while True:
+            text = self._queue.get()
+            try:
+                if text is None:
+                    return
+                # Once writing fails, drop everything else.
+                if self._error is None:
+                    self._write(text)
+            except BaseException as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _check_error(self) -> None:
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def __enter__(self) -> "OutputSink":
+        self._stdout = sys.stdout
+        sys.stdout = SinkStdout(self, self._stdout)  # type: ignore
+        return self
+
+    def __exit__(self, type, value, traceback) -> None:
+        sys.stdout = self._stdout
+        self.close()
+
+
+def json_encoder() -> Callable[[Any], str]:
+    """Return a function encoding values as compact JSON, with orjson
+    if it's installed."""
+    try:
+        import orjson  # type: ignore
+    except ImportError:
+        import json
+
+        return json.JSONEncoder(separators=(",", ":"), ensure_ascii=False).encode
+    dumps = orjson.dumps
+    return lambda value: dumps(value).decode()
+
+
+def json_printer(printer: Callable[[Any], Any]) -> Callable[[Any], None]:
+    """Wrap a print function to print dicts and lists as compact JSON,
+    like OutputSink.write_json."""
+    encode = json_encoder()
+
+    def print_json(value: Any) -> None:
+        if isinstance(value, dict) or isinstance(value, list):
+            value = encode(value)
+        printer(value)
+
+    return print_json
+
+
+class SinkStdout:
+    """Stand-in for sys.stdout, which writes out any results in the
+    sink before writing anything else."""
+
+    def __init__(self, sink: OutputSink, stream: Any):
+        self._sink = sink
+        self._stream = stream
+
+    def write(self, text: str) -> int:
+        self._sink.sync()
+        self._stream.write(self._sink.take_lines(text))
+        self._sink.check_limit()
+        return len(text)
+
+    def writelines(self, lines: Any) -> None:
+        for line in lines:
+            self.write(line)
+
+    def flush(self) -> None:
+        self._sink.sync()
+        self._stream.flush()
+
+    def __getattr__(self, name: str) -> Any:
+        if name == "buffer":
+            return SinkBuffer(self._sink, self._stream)
+        if name == "fileno":
+            # Writing to the file descriptor skips everything above it.
+            self._sink.sync()
+            self._stream.flush()
+        return getattr(self._stream, name)
+
+
+class SinkBuffer:
+    """Stand-in for sys.stdout.buffer, which writes out any results in
+    the sink (and any text) before writing anything else."""
+
+    def __init__(self, sink: OutputSink, stream: Any):
+        self._sink = sink
+        self._stream = stream
+        self._buffer = stream.buffer
+
+    def write(self, data: Any) -> int:
+        self._sync()
+        written = self._buffer.write(self._sink.take_lines(data))
+        self._sink.check_limit()
+        return written
+
+    def writelines(self, lines: Any) -> None:
+        for line in lines:
+            self.write(line)
+
+    def flush(self) -> None:
+        self._sync()
+        self._buffer.flush()
+
+    def _sync(self) -> None:
+        self._sink.sync()
+        self._stream.flush()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._buffer, name)
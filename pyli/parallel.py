@@ -0,0 +1,289 @@
+#  Copyright (c) <2014> <thenoviceoof>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+#  THE SOFTWARE.
+
+# Run per-line programs over batches of input in parallel.
+#
+# The generated code for a per-line program is a loop over a generator
+# variable. Instead of binding that variable to a stdin reader, we
+# execute the whole module once per batch of lines in a worker, with
+# the variable bound to the batch and the output captured, and then
+# write the captured output from the main process.
+#
+# Worker processes can swap out sys.stdout to capture output, but
+# worker threads share it, so in threaded mode sys.stdout is replaced
+# with a proxy that routes writes to the current task's buffer. The
+# same proxy captures the output of asyncio tasks, for per-line
+# programs that await.
+
+import contextvars
+import io
+import itertools
+import logging
+import marshal
+import sys
+from collections import deque
+from collections.abc import Awaitable, Callable, Iterable, Iterator
+from types import CodeType
+from typing import TYPE_CHECKING, Any, Optional
+
+# The executors and asyncio are only imported when needed, since they
+# are slow to import and most programs don't run in parallel.
+if TYPE_CHECKING:
+    import asyncio
+    import concurrent.futures
+
+LOG = logging.getLogger(__name__)
+
+# Batches amortize shipping lines to processes, while threads are
+# meant for I/O bound work, where each line should be its own task.
+DEFAULT_BATCH_SIZE = 1024
+DEFAULT_THREAD_BATCH_SIZE = 1
+DEFAULT_CONCURRENCY = 64
+
+# Set up in each worker process by init_worker().
+_worker_code: Optional[CodeType] = None
+_worker_variables: dict = {}
+_worker_source = ""
+
+
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    """Group items into lists of (at most) the given size."""
+    iterator = iter(items)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def init_worker(code: bytes, variables: dict, source: str) -> None:
+    global _worker_code, _worker_variables, _worker_source
+    # Code objects can't be pickled, so they are shipped marshalled.
+    _worker_code = marshal.loads(code)
+    _worker_variables = variables
+    _worker_source = source
+
+
+def run_worker_batch(batch: list) -> str:
+    """Execute the generated code over a batch, returning its output."""
+    assert _worker_code is not None
+    context = dict(**_worker_variables)
+    context[_worker_source] = batch
+    # Worker processes only run one batch at a time, so it is safe to
+    # swap out stdout wholesale.
+    output = io.StringIO()
+    stdout = sys.stdout
+    sys.stdout = output
+    try:
+        exec(_worker_code, context)
+    finally:
+        sys.stdout = stdout
+    return output.getvalue()
+
+
+# The output buffer of the task running in the current thread, if any.
+_task_output: contextvars.ContextVar[Optional[io.StringIO]] = contextvars.ContextVar(
+    "pyli_task_output", default=None
+)
+
+
+class TaskStdout:
+    """Stand-in for sys.stdout, which sends writes to the output buffer
+    of the current task (if there is one)."""
+
+    def __init__(self, stream: Any):
+        self._stream = stream
+
+    def write(self, text: str) -> int:
+        output = _task_output.get()
+        if output is None:
+            return self._stream.write(text)
+        return output.write(text)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._stream, name)
+
+
+def run_task(code: CodeType, variables: dict, source: str, batch: list) -> str:
+    """Execute the generated code over a batch on a thread, returning
+    its output."""
+    context = dict(**variables)
+    context[source] = batch
+    output = io.StringIO()
+    token = _task_output.set(output)
+    try:
+        exec(code, context)
+    finally:
+        _task_output.reset(token)
+    return output.getvalue()
+
+
+def run_batches(
+    executor: "concurrent.futures.Executor",
+    run_batch: Callable[[list], str],
+    batches: Iterable[list],
+    max_pending: int,
+    ordered: bool = True,
+) -> None:
+    """Submit batches to an executor, writing each batch's output to
+    stdout. At most max_pending batches are in flight (or waiting to
+    be written) at a time, so memory stays flat on endless input."""
+    import concurrent.futures
+
+    pending: deque[concurrent.futures.Future] = deque()
+    try:
+        for batch in batches:
+            while len(pending) >= max_pending:
+                if ordered:
+                    sys.stdout.write(pending.popleft().result())
+                else:
+                    done, _ = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                    for future in done:
+                        pending.remove(future)
+                        sys.stdout.write(future.result())
+            pending.append(executor.submit(run_batch, batch))
+        if ordered:
+            while pending:
+                sys.stdout.write(pending.popleft().result())
+        else:
+            for future in concurrent.futures.as_completed(pending):
+                sys.stdout.write(future.result())
+    except BaseException:
+        # Don't bother running anything else if a batch failed.
+        for future in pending:
+            future.cancel()
+        raise
+
+
+def run_processes(
+    bytecode: CodeType,
+    variables: dict,
+    source: str,
+    items: Iterable[Any],
+    jobs: int,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    ordered: bool = True,
+) -> None:
+    """Run the generated code over batches of items in a process pool."""
+    import concurrent.futures
+
+    LOG.info("Running batches of {} on {} processes...".format(batch_size, jobs))
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=init_worker,
+        initargs=(marshal.dumps(bytecode), variables, source),
+    ) as executor:
+        # Start the workers before reading any input: forking while a
+        # read-ahead thread (see pyli.stream.read_ahead) holds the stdin
+        # lock would leave the workers stuck on it.
+        executor.submit(int).result()
+        run_batches(
+            executor,
+            run_worker_batch,
+            batched(items, batch_size),
+            # Keep every worker busy, with a batch queued up behind it.
+            max_pending=2 * jobs,
+            ordered=ordered,
+        )
+
+
+def run_threads(
+    bytecode: CodeType,
+    variables: dict,
+    source: str,
+    items: Iterable[Any],
+    threads: int,
+    batch_size: int = DEFAULT_THREAD_BATCH_SIZE,
+    ordered: bool = True,
+) -> None:
+    """Run the generated code over batches of items in a thread pool."""
+    import concurrent.futures
+
+    LOG.info("Running batches of {} on {} threads...".format(batch_size, threads))
+    stdout = sys.stdout
+    sys.stdout = TaskStdout(stdout)  # type: ignore
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+            run_batches(
+                executor,
+                lambda batch: run_task(bytecode, variables, source, batch),
+                batched(items, batch_size),
+                max_pending=2 * threads,
+                ordered=ordered,
+            )
+    finally:
+        sys.stdout = stdout
+
+
+def run_async(
+    task: Callable[[Any], Awaitable[None]],
+    items: Iterable[Any],
+    concurrency: int = DEFAULT_CONCURRENCY,
+) -> None:
+    """Run an async per-line task over items concurrently, writing the
+    output of each task in input order."""
+    import asyncio
+
+    LOG.info("Running up to {} tasks concurrently...".format(concurrency))
+    stdout = sys.stdout
+    sys.stdout = TaskStdout(stdout)  # type: ignore
+    try:
+        asyncio.run(run_tasks_in_order(task, items, concurrency, stdout))
+    finally:
+        sys.stdout = stdout
+
+
+async def run_tasks_in_order(
+    task: Callable[[Any], Awaitable[None]],
+    items: Iterable[Any],
+    concurrency: int,
+    stdout: Any,
+) -> None:
+    import asyncio
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(item: Any) -> str:
+        # Each asyncio task runs in a copy of the context, so this
+        # doesn't leak into other tasks.
+        output = io.StringIO()
+        _task_output.set(output)
+        try:
+            await task(item)
+        finally:
+            semaphore.release()
+        return output.getvalue()
+
+    pending: deque[asyncio.Task] = deque()
+    try:
+        for item in items:
+            await semaphore.acquire()
+            pending.append(asyncio.ensure_future(run_one(item)))
+            # Don't let finished output pile up behind a slow task.
+            while pending and (pending[0].done() or len(pending) >= 2 * concurrency):
+                stdout.write(await pending.popleft())
+        while pending:
+            stdout.write(await pending.popleft())
+    except BaseException:
+        for future in pending:
+            future.cancel()
+        raise
@@ -19,32 +19,35 @@
 #  THE SOFTWARE.
 
 import ast
+import importlib.machinery
+import importlib.util
 import logging
+import sys
 from collections.abc import Sequence
+from importlib.machinery import ModuleSpec
+from typing import Optional
+from pyli.util import PREFIX
 
 LOG = logging.getLogger(__name__)
 
 
-def create_imports(tree: ast.AST, free_variables: set[tuple[str, ...]]) -> None:
+def create_imports(
+    tree: ast.AST,
+    free_variables: set[tuple[str, ...]],
+    lazy: bool = False,
+    index: Optional[dict[str, tuple[str, ...]]] = None,
+) -> None:
     LOG.info("Creating imports...")
     assert isinstance(tree, ast.Module)
-    for free_var in free_variables:
-        LOG.debug("Creating import chain for {}".format(".".join(free_var)))
-        # Build up a try-import chain from most specific to least.
-        current_import: ast.stmt = create_import(free_var[:1])
-        for i in range(2, len(free_var) + 1):
-            current_import = ast.Try(
-                body=[create_import(free_var[:i])],
-                handlers=[
-                    ast.ExceptHandler(
-                        type=ast.Name(id="ImportError", ctx=ast.Load()),
-                        body=[current_import],
-                    )
-                ],
-                orelse=[],
-                finalbody=[],
-            )
-        # This should continually copy line 0 to each new import.
+    # Import only the most specific module that exists, instead of
+    # trying (and failing) to import each prefix at runtime.
+    paths = {resolve_import(free_var, index) for free_var in free_variables}
+    if lazy:
+        create_lazy_imports(tree, paths)
+        return
+    for path in paths:
+        LOG.debug("Creating import for {}".format(".".join(path)))
+        current_import = create_import(path)
         ast.copy_location(current_import, tree.body[0])
         # It is possible to keep pushing the rest of the body down,
         # but for some reason this easily ends up with impossible line
@@ -52,5 +55,66 @@ def create_imports(tree: ast.AST, free_variables: set[tuple[str, ...]]) -> None:
         tree.body.insert(0, current_import)
 
 
+def resolve_import(
+    path: tuple[str, ...], index: Optional[dict[str, tuple[str, ...]]] = None
+) -> tuple[str, ...]:
+    """Find the longest prefix of the path that is a module, without
+    importing anything. If not even the first part is a module, that is
+    still returned, so the import error shows up at runtime.
+
+    The index memoizes the results, and gets filled in as we go."""
+    dotted = ".".join(path)
+    if index is not None and dotted in index:
+        return tuple(index[dotted])
+    resolved = path[:1]
+    spec = find_module_spec(path[0], None)
+    for i in range(2, len(path) + 1):
+        if spec is None:
+            break
+        spec = find_module_spec(".".join(path[:i]), spec)
+        if spec is not None:
+            resolved = path[:i]
+    LOG.debug("Resolved {} to module {}".format(dotted, ".".join(resolved)))
+    if index is not None:
+        index[dotted] = resolved
+    return resolved
+
+
+def find_module_spec(name: str, parent: Optional[ModuleSpec]) -> Optional[ModuleSpec]:
+    # Modules can add submodules to sys.modules themselves (os.path),
+    # which no finder knows about.
+    module = sys.modules.get(name)
+    if module is not None:
+        return getattr(module, "__spec__", None) or ModuleSpec(name, None)
+    try:
+        if parent is None:
+            # Only finding a top level module doesn't import anything.
+            return importlib.util.find_spec(name)
+        if parent.submodule_search_locations is None:
+            return None
+        # Unlike importlib.util.find_spec, this doesn't import the parent.
+        return importlib.machinery.PathFinder.find_spec(
+            name, list(parent.submodule_search_locations)
+        )
+    except (ImportError, ValueError):
+        return None
+
+
 def create_import(import_path: Sequence[str]) -> ast.Import:
     return ast.Import(names=[ast.alias(name=".".join(import_path))])
+
+
+def create_lazy_imports(tree: ast.Module, free_variables: set[tuple[str, ...]]) -> None:
+    """Bind each base name to a proxy, which imports the resolved
+    modules on first use (see pyli.lazy)."""
+    paths_by_name: dict[str, list[tuple[str, ...]]] = {}
+    for free_var in sorted(free_variables):
+        LOG.debug("Creating lazy import for {}".format(".".join(free_var)))
+        paths_by_name.setdefault(free_var[0], []).append(free_var)
+    if not paths_by_name:
+        return
+    fn = PREFIX + "LazyModule"
+    code = "from pyli.lazy import LazyModule as {}\n".format(fn)
+    for name, paths in paths_by_name.items():
+        code += "{} = {}({!r}, {!r}, globals())\n".format(name, fn, name, paths)
+    tree.body[0:0] = ast.parse(code).body
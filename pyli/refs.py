@@ -23,6 +23,7 @@ import builtins
 import logging
 import sys
 from collections.abc import Sequence
+from typing import Optional
 from pyli.util import var_base_difference
 
 LOG = logging.getLogger(__name__)
@@ -332,6 +333,98 @@ def find_references(node: ast.AST) -> tuple[set[str], set[tuple[str, ...]]]:
         return (set(), set())
 
 
+def find_top_level_await(node: ast.AST) -> bool:
+    """Check whether a program awaits outside of any function definition."""
+    if (
+        isinstance(node, ast.Await)
+        or isinstance(node, ast.AsyncFor)
+        or isinstance(node, ast.AsyncWith)
+        or (isinstance(node, ast.comprehension) and node.is_async)
+    ):
+        return True
+    elif (
+        isinstance(node, ast.FunctionDef)
+        or isinstance(node, ast.AsyncFunctionDef)
+        or isinstance(node, ast.Lambda)
+        or isinstance(node, ast.ClassDef)
+    ):
+        # Awaiting inside an `async def` is business as usual.
+        return False
+    return any(find_top_level_await(child) for child in ast.iter_child_nodes(node))
+
+
+def find_max_index(node: ast.AST, names: set[str]) -> Optional[int]:
+    """Find the largest index used on any of the names, if they are
+    only ever indexed by constant non-negative integers (like
+    `part[2]`). Otherwise (the value is passed around, indexed by a
+    variable, ...) the whole value is needed, and None is returned."""
+    indexed = set()
+    max_index = -1
+    for child in ast.walk(node):
+        if (
+            isinstance(child, ast.Subscript)
+            and isinstance(child.value, ast.Name)
+            and child.value.id in names
+        ):
+            index = child.slice
+            if not (
+                isinstance(index, ast.Constant)
+                and type(index.value) is int
+                and index.value >= 0
+                and isinstance(child.ctx, ast.Load)
+            ):
+                return None
+            max_index = max(max_index, index.value)
+            indexed.add(id(child.value))
+    for child in ast.walk(node):
+        if (
+            isinstance(child, ast.AugAssign)
+            and isinstance(child.target, ast.Name)
+            and child.target.id in names
+        ):
+            return None
+        # Binding the names again doesn't use the value.
+        if (
+            isinstance(child, ast.Name)
+            and child.id in names
+            and isinstance(child.ctx, ast.Load)
+            and id(child) not in indexed
+        ):
+            return None
+    return max_index if max_index >= 0 else None
+
+
+def find_max_item_index(node: ast.AST, names: set[str]) -> Optional[int]:
+    """Like find_max_index, but for the items of iterables: the names
+    can only be looped over (`for p in parts`, `... for p in parts`),
+    and the loop variables only indexed by constants."""
+    targets = set()
+    iterated = set()
+    for child in ast.walk(node):
+        if (
+            (
+                isinstance(child, ast.For)
+                or isinstance(child, ast.AsyncFor)
+                or isinstance(child, ast.comprehension)
+            )
+            and isinstance(child.iter, ast.Name)
+            and child.iter.id in names
+            and isinstance(child.target, ast.Name)
+        ):
+            targets.add(child.target.id)
+            iterated.add(id(child.iter))
+    for child in ast.walk(node):
+        if (
+            isinstance(child, ast.Name)
+            and child.id in names
+            and id(child) not in iterated
+        ):
+            return None
+    if not targets or targets & names:
+        return None
+    return find_max_index(node, targets)
+
+
 def find_multiple_node_references(
     nodes: Sequence[ast.AST],
 ) -> tuple[set[str], set[tuple[str, ...]]]:
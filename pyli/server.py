@@ -0,0 +1,277 @@
+#  Copyright (c) <2014> <thenoviceoof>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+#  THE SOFTWARE.
+
+# Pre-warmed server (a "zygote") and the thin client that talks to it.
+#
+# Importing heavy modules (numpy, pandas, ...) can take much longer
+# than actually running a one-liner. `pyli --server` imports them once,
+# and then listens on a Unix socket. A client sends its arguments,
+# working directory, environment and stream encodings, along with its
+# stdin, stdout and stderr file descriptors; the server forks a child
+# which takes over those descriptors, runs the program, and replies
+# with the exit status.
+#
+# The child isn't in the client's process group, so Ctrl-C at the
+# terminal only reaches the client: the client relays SIGINT and
+# SIGTERM to the child over the socket (one byte, the signal number),
+# and the child stops if the client goes away altogether.
+
+import json
+import os
+import signal
+import socket
+import sys
+from pyli import SOCKET_VARIABLE
+
+# Marker sent along with the file descriptors.
+FDS_MARKER = b"F"
+# Ends the request, after which only relayed signals are sent.
+REQUEST_END = b"\n"
+# Signals the client passes on to the child.
+RELAYED_SIGNALS = [signal.SIGINT, signal.SIGTERM]
+# Modules the server always imports, so that compiling is warm too.
+PRELOAD = ["pyli.main", "pyli.preamble", "pyli.refs", "pyli.spec"]
+
+
+def default_socket_path() -> str:
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "pyli.sock")
+    import tempfile
+
+    return os.path.join(tempfile.gettempdir(), "pyli-{}.sock".format(os.getuid()))
+
+
+def run_client(path: str, args: list[str]) -> "int | None":
+    """Run the arguments on the server listening at path, returning
+    the exit status, or None if there's no server."""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            client.connect(path)
+        except OSError:
+            return None
+        # Anything already buffered would be written after the
+        # server's output.
+        sys.stdout.flush()
+        sys.stderr.flush()
+        socket.send_fds(client, [FDS_MARKER], [0, 1, 2])
+        request = {
+            "args": args,
+            "cwd": os.getcwd(),
+            "environ": dict(os.environ),
+            "streams": [
+                stream_encoding(s) for s in (sys.stdin, sys.stdout, sys.stderr)
+            ],
+        }
+        client.sendall(json.dumps(request).encode() + REQUEST_END)
+
+        def relay(signum: int, frame: object) -> None:
+            try:
+                client.sendall(bytes([signum]))
+            except OSError:
+                # The child is already gone.
+                pass
+
+        old_handlers = [(s, signal.signal(s, relay)) for s in RELAYED_SIGNALS]
+        try:
+            reply = b""
+            while True:
+                data = client.recv(64)
+                if not data:
+                    break
+                reply += data
+        finally:
+            for signum, handler in old_handlers:
+                signal.signal(signum, handler)
+    finally:
+        client.close()
+    # No reply means the child died without reporting back.
+    return int(reply) if reply else 1
+
+
+def stream_encoding(stream: object) -> dict[str, str]:
+    """The encoding and error handler of a std stream (from the locale
+    or PYTHONIOENCODING), to open the same descriptor with elsewhere."""
+    options = {
+        "encoding": getattr(stream, "encoding", None),
+        "errors": getattr(stream, "errors", None),
+    }
+    return {name: value for name, value in options.items() if value is not None}
+
+
+def serve(path: str, preload: list[str]) -> None:
+    """Import the preloaded modules, and run requests until
+    interrupted."""
+    import importlib
+
+    if not hasattr(os, "fork"):
+        sys.stderr.write("pyli --server needs os.fork()\n")
+        sys.exit(2)
+    for name in PRELOAD + preload:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            sys.stderr.write("Unable to preload {}: {}\n".format(name, e))
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    remove_stale_socket(path)
+    # Anyone who can connect can run code as us, so keep the socket
+    # private.
+    old_umask = os.umask(0o077)
+    try:
+        server.bind(path)
+    finally:
+        os.umask(old_umask)
+    server.listen()
+    # Children report back to the client directly, so nobody needs to
+    # wait for them.
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    sys.stderr.write("pyli server listening, use it with:\n")
+    sys.stderr.write("export {}={}\n".format(SOCKET_VARIABLE, path))
+    sys.stderr.flush()
+    try:
+        while True:
+            conn, _ = server.accept()
+            if not same_user(conn):
+                conn.close()
+                continue
+            pid = os.fork()
+            if pid == 0:
+                status = 1
+                try:
+                    server.close()
+                    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                    status = handle_request(conn)
+                finally:
+                    # Never return into the server loop (or run its
+                    # cleanup) from a child.
+                    os._exit(status)
+            conn.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.unlink(path)
+
+
+def remove_stale_socket(path: str) -> None:
+    """Remove a socket left behind by a server that's no longer
+    running."""
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except ConnectionRefusedError:
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    sys.stderr.write("A pyli server is already listening on {}\n".format(path))
+    sys.exit(2)
+
+
+def same_user(conn: socket.socket) -> bool:
+    """Check that the client is running as us, where the platform can
+    tell us."""
+    if not hasattr(socket, "SO_PEERCRED"):
+        return True
+    import struct
+
+    credentials = conn.getsockopt(
+        socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+    )
+    _, uid, _ = struct.unpack("3i", credentials)
+    return uid == os.getuid()
+
+
+def handle_request(conn: socket.socket) -> int:
+    """Take over the client's stdio, and run its arguments (in a
+    forked child), returning the exit status."""
+    import traceback
+    from pyli import run
+
+    _, fds, _, _ = socket.recv_fds(conn, len(FDS_MARKER), 3)
+    data = b""
+    while REQUEST_END not in data:
+        chunk = conn.recv(1 << 16)
+        if not chunk:
+            # The client went away before finishing its request.
+            return 1
+        data += chunk
+    data, _, signals = data.partition(REQUEST_END)
+    request = json.loads(data)
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+    # Start over with fresh streams, so nothing buffered in the server
+    # leaks out, buffering suits the client's stdout (a terminal or
+    # not), and text is encoded the way the client's would be.
+    stdin, stdout, stderr = request["streams"]
+    stderr.setdefault("errors", "backslashreplace")
+    sys.stdin = open(0, "r", closefd=False, **stdin)
+    sys.stdout = open(1, "w", closefd=False, **stdout)
+    sys.stderr = open(2, "w", closefd=False, **stderr)
+    relay_signals(conn, signals)
+    os.chdir(request["cwd"])
+    os.environ.clear()
+    os.environ.update(request["environ"])
+    status = 0
+    try:
+        run(request["args"])
+    except SystemExit as e:
+        if isinstance(e.code, int):
+            status = e.code
+        elif e.code is not None:
+            sys.stderr.write("{}\n".format(e.code))
+            status = 1
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+    try:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    except OSError:
+        pass
+    conn.sendall(str(status).encode())
+    conn.close()
+    return status
+
+
+def relay_signals(conn: socket.socket, signals: bytes) -> None:
+    """Raise the signals the client relays in this (child) process, and
+    stop it if the client goes away."""
+    import threading
+
+    def watch(signals: bytes) -> None:
+        while True:
+            for signum in signals:
+                os.kill(os.getpid(), signum)
+            try:
+                signals = conn.recv(64)
+            except OSError:
+                break
+            if not signals:
+                break
+        # Nobody is left to run the program for.
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    threading.Thread(target=watch, args=(signals,), daemon=True).start()
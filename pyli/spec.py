@@ -22,100 +22,238 @@ import ast
 import logging
 import sys
 from collections.abc import Sequence
-from pyli.util import var_base_intersection, var_base_difference
+from typing import Optional
+from pyli.refs import find_max_index, find_max_item_index
+from pyli.stream import DEFAULT_BLOCK_SIZE, DEFAULT_COLUMN_BATCH_SIZE
+from pyli.util import PREFIX, var_base_intersection, var_base_difference
 
 LOG = logging.getLogger(__name__)
 
-PREFIX = "PYLI_RESERVED_"
-
 SPEC_PER_LINE = {"l", "li", "line"}
 SPEC_LINE_GEN = {"ls", "lis", "lines"}
 SPEC_CONTENTS = {"cs", "conts", "contents"}
+SPEC_PER_CHUNK = {"chunk"}
+SPEC_CHUNK_GEN = {"chunks"}
 SPEC_PER_PART = {"p", "part"}
 SPEC_PARTS_GEN = {"ps", "parts"}
+SPEC_COLUMNS = {"cols", "columns"}
+SPEC_PER_RECORD = {"obj", "record"}
 SPEC_STD = {"stdin", "stdout", "stderr"}
+SPEC_FILENAME = {"fn", "filename"}
+SPEC_LINENO = {"n", "lineno"}
 
 
 def handle_special_variables(
-    tree: ast.Module, free_variables: set[tuple[str, ...]], pprint: bool
+    tree: ast.Module,
+    free_variables: set[tuple[str, ...]],
+    pprint: bool,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    read_stdin: bool = True,
+    concurrency: Optional[int] = None,
+    emit: bool = False,
+    sep: Optional[str] = None,
+    dialect: Optional[str] = None,
+    maxsplit: int = -1,
+    column_batch_size: int = DEFAULT_COLUMN_BATCH_SIZE,
+    combine: Optional[list[ast.stmt]] = None,
+    end: Optional[list[ast.stmt]] = None,
+    shared: Optional[set[str]] = None,
+    binary: bool = False,
+    decompress: bool = True,
+    prefetch: bool = False,
+    skip: int = 0,
+    grep: Optional[str] = None,
+    fixed: bool = False,
 ) -> set[tuple[str, ...]]:
+    """Set up the special variables and the printing of the last
+    statement. If read_stdin is False, the per-line/per-part loops
+    iterate over generator variables that the caller binds instead of
+    stdin readers (see per_item_source). If concurrency is given, the
+    per-line/per-part body is run as concurrent asyncio tasks. If emit
+    is True, results are printed by calling a function the caller binds
+    to PREFIX + "emit" (see pyli.output.OutputSink). The parts are
+    split according to sep, dialect and maxsplit (see
+    pyli.stream.read_parts and parts_maxsplit). Columns come in batches
+    of column_batch_size lines, and if combine is given, it is run over
+    the `results` of every batch at the end. Per-record programs print
+    dicts and lists as JSON.
+
+    If there is an END block, only its last statement is printed (the
+    caller puts it after the program). Names in shared are global
+    across the per-line/per-part tasks of programs that await.
+
+    If binary is True, lines, parts and contents are bytes, and bytes
+    results are written as they are (with a newline per line or part)
+    by PREFIX + "emit_raw" and PREFIX + "emit_bytes". Compressed stdin
+    is decompressed, unless decompress is False (chunks are always
+    read as they are). With prefetch, lines, parts, columns and records
+    are read ahead on a background thread. The first skip lines of
+    them are skipped (line numbers still count them), and so are lines
+    not matching grep (see pyli.stream.read_lines).
+    """
     LOG.info("Handling special variables...")
+    printer: tuple[str, ...] = ("print",)
+    json_output = per_item_source(free_variables) == PREFIX + "records"
+    if pprint and emit:
+        printer = (PREFIX + "emit_pretty",)
+    elif pprint:
+        printer = ("pprint", "pprint")
+    elif emit and json_output:
+        printer = (PREFIX + "emit_json",)
+    elif emit and binary:
+        printer = (PREFIX + "emit_raw",)
+    elif emit:
+        printer = (PREFIX + "emit",)
+    elif json_output:
+        printer = (PREFIX + "print_json",)
+    body_printer: Optional[tuple[str, ...]] = printer
+    if end:
+        wrap_last_statement_with_print(end, printer)
+        body_printer = None
+    # Per-line/per-part results still get a newline each.
+    item_printer = body_printer
+    if body_printer == (PREFIX + "emit_raw",):
+        item_printer = (PREFIX + "emit_bytes",)
     if var_base_intersection(free_variables, SPEC_PER_LINE):
         LOG.debug("Per-line variables detected")
         # Create a stdin line generator.
-        stdin_nodes = create_stdin_reader_lines()
+        stdin_nodes = (
+            create_stdin_reader_lines(
+                block_size, binary, decompress, prefetch, skip, grep, fixed
+            )
+            if read_stdin
+            else []
+        )
         tmp_line_name = PREFIX + "line"
-        aliasing = [
+        numbering, aliasing = number_items(
+            free_variables, PREFIX + "lines", tmp_line_name, skip + 1
+        )
+        aliasing += [
             set_variable_to_name(v, tmp_line_name)
             for v in var_base_intersection(free_variables, SPEC_PER_LINE)
         ]
-        wrap_last_statement_with_print(tree.body, pprint)
-        ast.increment_lineno(tree, stdin_nodes[-1].lineno)
+        wrap_last_statement_with_print(tree.body, item_printer)
+        ast.increment_lineno(tree, last_lineno(stdin_nodes))
         # Execute the code per line.
-        for_node = ast.For(
-            target=ast.Name(id=tmp_line_name, ctx=ast.Store()),
-            iter=ast.Name(id=PREFIX + "lines", ctx=ast.Load()),
-            body=aliasing + tree.body,
-            orelse=[],
+        loop_nodes = create_item_loop(
+            tmp_line_name, PREFIX + "lines", aliasing + tree.body, concurrency, shared
         )
-        tree.body = stdin_nodes + [for_node]
-        return var_base_difference(free_variables, SPEC_PER_LINE) | {("sys",)}
+        tree.body = stdin_nodes + numbering + loop_nodes
+        remaining = var_base_difference(free_variables, SPEC_PER_LINE | SPEC_LINENO)
+        return remaining | {("sys",)}
     elif var_base_intersection(free_variables, SPEC_LINE_GEN):
         LOG.debug("Line generator variables detected")
         # Create a stdin line generator.
-        stdin_nodes = create_stdin_reader_lines()
+        stdin_nodes = create_stdin_reader_lines(
+            block_size, binary, decompress, prefetch, skip, grep, fixed
+        )
         aliasing = [
             set_variable_to_name(v, PREFIX + "lines")
             for v in var_base_intersection(free_variables, SPEC_LINE_GEN)
         ]
         # Wrap the last statement with print(...).
-        wrap_last_statement_with_print(tree.body, pprint)
+        wrap_last_statement_with_print(tree.body, body_printer)
         ast.increment_lineno(tree, stdin_nodes[-1].lineno + len(aliasing))
         tree.body = stdin_nodes + aliasing + tree.body
         return var_base_difference(free_variables, SPEC_LINE_GEN) | {("sys",)}
     elif var_base_intersection(free_variables, SPEC_CONTENTS):
         LOG.debug("Contents variables detected")
         # Create a stdin line generator.
-        stdin_node = ast.Assign(
-            targets=[ast.Name(id=PREFIX + "contents", ctx=ast.Store())],
-            value=ast.Call(
-                func=ast_attr(("sys", "stdin", "read")), args=[], keywords=[]
-            ),
-        )
+        stdin_nodes = create_stdin_reader_contents(binary, decompress)
         aliasing = [
             set_variable_to_name(v, PREFIX + "contents")
             for v in var_base_intersection(free_variables, SPEC_CONTENTS)
         ]
         # Wrap the last statement with print(...).
-        wrap_last_statement_with_print(tree.body, pprint)
-        ast.increment_lineno(tree, 1 + len(aliasing))
-        tree.body = [stdin_node] + aliasing + tree.body
+        wrap_last_statement_with_print(tree.body, body_printer)
+        ast.increment_lineno(tree, stdin_nodes[-1].lineno + len(aliasing))
+        tree.body = stdin_nodes + aliasing + tree.body
         return var_base_difference(free_variables, SPEC_CONTENTS) | {("sys",)}
+    elif var_base_intersection(free_variables, SPEC_PER_CHUNK):
+        LOG.debug("Per-chunk variables detected")
+        # Create a stdin chunk generator.
+        stdin_nodes = create_stdin_reader_chunks(block_size)
+        aliasing = [
+            set_variable_to_name(v, PREFIX + "chunk")
+            for v in var_base_intersection(free_variables, SPEC_PER_CHUNK)
+        ]
+        wrap_last_statement_with_print(tree.body, body_printer)
+        ast.increment_lineno(tree, 1 + last_lineno(stdin_nodes) + len(aliasing))
+        # Execute the code per chunk.
+        loop_nodes = create_item_loop(
+            PREFIX + "chunk",
+            PREFIX + "chunks",
+            aliasing + tree.body,
+            concurrency,
+            shared,
+        )
+        tree.body = stdin_nodes + loop_nodes
+        return var_base_difference(free_variables, SPEC_PER_CHUNK) | {("sys",)}
+    elif var_base_intersection(free_variables, SPEC_CHUNK_GEN):
+        LOG.debug("Chunk generator variables detected")
+        # Create a stdin chunk generator.
+        stdin_nodes = create_stdin_reader_chunks(block_size)
+        aliasing = [
+            set_variable_to_name(v, PREFIX + "chunks")
+            for v in var_base_intersection(free_variables, SPEC_CHUNK_GEN)
+        ]
+        # Wrap the last statement with print(...).
+        wrap_last_statement_with_print(tree.body, body_printer)
+        ast.increment_lineno(tree, stdin_nodes[-1].lineno + len(aliasing))
+        tree.body = stdin_nodes + aliasing + tree.body
+        return var_base_difference(free_variables, SPEC_CHUNK_GEN) | {("sys",)}
     elif var_base_intersection(free_variables, SPEC_PER_PART):
         LOG.debug("Space-delimited parts variables detected")
         # Create a stdin space-delimited parts generator.
-        stdin_nodes = create_stdin_reader_parts()
+        stdin_nodes = (
+            create_stdin_reader_parts(
+                block_size,
+                sep,
+                dialect,
+                maxsplit,
+                binary,
+                decompress,
+                prefetch,
+                skip,
+                grep,
+                fixed,
+            )
+            if read_stdin
+            else []
+        )
         # Wrap the last statement with print(...).
-        wrap_last_statement_with_print(tree.body, pprint)
-        aliasing = [
+        wrap_last_statement_with_print(tree.body, item_printer)
+        numbering, aliasing = number_items(
+            free_variables, PREFIX + "parts", PREFIX + "part", skip + 1
+        )
+        aliasing += [
             set_variable_to_name(v, PREFIX + "part")
             for v in var_base_intersection(free_variables, SPEC_PER_PART)
         ]
-        ast.increment_lineno(tree, 1 + stdin_nodes[-1].lineno + len(aliasing))
-        for_node = ast.For(
-            target=ast.Name(id=PREFIX + "part", ctx=ast.Store()),
-            iter=ast.Name(id=PREFIX + "parts", ctx=ast.Load()),
-            body=aliasing + tree.body,
-            orelse=[],
+        ast.increment_lineno(tree, 1 + last_lineno(stdin_nodes) + len(aliasing))
+        loop_nodes = create_item_loop(
+            PREFIX + "part", PREFIX + "parts", aliasing + tree.body, concurrency, shared
         )
-        tree.body = stdin_nodes + [for_node]
-        return var_base_difference(free_variables, SPEC_PER_PART) | {("sys",)}
+        tree.body = stdin_nodes + numbering + loop_nodes
+        remaining = var_base_difference(free_variables, SPEC_PER_PART | SPEC_LINENO)
+        return remaining | {("sys",)}
     elif var_base_intersection(free_variables, SPEC_PARTS_GEN):
         LOG.debug("Space-delimited line generator detected")
         # Create a stdin space-delimited parts generator.
-        stdin_nodes = create_stdin_reader_parts()
+        stdin_nodes = create_stdin_reader_parts(
+            block_size,
+            sep,
+            dialect,
+            maxsplit,
+            binary,
+            decompress,
+            prefetch,
+            skip,
+            grep,
+            fixed,
+        )
         # Wrap the last statement with print(...).
-        wrap_last_statement_with_print(tree.body, pprint)
+        wrap_last_statement_with_print(tree.body, body_printer)
         aliasing = [
             set_variable_to_name(v, PREFIX + "parts")
             for v in var_base_intersection(free_variables, SPEC_PARTS_GEN)
@@ -123,6 +261,79 @@ def handle_special_variables(
         ast.increment_lineno(tree, stdin_nodes[-1].lineno + len(aliasing))
         tree.body = stdin_nodes + aliasing + tree.body
         return var_base_difference(free_variables, SPEC_PARTS_GEN) | {("sys",)}
+    elif var_base_intersection(free_variables, SPEC_COLUMNS):
+        LOG.debug("Columns variables detected")
+        # Create a stdin column batch generator.
+        stdin_nodes = create_stdin_reader_columns(
+            block_size,
+            sep,
+            dialect,
+            maxsplit,
+            column_batch_size,
+            decompress,
+            prefetch,
+            skip,
+            grep,
+            fixed,
+        )
+        aliasing = [
+            set_variable_to_name(v, PREFIX + "cols")
+            for v in var_base_intersection(free_variables, SPEC_COLUMNS)
+        ]
+        combine_nodes: list[ast.stmt] = []
+        if combine is None:
+            # Wrap the last statement with print(...).
+            wrap_last_statement_with_print(tree.body, body_printer)
+        else:
+            # Collect the result of each batch, and print the
+            # combination of all of them at the end.
+            wrap_last_statement_with_print(tree.body, (PREFIX + "results", "append"))
+            wrap_last_statement_with_print(combine, printer)
+            combine_nodes = [set_variable_to_name("results", PREFIX + "results")]
+            ast.copy_location(combine_nodes[0], combine[0])
+            combine_nodes += combine
+        ast.increment_lineno(tree, 1 + last_lineno(stdin_nodes) + len(aliasing))
+        loop_nodes = create_item_loop(
+            PREFIX + "cols",
+            PREFIX + "batches",
+            aliasing + tree.body,
+            concurrency,
+            shared,
+        )
+        tree.body = stdin_nodes + loop_nodes + combine_nodes
+        return var_base_difference(free_variables, SPEC_COLUMNS) | {("sys",)}
+    elif var_base_intersection(free_variables, SPEC_PER_RECORD):
+        LOG.debug("JSON record variables detected")
+        # Create a stdin JSON Lines generator.
+        stdin_nodes = (
+            create_stdin_reader_records(
+                block_size, decompress, prefetch, skip, grep, fixed
+            )
+            if read_stdin
+            else []
+        )
+        if printer == (PREFIX + "print_json",):
+            stdin_nodes += create_json_printer()
+        # Wrap the last statement with print(...).
+        wrap_last_statement_with_print(tree.body, body_printer)
+        numbering, aliasing = number_items(
+            free_variables, PREFIX + "records", PREFIX + "record", skip + 1
+        )
+        aliasing += [
+            set_variable_to_name(v, PREFIX + "record")
+            for v in var_base_intersection(free_variables, SPEC_PER_RECORD)
+        ]
+        ast.increment_lineno(tree, 1 + last_lineno(stdin_nodes) + len(aliasing))
+        loop_nodes = create_item_loop(
+            PREFIX + "record",
+            PREFIX + "records",
+            aliasing + tree.body,
+            concurrency,
+            shared,
+        )
+        tree.body = stdin_nodes + numbering + loop_nodes
+        remaining = var_base_difference(free_variables, SPEC_PER_RECORD | SPEC_LINENO)
+        return remaining | {("sys",)}
     elif var_base_intersection(free_variables, SPEC_STD):
         LOG.debug("std* reference detected")
         aliasing = []
@@ -136,17 +347,174 @@ def handle_special_variables(
             ast.copy_location(alias, tree.body[0])
         # If you're using stdout, you probably want only specific things going to stdout.
         if not var_base_intersection(free_variables, {"stdout"}):
-            wrap_last_statement_with_print(tree.body, pprint)
+            wrap_last_statement_with_print(tree.body, body_printer)
         ast.increment_lineno(tree, 1 + len(aliasing))
         tree.body = aliasing + tree.body
         return var_base_difference(free_variables, SPEC_STD) | {("sys",)}
     else:
         # No special behavior required, just make sure to print the last statement.
         LOG.debug("No special variable behavior detected")
-        wrap_last_statement_with_print(tree.body, pprint)
+        wrap_last_statement_with_print(tree.body, body_printer)
         return free_variables
 
 
+def create_item_loop(
+    target: str,
+    iterable: str,
+    body: list[ast.stmt],
+    concurrency: Optional[int],
+    shared: Optional[set[str]] = None,
+) -> list[ast.stmt]:
+    """Run the body once per item of the iterable, bound to target.
+    Names in shared stay global if the body is run in a coroutine."""
+    if concurrency is None:
+        for_node = ast.For(
+            target=ast.Name(id=target, ctx=ast.Store()),
+            iter=ast.Name(id=iterable, ctx=ast.Load()),
+            body=body,
+            orelse=[],
+        )
+        return [for_node]
+    # Programs that await get their body wrapped in a coroutine, which
+    # is run concurrently over the items.
+    code = """
+from pyli.parallel import run_async as {run}
+async def {task}({target}):
+    pass
+{run}({task}, {iterable}, {concurrency})
+    """.format(
+        run=PREFIX + "run_async",
+        task=PREFIX + "task",
+        target=target,
+        iterable=iterable,
+        concurrency=concurrency,
+    )
+    tmp_tree = ast.parse(code)
+    task_node = tmp_tree.body[1]
+    assert isinstance(task_node, ast.AsyncFunctionDef)
+    task_node.body = body
+    if shared:
+        # Otherwise updating state set up by a BEGIN block would make
+        # it local to the task.
+        task_node.body = [ast.Global(names=sorted(shared))] + body
+    return tmp_tree.body
+
+
+def number_items(
+    free_variables: set[tuple[str, ...]], iterable: str, target: str, start: int = 1
+) -> tuple[list[ast.stmt], list[ast.stmt]]:
+    """If the program uses the line number, number the items of the
+    iterable from start. Returns the statements to run before the loop,
+    and at the start of each iteration (which unpack the target)."""
+    linenos = var_base_intersection(free_variables, SPEC_LINENO)
+    if not linenos:
+        return [], []
+    numbering = ast.parse("{0} = enumerate({0}, {1})".format(iterable, start)).body
+    aliasing: list[ast.stmt] = [
+        set_variable_to_node(v, ast.parse(target + "[0]", mode="eval").body)
+        for v in sorted(linenos)
+    ]
+    aliasing += ast.parse("{0} = {0}[1]".format(target)).body
+    return numbering, aliasing
+
+
+def handle_file_variables(
+    tree: ast.Module, free_variables: set[tuple[str, ...]], files: bool
+) -> set[tuple[str, ...]]:
+    """Set up the file name variables. With file operands, run the
+    program once per file of PREFIX + "files" (bound by the caller),
+    reading the file wherever it would read sys.stdin."""
+    aliasing = [
+        set_variable_to_name(v, PREFIX + "filename")
+        for v in var_base_intersection(free_variables, SPEC_FILENAME)
+    ]
+    if not files:
+        if aliasing:
+            tree.body = (
+                [set_variable_to_node(PREFIX + "filename", ast.Constant(value="-"))]
+                + aliasing
+                + tree.body
+            )
+        return var_base_difference(free_variables, SPEC_FILENAME)
+    LOG.debug("Running once per file")
+    code = """
+from pyli.stream import read_files as {fn}
+for {filename}, {stdin} in {fn}({files}, {failed}):
+    pass
+    """.format(
+        fn=PREFIX + "read_files",
+        filename=PREFIX + "filename",
+        stdin=PREFIX + "stdin",
+        files=PREFIX + "files",
+        failed=PREFIX + "failed_files",
+    )
+    tmp_tree = ast.parse(code)
+    loop_node = tmp_tree.body[1]
+    assert isinstance(loop_node, ast.For)
+    body = [ReplaceStdin().visit(node) for node in tree.body]
+    ast.increment_lineno(tree, loop_node.lineno)
+    loop_node.body = aliasing + body
+    tree.body = tmp_tree.body
+    return var_base_difference(free_variables, SPEC_FILENAME)
+
+
+class ReplaceStdin(ast.NodeTransformer):
+    """Point the generated readers (and the program) at the current
+    file instead of sys.stdin."""
+
+    def visit_Attribute(self, node: ast.Attribute) -> ast.expr:
+        if (
+            isinstance(node.value, ast.Name)
+            and node.value.id == "sys"
+            and node.attr == "stdin"
+            and isinstance(node.ctx, ast.Load)
+        ):
+            return ast.copy_location(
+                ast.Name(id=PREFIX + "stdin", ctx=ast.Load()), node
+            )
+        self.generic_visit(node)
+        return node
+
+
+def per_item_source(free_variables: set[tuple[str, ...]]) -> Optional[str]:
+    """If the program runs once per line, part or record, return the name
+    of the generator variable the generated loop iterates over."""
+    # Mirror the precedence in handle_special_variables.
+    if var_base_intersection(free_variables, SPEC_PER_LINE):
+        return PREFIX + "lines"
+    elif var_base_intersection(
+        free_variables, SPEC_LINE_GEN | SPEC_CONTENTS | SPEC_PER_CHUNK | SPEC_CHUNK_GEN
+    ):
+        return None
+    elif var_base_intersection(free_variables, SPEC_PER_PART):
+        return PREFIX + "parts"
+    elif var_base_intersection(free_variables, SPEC_PARTS_GEN | SPEC_COLUMNS):
+        return None
+    elif var_base_intersection(free_variables, SPEC_PER_RECORD):
+        return PREFIX + "records"
+    return None
+
+
+def parts_maxsplit(tree: ast.AST, free_variables: set[tuple[str, ...]]) -> int:
+    """How many times lines need to be split for part/parts/cols, if the
+    program only looks at the first few fields, or -1 to split them
+    all (see find_max_index)."""
+    per_part = var_base_intersection(free_variables, SPEC_PER_PART)
+    columns = var_base_intersection(free_variables, SPEC_COLUMNS)
+    if per_part:
+        max_index = find_max_index(tree, per_part)
+    elif columns:
+        max_index = find_max_index(tree, columns)
+    else:
+        parts = var_base_intersection(free_variables, SPEC_PARTS_GEN)
+        max_index = find_max_item_index(tree, parts)
+    return -1 if max_index is None else max_index + 1
+
+
+def last_lineno(stmts: list[ast.stmt]) -> int:
+    return stmts[-1].lineno if stmts else 0
+
+
 def set_variable_to_node(target_name: str, source_node: ast.expr) -> ast.Assign:
     return ast.Assign(
         targets=[ast.Name(id=target_name, ctx=ast.Store())], value=source_node
@@ -170,7 +538,7 @@ def ast_attr(parts: Sequence[str], load: bool = True) -> ast.expr:
 
 
 def create_print_ast(
-    node: ast.expr, pprint: bool, location_node: ast.AST
+    node: ast.expr, printer: Sequence[str], location_node: ast.AST
 ) -> list[ast.stmt]:
     """Wraps a given AST node into a print pattern; don't print None."""
     # Assign the result of the node to a variable, since the node could have side effects.
@@ -178,22 +546,10 @@ def create_print_ast(
     assign_node = ast.Assign(
         targets=[ast.Name(id=tmp_var_name, ctx=ast.Store())], value=node
     )
-    print_expr = (
-        ast.Call(
-            func=ast.Attribute(
-                value=ast.Name(id="pprint", ctx=ast.Load()),
-                attr="pprint",
-                ctx=ast.Load(),
-            ),
-            args=[ast.Name(id=tmp_var_name, ctx=ast.Load())],
-            keywords=[],
-        )
-        if pprint
-        else ast.Call(
-            func=ast.Name(id="print", ctx=ast.Load()),
-            args=[ast.Name(id=tmp_var_name, ctx=ast.Load())],
-            keywords=[],
-        )
+    print_expr = ast.Call(
+        func=ast_attr(printer),
+        args=[ast.Name(id=tmp_var_name, ctx=ast.Load())],
+        keywords=[],
     )
     none_check = ast.If(
         test=ast.Compare(
@@ -209,8 +565,13 @@ def create_print_ast(
     return [assign_node, none_check]
 
 
-def wrap_last_statement_with_print(stmts: list[ast.stmt], pprint: bool) -> None:
-    """Given an AST body, wrap the "last" statement in a call to print(...)."""
+def wrap_last_statement_with_print(
+    stmts: list[ast.stmt], printer: Optional[Sequence[str]]
+) -> None:
+    """Given an AST body, wrap the "last" statement in a call to print(...).
+    A printer of None leaves the body alone."""
+    if printer is None:
+        return
     last_node = stmts[-1]
     if isinstance(last_node, ast.Expr):
         # Check if the expression is already wrapped in a print statement.
@@ -219,7 +580,7 @@ def wrap_last_statement_with_print(stmts: list[ast.stmt], pprint: bool) -> None:
         # If our given node is an Expr (statement-expression), unwrap
         # it before putting it into a print(...).
         # See https://stackoverflow.com/a/32429203
-        print_stmts = create_print_ast(last_node.value, pprint, last_node)
+        print_stmts = create_print_ast(last_node.value, printer, last_node)
         stmts.pop()
         stmts.extend(print_stmts)
     elif (
@@ -243,43 +604,43 @@ def wrap_last_statement_with_print(stmts: list[ast.stmt], pprint: bool) -> None:
         else:
             target = last_node.target
         target = set_assignment_target_context(target, ast.Load())
-        print_stmts = create_print_ast(target, pprint, last_node)
+        print_stmts = create_print_ast(target, printer, last_node)
         stmts.extend(print_stmts)
     elif isinstance(last_node, ast.If):
         # That is disgusting, elif is represented extra If nodes.
         # Either way, we need to print the last statement of each
         # branch, and since we recurse we should get every branch
         # automatically.
-        wrap_last_statement_with_print(last_node.body, pprint)
+        wrap_last_statement_with_print(last_node.body, printer)
         if len(last_node.orelse):
-            wrap_last_statement_with_print(last_node.orelse, pprint)
+            wrap_last_statement_with_print(last_node.orelse, printer)
     elif isinstance(last_node, ast.For) or isinstance(last_node, ast.While):
         if last_node.orelse:
-            wrap_last_statement_with_print(last_node.orelse, pprint)
+            wrap_last_statement_with_print(last_node.orelse, printer)
         else:
-            wrap_last_statement_with_print(last_node.body, pprint)
+            wrap_last_statement_with_print(last_node.body, printer)
     elif isinstance(last_node, ast.Try):
         if last_node.finalbody:
-            wrap_last_statement_with_print(last_node.finalbody, pprint)
+            wrap_last_statement_with_print(last_node.finalbody, printer)
             # Finally always executes, so it is the definitive last statement.
             return
         if last_node.orelse:
             # Else executes if no exceptions are handled.
-            wrap_last_statement_with_print(last_node.orelse, pprint)
+            wrap_last_statement_with_print(last_node.orelse, printer)
         else:
-            wrap_last_statement_with_print(last_node.body, pprint)
+            wrap_last_statement_with_print(last_node.body, printer)
         # I think you could argue that we should not be printing
         # exception handlers, but the user is doing custom work they
         # might want printed.
         for handler in last_node.handlers:
             assert isinstance(handler, ast.ExceptHandler)
-            wrap_last_statement_with_print(handler.body, pprint)
+            wrap_last_statement_with_print(handler.body, printer)
     elif isinstance(last_node, ast.With):
-        wrap_last_statement_with_print(last_node.body, pprint)
+        wrap_last_statement_with_print(last_node.body, printer)
     elif sys.version_info >= (3, 10, 0) and isinstance(last_node, ast.Match):
         for case in last_node.cases:
             assert isinstance(case, ast.match_case)
-            wrap_last_statement_with_print(case.body, pprint)
+            wrap_last_statement_with_print(case.body, printer)
     else:
         # There are many statements that shouldn't be printed, like
         # Raise or Assert, enough that I will not bother explicitly
@@ -298,33 +659,186 @@ def is_ast_print(node: ast.AST) -> bool:
     )
 
 
-def create_stdin_reader_lines() -> list[ast.stmt]:
+def create_stdin_reader_lines(
+    block_size: int,
+    binary: bool = False,
+    decompress: bool = True,
+    prefetch: bool = False,
+    skip: int = 0,
+    grep: Optional[str] = None,
+    fixed: bool = False,
+) -> list[ast.stmt]:
+    code = """
+from pyli.stream import {reader} as {fn}
+{gen} = {fn}(
+    sys.stdin, {block_size}, {decompress}, {prefetch}, {skip}, {grep!r}, {fixed}
+)
+    """.format(
+        reader="read_binary_lines" if binary else "read_lines",
+        fn=PREFIX + "read_lines",
+        gen=PREFIX + "lines",
+        block_size=block_size,
+        decompress=decompress,
+        prefetch=prefetch,
+        skip=skip,
+        grep=grep,
+        fixed=fixed,
+    )
+    tmp_tree = ast.parse(code)
+    return tmp_tree.body
+
+
+def create_stdin_reader_parts(
+    block_size: int,
+    sep: Optional[str],
+    dialect: Optional[str],
+    maxsplit: int,
+    binary: bool = False,
+    decompress: bool = True,
+    prefetch: bool = False,
+    skip: int = 0,
+    grep: Optional[str] = None,
+    fixed: bool = False,
+) -> list[ast.stmt]:
+    code = """
+from pyli.stream import {reader} as {fn}
+{gen} = {fn}(
+    sys.stdin,
+    {block_size},
+    {sep!r},
+    {dialect!r},
+    {maxsplit},
+    {decompress},
+    {prefetch},
+    {skip},
+    {grep!r},
+    {fixed},
+)
+    """.format(
+        reader="read_binary_parts" if binary else "read_parts",
+        fn=PREFIX + "read_parts",
+        gen=PREFIX + "parts",
+        block_size=block_size,
+        sep=sep,
+        dialect=dialect,
+        maxsplit=maxsplit,
+        decompress=decompress,
+        prefetch=prefetch,
+        skip=skip,
+        grep=grep,
+        fixed=fixed,
+    )
+    tmp_tree = ast.parse(code)
+    return tmp_tree.body
+
+
+def create_stdin_reader_columns(
+    block_size: int,
+    sep: Optional[str],
+    dialect: Optional[str],
+    maxsplit: int,
+    batch_size: int,
+    decompress: bool = True,
+    prefetch: bool = False,
+    skip: int = 0,
+    grep: Optional[str] = None,
+    fixed: bool = False,
+) -> list[ast.stmt]:
+    code = """
+from pyli.stream import read_columns as {fn}
+{gen} = {fn}(
+    sys.stdin,
+    {block_size},
+    {sep!r},
+    {dialect!r},
+    {maxsplit},
+    {batch_size},
+    {decompress},
+    {prefetch},
+    {skip},
+    {grep!r},
+    {fixed},
+)
+{results} = []
+    """.format(
+        fn=PREFIX + "read_columns",
+        gen=PREFIX + "batches",
+        results=PREFIX + "results",
+        block_size=block_size,
+        sep=sep,
+        dialect=dialect,
+        maxsplit=maxsplit,
+        batch_size=batch_size,
+        decompress=decompress,
+        prefetch=prefetch,
+        skip=skip,
+        grep=grep,
+        fixed=fixed,
+    )
+    tmp_tree = ast.parse(code)
+    return tmp_tree.body
+
+
+def create_stdin_reader_records(
+    block_size: int,
+    decompress: bool = True,
+    prefetch: bool = False,
+    skip: int = 0,
+    grep: Optional[str] = None,
+    fixed: bool = False,
+) -> list[ast.stmt]:
+    code = """
+from pyli.stream import read_records as {fn}
+{gen} = {fn}(
+    sys.stdin, {block_size}, {decompress}, {prefetch}, {skip}, {grep!r}, {fixed}
+)
+    """.format(
+        fn=PREFIX + "read_records",
+        gen=PREFIX + "records",
+        block_size=block_size,
+        decompress=decompress,
+        prefetch=prefetch,
+        skip=skip,
+        grep=grep,
+        fixed=fixed,
+    )
+    tmp_tree = ast.parse(code)
+    return tmp_tree.body
+
+
+def create_json_printer() -> list[ast.stmt]:
+    code = """
+from pyli.output import json_printer as {fn}
+{printer} = {fn}(print)
+    """.format(
+        fn=PREFIX + "json_printer", printer=PREFIX + "print_json"
+    )
+    tmp_tree = ast.parse(code)
+    return tmp_tree.body
+
+
+def create_stdin_reader_chunks(chunk_size: int) -> list[ast.stmt]:
     code = """
-def {fn}():
-    while True:
-        li = sys.stdin.readline()
-        if not li:
-            break
-        yield li.rstrip('\\n')
-{gen} = {fn}()
+from pyli.stream import read_chunks as {fn}
+{gen} = {fn}(sys.stdin, {chunk_size})
     """.format(
-        fn=PREFIX + "line_generator", gen=PREFIX + "lines"
+        fn=PREFIX + "read_chunks", gen=PREFIX + "chunks", chunk_size=chunk_size
     )
     tmp_tree = ast.parse(code)
     return tmp_tree.body
 
 
-def create_stdin_reader_parts() -> list[ast.stmt]:
+def create_stdin_reader_contents(
+    binary: bool = False, decompress: bool = True
+) -> list[ast.stmt]:
     code = """
-def {fn}():
-    while True:
-        li = sys.stdin.readline()
-        if not li:
-            break
-        yield li.rstrip('\\n').split(' ')
-{gen} = {fn}()
+from pyli.stream import {reader} as {fn}
+{contents} = {fn}(sys.stdin, {decompress})
     """.format(
-        fn=PREFIX + "parts_generator", gen=PREFIX + "parts"
+        reader="read_binary_contents" if binary else "read_contents",
+        fn=PREFIX + "read_contents",
+        contents=PREFIX + "contents",
+        decompress=decompress,
     )
     tmp_tree = ast.parse(code)
     return tmp_tree.body
@@ -0,0 +1,903 @@
+#  Copyright (c) <2014> <thenoviceoof>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in
+#  all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+#  THE SOFTWARE.
+
+# Readers used by the generated code to feed the special variables.
+#
+# Reading stdin one readline() at a time costs a trip through the text
+# layer, a decode and an rstrip per line, which dominates on large
+# inputs. Instead, we pull large blocks from the underlying binary
+# buffer, decode each block once and split it into lines in bulk,
+# carrying any partial line over to the next block.
+#
+# When stdin is a regular file (`pyli ... < huge.log`), we memory-map
+# it instead of copying it through read() calls, and hint to the
+# kernel that it will be read sequentially.
+#
+# Compressed input (gzip, bzip2 or xz, going by its magic bytes) is
+# decompressed on a separate thread, which feeds a short queue of
+# decompressed blocks, so decompression (which releases the GIL)
+# overlaps with running the program. With prefetch, plain input is
+# read on a separate thread the same way, for slow pipes and network
+# filesystems.
+
+import array
+import codecs
+import errno
+import functools
+import io
+import itertools
+import logging
+import mmap
+import os
+import stat
+import sys
+from collections.abc import Iterable, Iterator, Sequence
+from typing import IO, Any, AnyStr, Callable, Optional, Union
+
+DEFAULT_BLOCK_SIZE = 1 << 16
+DEFAULT_COLUMN_BATCH_SIZE = 1 << 16
+# Decompressed blocks to read ahead.
+DECOMPRESS_QUEUE_SIZE = 8
+# Blocks to read ahead with prefetch: one being filled while the
+# program works through the other.
+PREFETCH_QUEUE_SIZE = 2
+GZIP_MAGIC = b"\x1f\x8b\x08"
+XZ_MAGIC = b"\xfd7zXZ\x00"
+# Followed by the block size, and then the magic number of the first
+# block (or of the end of an empty stream).
+BZ2_MAGIC = b"BZh"
+BZ2_BLOCK_MAGIC = (b"1AY&SY", b"\x17rE8P\x90")
+LOG = logging.getLogger(__name__)
+# Encodings where every byte of a non-ASCII character is non-ASCII, so
+# ASCII bytes in the raw input are always the characters they look like.
+ASCII_TRANSPARENT_ENCODINGS = {"ascii", "utf-8", "iso8859-1", "cp1252"}
+
+# Dialect for read_parts splitting on runs of whitespace.
+WHITESPACE = "whitespace"
+
+
+def map_regular_file(stream: IO) -> Optional[tuple[mmap.mmap, int]]:
+    """Memory-map a stream backed by a regular file, returning the map
+    and the current offset into it."""
+    try:
+        fd = stream.fileno()
+    except (AttributeError, OSError, ValueError):
+        return None
+    if not stat.S_ISREG(os.fstat(fd).st_mode):
+        return None
+    try:
+        mapped = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        # Empty files can't be mapped, and some filesystems don't
+        # support mapping at all.
+        return None
+    if hasattr(mapped, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+        mapped.madvise(mmap.MADV_SEQUENTIAL)
+    # Respect anything that has already been consumed from the stream.
+    return mapped, stream.tell()
+
+
+def advise_sequential(stream: IO) -> None:
+    """Tell the kernel to read ahead aggressively, if the stream is a file."""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        os.posix_fadvise(stream.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    except (AttributeError, OSError, ValueError):
+        pass
+
+
+def read_raw_blocks(
+    buffer: IO[bytes], block_size: int = DEFAULT_BLOCK_SIZE
+) -> Iterator[Union[bytes, memoryview]]:
+    """Read undecoded blocks from a binary stream."""
+    mapping = map_regular_file(buffer)
+    if mapping is not None:
+        mapped, offset = mapping
+        with mapped, memoryview(mapped) as view:
+            for start in range(offset, len(view), block_size):
+                block = view[start : start + block_size]
+                try:
+                    yield block
+                finally:
+                    # Blocks are only valid until the next one is
+                    # read, and the map can't be closed while any
+                    # views into it are still exported.
+                    block.release()
+        return
+    advise_sequential(buffer)
+    # read1() returns whatever is available instead of waiting for a
+    # full block, so slow pipes still stream line by line.
+    read = getattr(buffer, "read1", buffer.read)
+    while True:
+        data = read(block_size)
+        if not data:
+            return
+        yield data
+
+
+def detect_compression(buffer: IO[bytes]) -> Optional[str]:
+    """Recognize compressed input by its magic bytes, without consuming
+    anything."""
+    peek = getattr(buffer, "peek", None)
+    if peek is None:
+        return None
+    try:
+        head = peek(10)
+    except (OSError, ValueError):
+        return None
+    if head.startswith(GZIP_MAGIC):
+        return "gzip"
+    elif head.startswith(XZ_MAGIC):
+        return "xz"
+    elif (
+        head.startswith(BZ2_MAGIC)
+        and head[3:4].isdigit()
+        and head[4:10] in BZ2_BLOCK_MAGIC
+    ):
+        return "bz2"
+    return None
+
+
+def create_decompressor(kind: str) -> Any:
+    if kind == "gzip":
+        import zlib
+
+        # Expect a gzip header and trailer.
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif kind == "bz2":
+        import bz2
+
+        return bz2.BZ2Decompressor()
+    else:
+        import lzma
+
+        return lzma.LZMADecompressor()
+
+
+def decompress_blocks(
+    blocks: Iterable[Union[bytes, memoryview]], kind: str
+) -> Iterator[bytes]:
+    """Decompress a stream of compressed blocks."""
+    decompressor = create_decompressor(kind)
+    fed = False
+    for data in blocks:
+        while data:
+            fed = True
+            block = decompressor.decompress(data)
+            if block:
+                yield block
+            if not decompressor.eof:
+                break
+            # Concatenated streams (like `cat a.gz b.gz`) carry on in
+            # a new decompressor.
+            data = decompressor.unused_data
+            decompressor = create_decompressor(kind)
+            fed = False
+    if fed and not decompressor.eof:
+        raise EOFError("Compressed input ended before the end-of-stream marker")
+
+
+def read_ahead(
+    blocks: Iterator[bytes], size: int = DECOMPRESS_QUEUE_SIZE
+) -> Iterator[bytes]:
+    """Run a block generator on a background thread, up to size blocks
+    ahead of the consumer. How long each side spent waiting on the
+    other is logged at the end, to help size the blocks and queue."""
+    import queue
+    import threading
+    import time
+
+    ahead: queue.Queue = queue.Queue(maxsize=size)
+    stopped = threading.Event()
+    done = object()
+    # Time the reader spent waiting for room in the queue.
+    producer_stall = 0.0
+
+    def put(item: Any) -> bool:
+        nonlocal producer_stall
+        start = time.perf_counter()
+        try:
+            # Give up if nobody is reading any more.
+            while not stopped.is_set():
+                try:
+                    ahead.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+        finally:
+            producer_stall += time.perf_counter() - start
+
+    def produce() -> None:
+        try:
+            for block in blocks:
+                if not put(block):
+                    return
+            put(done)
+        except BaseException as e:
+            put(e)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    # Time the consumer spent waiting for blocks.
+    consumer_stall = 0.0
+    blocks_read = 0
+    try:
+        while True:
+            start = time.perf_counter()
+            block = ahead.get()
+            consumer_stall += time.perf_counter() - start
+            if block is done:
+                return
+            if isinstance(block, BaseException):
+                raise block
+            blocks_read += 1
+            yield block
+    finally:
+        stopped.set()
+        LOG.info(
+            "Read ahead {} blocks: waited {:.3f}s for input, "
+            "and the reader waited {:.3f}s for room in the queue".format(
+                blocks_read, consumer_stall, producer_stall
+            )
+        )
+
+
+def read_input_blocks(
+    buffer: IO[bytes],
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    decompress: bool = True,
+    prefetch: bool = False,
+) -> Iterator[Union[bytes, memoryview]]:
+    """Read blocks from a binary stream, decompressing them if it's
+    compressed (and decompress is True). With prefetch, plain input is
+    read ahead on a background thread too."""
+    kind = detect_compression(buffer) if decompress else None
+    if kind is not None:
+        return read_ahead(decompress_blocks(read_unlocked(buffer, block_size), kind))
+    if prefetch:
+        return read_ahead(read_unlocked(buffer, block_size), PREFETCH_QUEUE_SIZE)
+    return read_raw_blocks(buffer, block_size)
+
+
+def read_unlocked(
+    buffer: IO[bytes], block_size: int = DEFAULT_BLOCK_SIZE
+) -> Iterator[bytes]:
+    """Read blocks from a (peekable) binary stream, going straight to
+    its file descriptor if it has one.
+
+    Reading on a background thread through the stream itself would
+    hold its lock, which stops the interpreter from shutting down
+    cleanly while the thread is waiting on input.
+    """
+    try:
+        fd = buffer.fileno()
+    except (AttributeError, OSError, ValueError):
+        # Without a file descriptor nothing gets mapped, so these are
+        # all bytes already.
+        return map(bytes, read_raw_blocks(buffer, block_size))
+    # Take over whatever the stream has buffered already (like the
+    # peeked magic bytes).
+    peek = getattr(buffer, "peek", None)
+    head = buffer.read1(len(peek(1))) if peek is not None else b""  # type: ignore
+
+    def read_fd() -> Iterator[bytes]:
+        if head:
+            yield head
+        while True:
+            data = os.read(fd, block_size)
+            if not data:
+                return
+            yield data
+
+    return read_fd()
+
+
+def create_decoder(stream: IO[str]) -> io.IncrementalNewlineDecoder:
+    """Decode the same way the text layer of a stream would, including
+    the universal newline translation."""
+    encoding = getattr(stream, "encoding", None) or "utf-8"
+    errors = getattr(stream, "errors", None) or "strict"
+    return io.IncrementalNewlineDecoder(
+        codecs.getincrementaldecoder(encoding)(errors), translate=True
+    )
+
+
+def read_blocks(
+    stream: IO[str],
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    decompress: bool = True,
+    prefetch: bool = False,
+) -> Iterator[str]:
+    """Read decoded blocks of text from a text stream."""
+    buffer = getattr(stream, "buffer", None)
+    if buffer is None:
+        # Something like io.StringIO, which is already decoded.
+        while True:
+            text = stream.read(block_size)
+            if not text:
+                return
+            yield text
+    blocks = read_input_blocks(buffer, block_size, decompress, prefetch)
+    yield from decode_blocks(blocks, create_decoder(stream))
+
+
+def decode_blocks(
+    blocks: Iterable[Union[bytes, memoryview]], decoder: io.IncrementalNewlineDecoder
+) -> Iterator[str]:
+    for data in blocks:
+        text = decoder.decode(data)
+        if text:
+            yield text
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+
+def read_binary_blocks(
+    stream: IO[str],
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    decompress: bool = True,
+    prefetch: bool = False,
+) -> Iterator[bytes]:
+    """Read undecoded blocks from the binary buffer under a text stream."""
+    buffer = getattr(stream, "buffer", None)
+    if buffer is None:
+        # Something like io.StringIO, which only has text to give.
+        encoding = getattr(stream, "encoding", None) or "utf-8"
+        for text in read_blocks(stream, block_size):
+            yield text.encode(encoding)
+        return
+    for block in read_input_blocks(buffer, block_size, decompress, prefetch):
+        yield bytes(block)
+
+
+def split_lines(blocks: Iterator[AnyStr], newline: AnyStr) -> Iterator[AnyStr]:
+    """Split a stream of text (or bytes) blocks into lines, without the
+    newlines."""
+    empty = newline[:0]
+    pending: list[AnyStr] = []
+    for block in blocks:
+        if newline not in block:
+            pending.append(block)
+            continue
+        if pending:
+            pending.append(block)
+            block = empty.join(pending)
+        lines = block.split(newline)
+        # The last piece is either empty or a partial line.
+        pending = [lines.pop()]
+        yield from lines
+    tail = empty.join(pending)
+    if tail:
+        yield tail
+
+
+# A match of a pattern in data[pos:end], as its span.
+LineSearch = Callable[[bytes, int, int], Optional[tuple[int, int]]]
+
+
+def create_line_search(pattern: bytes, fixed: bool = False) -> LineSearch:
+    """Search for a regex (or a fixed string) in bytes, where ^ and $
+    match at the start and end of each line."""
+    if fixed:
+        size = len(pattern)
+
+        def find(data: bytes, pos: int, end: int) -> Optional[tuple[int, int]]:
+            start = data.find(pattern, pos, end)
+            return None if start < 0 else (start, start + size)
+
+        return find
+    import re
+
+    search = re.compile(pattern, re.MULTILINE).search
+
+    def find_regex(data: bytes, pos: int, end: int) -> Optional[tuple[int, int]]:
+        match = search(data, pos, end)
+        return None if match is None else match.span()
+
+    return find_regex
+
+
+def can_search_bytes(pattern: str, fixed: bool) -> bool:
+    """Check whether searching the raw (ASCII transparent) bytes for a
+    regex finds the same lines as searching the decoded lines. A fixed
+    string always does, but a regex has to stick to ASCII characters,
+    and can't use anything that could match part of a character (like
+    `.` or `[^...]`) or that works differently on bytes (like `\\w`,
+    `\\b` or ignoring case)."""
+    if fixed:
+        return True
+    if not pattern.isascii():
+        return False
+    in_class = False
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        following = pattern[i + 1 : i + 2]
+        if char == "\\":
+            # Letters are classes, anchors or other escapes, but for
+            # the usual whitespace characters.
+            if following.isalpha() and following not in "nrtfv":
+                return False
+            i += 2
+            continue
+        if in_class:
+            in_class = char != "]"
+        elif char == "[":
+            if following == "^":
+                return False
+            in_class = True
+            if following == "]":
+                # A leading ] is part of the class.
+                i += 1
+        elif char == ".":
+            return False
+        elif char == "(" and following == "?":
+            flags = pattern[i + 2 :]
+            flags = flags[: len(flags) - len(flags.lstrip("aiLmsux-"))]
+            if "i" in flags:
+                return False
+        i += 1
+    return True
+
+
+def translate_newlines(blocks: Iterable[bytes]) -> Iterator[bytes]:
+    """Translate \\r\\n and \\r in raw (ASCII transparent) blocks to \\n,
+    like the universal newlines of the text layer."""
+    carry = b""
+    for block in blocks:
+        if carry:
+            block = carry + block
+            carry = b""
+        if b"\r" in block:
+            if block.endswith(b"\r"):
+                # Might be followed by a newline in the next block.
+                carry = b"\r"
+                block = block[:-1]
+            block = block.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        if block:
+            yield block
+    if carry:
+        yield b"\n"
+
+
+def grep_blocks(
+    blocks: Iterable[bytes], search: LineSearch, skip: int = 0
+) -> Iterator[bytes]:
+    """Keep only the lines of a stream of blocks with a match (see
+    create_line_search), after skipping the first skip lines. The
+    lines are found by searching whole blocks, not line by line."""
+    pending: list[bytes] = []
+    for block in blocks:
+        if b"\n" not in block:
+            pending.append(block)
+            continue
+        if pending:
+            pending.append(block)
+            block = b"".join(pending)
+        end = block.rfind(b"\n") + 1
+        # The rest is a partial line.
+        pending = [block[end:]]
+        pos = 0
+        if skip:
+            pos, skip = skip_lines(block, end, skip)
+        matched = grep_lines(block, pos, end, search)
+        if matched:
+            yield matched
+    tail = b"".join(pending)
+    if tail and not skip:
+        matched = grep_lines(tail, 0, len(tail), search)
+        if matched:
+            yield matched
+
+
+def skip_lines(data: bytes, end: int, skip: int) -> tuple[int, int]:
+    """Skip up to skip lines of data[:end], returning where the rest
+    starts, and how many lines are still left to skip."""
+    count = data.count(b"\n", 0, end)
+    if count <= skip:
+        return end, skip - count
+    pos = 0
+    for _ in range(skip):
+        pos = data.index(b"\n", pos) + 1
+    return pos, 0
+
+
+def grep_lines(data: bytes, pos: int, end: int, search: LineSearch) -> bytes:
+    """Join the lines of data[pos:end] (which starts at the start of a
+    line) with a match."""
+    matched = []
+    while pos < end:
+        span = search(data, pos, end)
+        if span is None:
+            break
+        start, stop = span
+        newline = data.rfind(b"\n", pos, start)
+        line_start = pos if newline < 0 else newline + 1
+        if line_start >= end:
+            # An empty match right at the end, after the last line.
+            break
+        newline = data.find(b"\n", start, end)
+        line_end = end if newline < 0 else newline
+        # A match running into the next line only counts if the line
+        # has a match of its own.
+        if stop <= line_end or search(data, line_start, line_end) is not None:
+            matched.append(data[line_start : line_end + 1])
+        pos = line_end + 1
+    return b"".join(matched)
+
+
+def grep_decoded(lines: Iterator[str], pattern: str, fixed: bool) -> Iterator[str]:
+    """Keep only the lines with a match of a regex (or containing a
+    fixed string)."""
+    if fixed:
+        return (line for line in lines if pattern in line)
+    import re
+
+    return filter(re.compile(pattern).search, lines)
+
+
+def read_lines(
+    stream: IO[str],
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    decompress: bool = True,
+    prefetch: bool = False,
+    skip: int = 0,
+    grep: Optional[str] = None,
+    fixed: bool = False,
+) -> Iterator[str]:
+    """Generate the lines of a text stream, without the newlines,
+    skipping the first skip lines.
+
+    Given grep, only the lines with a match of that regex (or
+    containing that string, if fixed) are generated. Where that gives
+    the same lines (see can_search_bytes), the raw bytes are searched,
+    and only the matching lines are decoded.
+    """
+    if grep is not None:
+        encoding = getattr(stream, "encoding", None) or "utf-8"
+        transparent = codecs.lookup(encoding).name in ASCII_TRANSPARENT_ENCODINGS
+        if not transparent or not can_search_bytes(grep, fixed):
+            # Filter the decoded lines instead.
+            lines = read_lines(stream, block_size, decompress, prefetch, skip)
+            return grep_decoded(lines, grep, fixed)
+        errors = getattr(stream, "errors", None) or "strict"
+        search = create_line_search(grep.encode(encoding, errors), fixed)
+        blocks = read_binary_blocks(stream, block_size, decompress, prefetch)
+        matched = grep_blocks(translate_newlines(blocks), search, skip)
+        return split_lines(decode_blocks(matched, create_decoder(stream)), "\n")
+    lines = split_lines(read_blocks(stream, block_size, decompress, prefetch), "\n")
+    if skip:
+        return itertools.islice(lines, skip, None)
+    return lines
+
+
+def read_binary_lines(
+    stream: IO[str],
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    decompress: bool = True,
+    prefetch: bool = False,
+    skip: int = 0,
+    grep: Optional[str] = None,
+    fixed: bool = False,
+) -> Iterator[bytes]:
+    """Generate the undecoded lines of a text stream, split on b"\\n"
+    (without it), skipping the first skip lines, and keeping only the
+    lines matching grep (see read_lines)."""
+    blocks = read_binary_blocks(stream, block_size, decompress, prefetch)
+    if grep is not None:
+        # Get back the bytes given on the command line.
+        search = create_line_search(os.fsencode(grep), fixed)
+        return split_lines(grep_blocks(blocks, search, skip), b"\n")
+    lines = split_lines(blocks, b"\n")
+    if skip:
+        return itertools.islice(lines, skip, None)
+    return lines
+
+
+def read_parts(
+    stream: IO[str],
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    sep: Optional[str] = None,
+    dialect: Optional[str] = None,
+    maxsplit: int = -1,
+    decompress: bool = True,
+    prefetch: bool = False,
+    skip: int = 0,
+    grep: Optional[str] = None,
+    fixed: bool = False,
+) -> Iterator[list[str]]:
+    """Generate the fields of each line of a text stream, split on sep
+    (a single space by default), at most maxsplit times.
+
+    The dialect can be "whitespace", to split on runs of whitespace
+    instead, or a csv dialect ("excel", "excel-tab", ...), to parse the
+    lines with the csv module, which handles quoting. Then sep
+    overrides the dialect's delimiter, if given, and maxsplit is
+    ignored. The first skip lines, and lines not matching grep (see
+    read_lines), are skipped without splitting them.
+    """
+    lines = read_lines(stream, block_size, decompress, prefetch, skip, grep, fixed)
+    if dialect is None:
+        sep = " " if sep is None else sep
+        return (line.split(sep, maxsplit) for line in lines)
+    if dialect == WHITESPACE:
+        return (line.split(None, maxsplit) for line in lines)
+    import csv
+
+    # The csv reader needs the newlines, to tell quoted newlines apart
+    # from the end of a record.
+    records = (line + "\n" for line in lines)
+    if sep is None:
+        return csv.reader(records, dialect)
+    return csv.reader(records, dialect, delimiter=sep)
+
+
+def read_binary_parts(
+    stream: IO[str],
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    sep: Optional[str] = None,
+    dialect: Optional[str] = None,
+    maxsplit: int = -1,
+    decompress: bool = True,
+    prefetch: bool = False,
+    skip: int = 0,
+    grep: Optional[str] = None,
+    fixed: bool = False,
+) -> Iterator[list[bytes]]:
+    """Generate the undecoded fields of each line of a text stream, like
+    read_parts. The csv dialects aren't supported."""
+    lines = read_binary_lines(
+        stream, block_size, decompress, prefetch, skip, grep, fixed
+    )
+    if dialect is None:
+        # Get back the bytes given on the command line.
+        binary_sep = b" " if sep is None else os.fsencode(sep)
+        return (line.split(binary_sep, maxsplit) for line in lines)
+    if dialect == WHITESPACE:
+        return (line.split(None, maxsplit) for line in lines)
+    raise ValueError("Can't read {} fields as bytes".format(dialect))
+
+
+def read_records(
+    stream: IO[str],
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    decompress: bool = True,
+    prefetch: bool = False,
+    skip: int = 0,
+    grep: Optional[str] = None,
+    fixed: bool = False,
+) -> Iterator[Any]:
+    """Generate the decoded JSON value of each line of a text stream
+    (JSON Lines), skipping blank lines (and the first skip lines, and
+    lines not matching grep, without decoding them). orjson is used if
+    installed."""
+    loads: Callable[[str], Any]
+    try:
+        import orjson  # type: ignore
+    except ImportError:
+        import json
+
+        loads = json.JSONDecoder().decode
+    else:
+        loads = orjson.loads
+    lines = read_lines(stream, block_size, decompress, prefetch, skip, grep, fixed)
+    for line in lines:
+        if line and not line.isspace():
+            yield loads(line)
+
+
+def read_columns(
+    stream: IO[str],
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    sep: Optional[str] = None,
+    dialect: Optional[str] = None,
+    maxsplit: int = -1,
+    batch_size: int = DEFAULT_COLUMN_BATCH_SIZE,
+    decompress: bool = True,
+    prefetch: bool = False,
+    skip: int = 0,
+    grep: Optional[str] = None,
+    fixed: bool = False,
+) -> Iterator["Columns"]:
+    """Generate batches of up to batch_size lines of parts (see
+    read_parts), as sequences of columns (see Columns)."""
+    try:
+        import numpy  # type: ignore
+    except ImportError:
+        to_column: Callable[[list[str]], Any] = array_column
+    else:
+        to_column = functools.partial(numpy_column, numpy)
+    rows = read_parts(
+        stream,
+        block_size,
+        sep,
+        dialect,
+        maxsplit,
+        decompress,
+        prefetch,
+        skip,
+        grep,
+        fixed,
+    )
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return
+        yield Columns(batch, to_column)
+
+
+class Columns(Sequence):
+    """The columns of a batch of lines, padded with empty strings where
+    lines are short.
+
+    Columns of integers or floats are NumPy arrays if NumPy is
+    installed, and array.array otherwise. Other columns are NumPy arrays
+    of strings, or lists. Each column is only pulled out of the lines
+    and converted when first used, so unused columns cost next to
+    nothing.
+    """
+
+    def __init__(self, rows: list[list[str]], to_column: Callable[[list[str]], Any]):
+        self._rows = rows
+        self._to_column = to_column
+        lengths = set(map(len, rows))
+        self._width = max(lengths)
+        self._ragged = len(lengths) > 1
+        self._columns: dict[int, Any] = {}
+
+    def __len__(self) -> int:
+        return self._width
+
+    def __getitem__(self, index: Any) -> Any:
+        if isinstance(index, slice):
+            return [self[i] for i in range(self._width)[index]]
+        index = range(self._width)[index]
+        column = self._columns.get(index)
+        if column is None:
+            if self._ragged:
+                values = [row[index] if index < len(row) else "" for row in self._rows]
+            else:
+                values = [row[index] for row in self._rows]
+            column = self._columns[index] = self._to_column(values)
+        return column
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+
+def array_column(values: list[str]) -> Union[array.array, list[str]]:
+    for typecode, convert in (("q", int), ("d", float)):
+        try:
+            return array.array(typecode, map(convert, values))
+        except (ValueError, OverflowError):
+            pass
+    return list(values)
+
+
+def numpy_column(numpy: Any, values: list[str]) -> Any:
+    column = numpy.array(values)
+    for dtype in (numpy.int64, numpy.float64):
+        try:
+            return column.astype(dtype)
+        except (ValueError, OverflowError):
+            pass
+    return column
+
+
+def read_contents(stream: IO[str], decompress: bool = True) -> str:
+    """Read all of a text stream into a single string."""
+    buffer = getattr(stream, "buffer", None)
+    kind = detect_compression(buffer) if buffer is not None and decompress else None
+    if kind is not None:
+        assert buffer is not None
+        data = b"".join(decompress_blocks(read_raw_blocks(buffer), kind))
+        return create_decoder(stream).decode(data, final=True)
+    mapping = map_regular_file(buffer) if buffer is not None else None
+    if mapping is None:
+        return stream.read()
+    # Decode straight out of the mapping, instead of reading a
+    # full-size copy of the bytes first.
+    mapped, offset = mapping
+    with mapped, memoryview(mapped) as view:
+        return create_decoder(stream).decode(view[offset:], final=True)
+
+
+def read_chunks(
+    stream: IO[str], chunk_size: int = DEFAULT_BLOCK_SIZE
+) -> Iterator[bytes]:
+    """Generate the undecoded contents of a text stream in chunks of
+    chunk_size bytes (the last one can be shorter), in constant memory."""
+    buffer = getattr(stream, "buffer", None)
+    if buffer is None:
+        # Something like io.StringIO, which only has text to give.
+        encoding = getattr(stream, "encoding", None) or "utf-8"
+        while True:
+            text = stream.read(chunk_size)
+            if not text:
+                return
+            yield text.encode(encoding)
+    advise_sequential(buffer)
+    # Each chunk is its own bytes object, since the program might hold
+    # on to them. A buffered read() only comes up short at the end.
+    while True:
+        chunk = buffer.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def read_binary_contents(stream: IO[str], decompress: bool = True) -> bytes:
+    """Read all of the binary buffer under a text stream."""
+    buffer = getattr(stream, "buffer", None)
+    if buffer is None:
+        encoding = getattr(stream, "encoding", None) or "utf-8"
+        return stream.read().encode(encoding)
+    kind = detect_compression(buffer) if decompress else None
+    if kind is not None:
+        return b"".join(decompress_blocks(read_raw_blocks(buffer), kind))
+    return buffer.read()
+
+
+def read_files(
+    paths: Iterable[str], failed: Optional[list[str]] = None
+) -> Iterator[tuple[str, IO[str]]]:
+    """Open each file in turn as a text stream, decoded like stdin
+    ("-" is stdin itself). Files that can't be opened are reported and
+    added to failed, and the rest are still read (like cat)."""
+    for path in paths:
+        if path == "-":
+            yield path, sys.stdin
+            continue
+        encoding = getattr(sys.stdin, "encoding", None)
+        errors = getattr(sys.stdin, "errors", None)
+        try:
+            stream = open(path, encoding=encoding, errors=errors)
+        except OSError as e:
+            report_unreadable(path, e.strerror or str(e), failed)
+            continue
+        with stream:
+            yield path, stream
+
+
+def readable_files(paths: Iterable[str], failed: list[str]) -> Iterator[str]:
+    """Skip the files that can't be read, without opening them (so the
+    files can be opened elsewhere, like in a worker process)."""
+    for path in paths:
+        if path == "-":
+            yield path
+            continue
+        try:
+            if stat.S_ISDIR(os.stat(path).st_mode):
+                report_unreadable(path, os.strerror(errno.EISDIR), failed)
+            elif not os.access(path, os.R_OK):
+                report_unreadable(path, os.strerror(errno.EACCES), failed)
+            else:
+                yield path
+        except OSError as e:
+            report_unreadable(path, e.strerror or str(e), failed)
+
+
+def report_unreadable(path: str, reason: str, failed: Optional[list[str]]) -> None:
+    sys.stderr.write("pyli: {}: {}\n".format(path, reason))
+    if failed is not None:
+        failed.append(path)
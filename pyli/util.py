@@ -18,6 +18,10 @@
 #  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 #  THE SOFTWARE.
 
+# Prefix for the names used by generated code, to avoid clashing with
+# anything the user would write.
+PREFIX = "PYLI_RESERVED_"
+
 
 def var_base_intersection(
     vars_path: set[tuple[str, ...]], vars_base: set[str]
@@ -18,11 +18,31 @@
 #  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 #  THE SOFTWARE.
 
+import ast
+import bz2
+import gzip
+import http.server
 import io
+import logging
+import lzma
+import os
+import pickle
 import sys
 import re
+import signal
+import subprocess
+import tempfile
+import threading
+import time
 import unittest
 from pyli.main import main
+from pyli.cache import cache_dir, evict, load_cached, store_cached
+from pyli.optimize import hoist_invariants, localize_loops
+from pyli.output import OutputLimitReached, OutputSink
+from pyli.preamble import resolve_import
+from pyli.refs import find_free_references
+from pyli.spec import parts_maxsplit
+from pyli.stream import can_search_bytes, read_chunks, read_contents, read_lines
 
 
 class StdoutManager:
@@ -50,6 +70,24 @@ class StdoutManager:
         sys.stderr = self._stderr
 
 
+def run_main(program, text="", **kwargs):
+    """
+    Run a program over text (or bytes) on stdin, returning its output.
+
+    The std* streams are backed by bytes like the real ones, and the
+    output comes back as bytes when running with binary=True.
+    """
+    if isinstance(text, str):
+        text = text.encode()
+    with StdoutManager():
+        sys.stdin = io.TextIOWrapper(io.BufferedReader(io.BytesIO(text)))
+        sys.stdout = stdout = io.TextIOWrapper(io.BytesIO())
+        main(program, **kwargs)
+        stdout.flush()
+    output = stdout.buffer.getvalue()
+    return output if kwargs.get("binary") else output.decode()
+
+
 class TestLastStatementPrint(unittest.TestCase):
     def test_constants(self):
         with StdoutManager() as (stdin, stdout, stderr):
@@ -1102,3 +1140,1367 @@ y 2
         with StdoutManager() as (stdin, stdout, stderr):
             main("print(x.split()[1])", variables={"x": "hello world"})
             assert stdout.getvalue() == "world\n", stdout.getvalue()
+
+
+class TestStream(unittest.TestCase):
+    def test_small_blocks(self):
+        stream = io.StringIO("hi\nbye\nnye")
+        assert list(read_lines(stream, 2)) == ["hi", "bye", "nye"]
+
+    def test_trailing_newline(self):
+        stream = io.StringIO("hi\n\nbye\n")
+        assert list(read_lines(stream, 3)) == ["hi", "", "bye"]
+
+    def test_long_line(self):
+        stream = io.StringIO("a" * 100 + "\nb")
+        assert list(read_lines(stream, 7)) == ["a" * 100, "b"]
+
+    def test_binary_buffer_multibyte(self):
+        # Split a multibyte character across blocks.
+        stream = io.TextIOWrapper(io.BytesIO("h\u00e9llo\nw\u00f6rld".encode()))
+        assert list(read_lines(stream, 2)) == ["h\u00e9llo", "w\u00f6rld"]
+
+    def test_binary_buffer_newlines(self):
+        stream = io.TextIOWrapper(io.BytesIO(b"hi\r\nbye\r\n"))
+        assert list(read_lines(stream, 3)) == ["hi", "bye"]
+
+    def test_main_block_size(self):
+        with StdoutManager() as (stdin, stdout, stderr):
+            stdin.write("hi\nbye\nnye")
+            stdin.seek(0)
+            main("len(p)", block_size=1)
+            assert stdout.getvalue() == "1\n1\n1\n", stdout.getvalue()
+
+    def test_mapped_file(self):
+        with tempfile.TemporaryFile("w+") as f:
+            f.write("hi\r\nbye\nnye")
+            f.seek(0)
+            assert list(read_lines(f, 4)) == ["hi", "bye", "nye"]
+
+    def test_mapped_file_offset(self):
+        with tempfile.TemporaryFile("w+") as f:
+            f.write("skip\nhi\nbye")
+            f.seek(0)
+            f.buffer.read(5)
+            assert list(read_lines(f, 4)) == ["hi", "bye"]
+
+    def test_mapped_empty_file(self):
+        with tempfile.TemporaryFile("w+") as f:
+            assert list(read_lines(f)) == []
+            assert read_contents(f) == ""
+
+    def test_mapped_contents(self):
+        with tempfile.TemporaryFile("w+") as f:
+            f.write("h\u00e9llo\r\nworld")
+            f.seek(0)
+            assert read_contents(f) == "h\u00e9llo\nworld"
+
+    def test_main_mapped_stdin(self):
+        with StdoutManager() as (stdin, stdout, stderr):
+            with tempfile.TemporaryFile("w+") as f:
+                f.write("hi\nbye\nnye")
+                f.seek(0)
+                sys.stdin = f
+                main("len(cs)")
+            assert stdout.getvalue() == "10\n", stdout.getvalue()
+
+
+class TestChunks(unittest.TestCase):
+    TEXT = "abcdefg"
+
+    def test_chunk(self):
+        output = run_main("chunk", self.TEXT, block_size=3)
+        assert output == "b'abc'\nb'def'\nb'g'\n", output
+
+    def test_chunks(self):
+        output = run_main("sum(len(c) for c in chunks)", self.TEXT, block_size=3)
+        assert output == "7\n", output
+
+    def test_hash(self):
+        output = run_main(
+            "h.update(chunk)",
+            self.TEXT,
+            block_size=2,
+            begin="h = hashlib.sha1()",
+            end="h.hexdigest()",
+        )
+        assert output == "2fb5e13419fc89246865e7a324f476ec624e8740\n", output
+
+    def test_read_chunks(self):
+        with tempfile.TemporaryFile() as f:
+            f.write(b"\x00\xff" * 5)
+            f.seek(0)
+            stream = io.TextIOWrapper(f)
+            chunks = list(read_chunks(stream, 4))
+        assert chunks == [b"\x00\xff\x00\xff"] * 2 + [b"\x00\xff"], chunks
+
+
+class TestBinary(unittest.TestCase):
+    TEXT = b"ab\xff cd\nef gh\n"
+
+    def test_line(self):
+        output = run_main("line.upper()", self.TEXT, binary=True)
+        assert output == b"AB\xff CD\nEF GH\n", output
+
+    def test_part(self):
+        output = run_main("part[0]", self.TEXT, binary=True)
+        assert output == b"ab\xff\nef\n", output
+
+    def test_sep(self):
+        output = run_main("part[-1]", self.TEXT, sep="\udcff", binary=True)
+        assert output == b" cd\nef gh\n", output
+
+    def test_text_results(self):
+        output = run_main("len(line)", self.TEXT, binary=True)
+        assert output == b"6\n5\n", output
+
+    def test_contents(self):
+        output = run_main("pickle.dumps(contents)", self.TEXT, binary=True)
+        assert pickle.loads(output) == b"ab\xff cd\nef gh\n", output
+        assert output.endswith(b"."), output
+
+    def test_chunk(self):
+        output = run_main("chunk", self.TEXT, block_size=4, binary=True)
+        assert output == b"ab\xff cd\nef gh\n", output
+
+    def test_end(self):
+        output = run_main(
+            "n += len(line)", self.TEXT, begin="n = 0", end="b'%d' % n", binary=True
+        )
+        assert output == b"11", output
+
+    def test_csv(self):
+        with StdoutManager():
+            with self.assertRaises(SystemExit):
+                run_main("part", self.TEXT, dialect="excel", binary=True)
+
+
+class TestDecompress(unittest.TestCase):
+    TEXT = b"1\n2\n3\n"
+
+    def test_gzip(self):
+        output = run_main("int(l) * 2", gzip.compress(self.TEXT))
+        assert output == "2\n4\n6\n", output
+
+    def test_bz2(self):
+        output = run_main("int(l) * 2", bz2.compress(self.TEXT))
+        assert output == "2\n4\n6\n", output
+
+    def test_xz(self):
+        output = run_main("int(l) * 2", lzma.compress(self.TEXT))
+        assert output == "2\n4\n6\n", output
+
+    def test_concatenated(self):
+        data = gzip.compress(self.TEXT) * 2
+        output = run_main("len(list(lines))", data)
+        assert output == "6\n", output
+
+    def test_contents(self):
+        output = run_main("contents", gzip.compress(self.TEXT))
+        assert output == "1\n2\n3\n\n", output
+
+    def test_parts(self):
+        output = run_main("p[1]", gzip.compress(b"a b\nc d\n"))
+        assert output == "b\nd\n", output
+
+    def test_truncated(self):
+        data = gzip.compress(self.TEXT)[:-4]
+        with self.assertRaises(EOFError):
+            run_main("l", data)
+
+    def test_no_decompress(self):
+        data = gzip.compress(self.TEXT)
+        output = run_main("len(contents)", data, binary=True, decompress=False)
+        assert output == b"%d\n" % len(data), output
+
+    def test_binary(self):
+        # Binary input passes through as it is, unless asked otherwise.
+        data = gzip.compress(self.TEXT)
+        output = run_main("contents", data, binary=True)
+        assert output == data, output
+        output = run_main("contents", data, binary=True, decompress=True)
+        assert output == self.TEXT, output
+
+    def test_chunk(self):
+        data = gzip.compress(self.TEXT)
+        output = run_main("len(chunk)", data)
+        assert output == "{}\n".format(len(data)), output
+
+    def test_plain(self):
+        output = run_main("l", b"BZh\n\x1f\n")
+        assert output == "BZh\n\x1f\n", output
+
+
+class TestPrefetch(unittest.TestCase):
+    TEXT = b"1\n2\n3\n"
+
+    def test_line(self):
+        output = run_main("int(l) * 2", self.TEXT, prefetch=True, block_size=2)
+        assert output == "2\n4\n6\n", output
+
+    def test_parts(self):
+        output = run_main("p[1]", b"a b\nc d\n", prefetch=True, block_size=2)
+        assert output == "b\nd\n", output
+
+    def test_record(self):
+        output = run_main(
+            'record["a"]', b'{"a": 1}\n{"a": 2}\n', prefetch=True, block_size=2
+        )
+        assert output == "1\n2\n", output
+
+    def test_binary(self):
+        output = run_main(
+            "line[::-1]", b"ab\ncd\n", binary=True, prefetch=True, block_size=2
+        )
+        assert output == b"ba\ndc\n", output
+
+    def test_gzip(self):
+        output = run_main(
+            "int(l) * 2", gzip.compress(self.TEXT), prefetch=True, block_size=2
+        )
+        assert output == "2\n4\n6\n", output
+
+    def test_stats(self):
+        with self.assertLogs("pyli.stream", logging.INFO) as logs:
+            run_main("l", self.TEXT, prefetch=True, block_size=2)
+        assert any("Read ahead 3 blocks" in m for m in logs.output), logs.output
+
+    def test_pipe(self):
+        # A real file descriptor, read with os.read.
+        read_fd, write_fd = os.pipe()
+
+        def write():
+            with open(write_fd, "wb") as f:
+                for i in range(1000):
+                    f.write(b"%d\n" % i)
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        with open(read_fd) as stream:
+            total = sum(map(int, read_lines(stream, 16, prefetch=True)))
+        writer.join()
+        assert total == sum(range(1000)), total
+
+
+class TestParallel(unittest.TestCase):
+    def test_jobs_line(self):
+        with StdoutManager() as (stdin, stdout, stderr):
+            stdin.write("\n".join(str(i) for i in range(100)))
+            stdin.seek(0)
+            main("int(line) * 2", jobs=3, batch_size=7)
+            expected = "".join("{}\n".format(i * 2) for i in range(100))
+            assert stdout.getvalue() == expected, stdout.getvalue()
+
+    def test_jobs_print(self):
+        with StdoutManager() as (stdin, stdout, stderr):
+            stdin.write("hi\nbye\nnye")
+            stdin.seek(0)
+            main("print('>'); l if 'y' in l else None", jobs=2, batch_size=1)
+            assert stdout.getvalue() == ">\n>\nbye\n>\nnye\n", stdout.getvalue()
+
+    def test_jobs_part(self):
+        with StdoutManager() as (stdin, stdout, stderr):
+            stdin.write("1 thing\n2 brah")
+            stdin.seek(0)
+            main("'%s: %s' % (part[0], part[1])", jobs=2, batch_size=1)
+            assert stdout.getvalue() == "1: thing\n2: brah\n", stdout.getvalue()
+
+    def test_jobs_unordered(self):
+        with StdoutManager() as (stdin, stdout, stderr):
+            stdin.write("\n".join(str(i) for i in range(50)))
+            stdin.seek(0)
+            main("line", jobs=2, batch_size=3, ordered=False)
+            lines = stdout.getvalue().splitlines()
+            assert sorted(lines, key=int) == [str(i) for i in range(50)], lines
+
+    def test_jobs_variables(self):
+        with StdoutManager() as (stdin, stdout, stderr):
+            stdin.write("hi\nbye")
+            stdin.seek(0)
+            main("x + line", variables={"x": "> "}, jobs=2)
+            assert stdout.getvalue() == "> hi\n> bye\n", stdout.getvalue()
+
+    def test_jobs_error(self):
+        with StdoutManager() as (stdin, stdout, stderr):
+            stdin.write("1 2\n3")
+            stdin.seek(0)
+            self.assertRaises(IndexError, main, "part[1]", jobs=2, batch_size=1)
+
+    def test_jobs_not_per_line(self):
+        with StdoutManager() as (stdin, stdout, stderr):
+            stdin.write("hi\nbye\nnye")
+            stdin.seek(0)
+            main("sum(len(l) for l in ls)", jobs=2)
+            assert stdout.getvalue() == "8\n", stdout.getvalue()
+
+
+class SlowHandler(http.server.BaseHTTPRequestHandler):
+    """Stand in for a slow remote service: echo the path after a delay,
+    keeping track of the most requests handled at once."""
+
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+
+    def do_GET(self):
+        with self.lock:
+            SlowHandler.in_flight += 1
+            SlowHandler.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.2)
+        with self.lock:
+            SlowHandler.in_flight -= 1
+        body = self.path.encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestThreads(unittest.TestCase):
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), SlowHandler)
+        self.url = "http://127.0.0.1:{}/".format(self.server.server_address[1])
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def run_requests(self, **kwargs):
+        """Returns the most requests that were in flight at once."""
+        SlowHandler.max_in_flight = 0
+        with StdoutManager() as (stdin, stdout, stderr):
+            stdin.write("\n".join("page{}".format(i) for i in range(10)))
+            stdin.seek(0)
+            main(
+                "r = urllib.request.urlopen(url + li).read().decode(); r",
+                variables={"url": self.url},
+                **kwargs
+            )
+            expected = "".join("/page{}\n".format(i) for i in range(10))
+            assert stdout.getvalue() == expected, stdout.getvalue()
+        return SlowHandler.max_in_flight
+
+    def test_threads_overlap(self):
+        # Serially, each request only starts once the last one is done.
+        assert self.run_requests() == 1
+        most = self.run_requests(threads=10)
+        assert most > 1, most
+
+    def test_threads_print(self):
+        with StdoutManager() as (stdin, stdout, stderr):
+            stdin.write("hi\nbye\nnye")
+            stdin.seek(0)
+            main("print('>'); time.sleep(0.01 * len(l)); l", threads=3)
+            assert stdout.getvalue() == ">\nhi\n>\nbye\n>\nnye\n", stdout.getvalue()
+
+    def test_threads_unordered(self):
+        with StdoutManager() as (stdin, stdout, stderr):
+            stdin.write("3\n1\n2")
+            stdin.seek(0)
+            main("time.sleep(0.05 * int(l)); l", threads=3, ordered=False)
+            assert stdout.getvalue() == "1\n2\n3\n", stdout.getvalue()
+
+    def test_threads_restores_stdout(self):
+        with StdoutManager() as (stdin, stdout, stderr):
+            stdin.write("hi")
+            stdin.seek(0)
+            main("l", threads=2)
+            assert sys.stdout is stdout
+
+
+class TestAwait(unittest.TestCase):
+    def test_await_line_order(self):
+        with StdoutManager() as (stdin, stdout, stderr):
+            stdin.write("3\n1\n2")
+            stdin.seek(0)
+            main("await asyncio.sleep(0.01 * int(l)); print('>' + l); l")
+            assert stdout.getvalue() == ">3\n3\n>1\n1\n>2\n2\n", stdout.getvalue()
+
+    # Keeps track of the most lines in flight at once.
+    COUNTED = (
+        "running += 1; most = max(most, running); "
+        "await asyncio.sleep(0.01); running -= 1; print(l)"
+    )
+
+    def test_await_concurrency(self):
+        text = "\n".join(str(i) for i in range(20))
+        output = run_main(
+            self.COUNTED, text, begin="running = most = 0", end="most", concurrency=20
+        )
+        *lines, most = output.splitlines()
+        assert lines == [str(i) for i in range(20)], lines
+        assert int(most) > 1, most
+
+    def test_await_concurrency_limit(self):
+        text = "\n".join(str(i) for i in range(4))
+        output = run_main(
+            self.COUNTED, text, begin="running = most = 0", end="most", concurrency=1
+        )
+        assert output == "0\n1\n2\n3\n1\n", output
+
+    def test_await_part(self):
+        with StdoutManager() as (stdin, stdout, stderr):
+            stdin.write("1 thing\n2 brah")
+            stdin.seek(0)
+            main("x = await asyncio.sleep(0, p[1]); x")
+            assert stdout.getvalue() == "thing\nbrah\n", stdout.getvalue()
+
+    def test_await_error(self):
+        with StdoutManager() as (stdin, stdout, stderr):
+            stdin.write("1 2\n3")
+            stdin.seek(0)
+            self.assertRaises(IndexError, main, "await asyncio.sleep(0, part[1])")
+
+    def test_await_top_level(self):
+        with StdoutManager() as (stdin, stdout, stderr):
+            main("await asyncio.sleep(0, 'hello')")
+            assert stdout.getvalue() == "hello\n", stdout.getvalue()
+
+    def test_await_in_function(self):
+        with StdoutManager() as (stdin, stdout, stderr):
+            main("async def f(): return await asyncio.sleep(0, 1)\nasyncio.run(f())")
+            assert stdout.getvalue() == "1\n", stdout.getvalue()
+
+
+class TestOutputSink(unittest.TestCase):
+    def test_batches(self):
+        stream = io.TextIOWrapper(io.BytesIO(), encoding="utf-8")
+        sink = OutputSink(stream, batch_size=2)
+        sink.write("h\u00e9llo")
+        assert stream.buffer.getvalue() == b""
+        sink.write(1)
+        assert stream.buffer.getvalue() == "h\u00e9llo\n1\n".encode()
+        sink.write(None)
+        sink.close()
+        assert stream.buffer.getvalue() == "h\u00e9llo\n1\nNone\n".encode()
+
+    def test_text_layer_first(self):
+        stream = io.TextIOWrapper(io.BytesIO(), encoding="utf-8")
+        stream.write("first\n")
+        sink = OutputSink(stream)
+        sink.write("second")
+        sink.close()
+        assert stream.buffer.getvalue() == b"first\nsecond\n"
+
+    def test_background(self):
+        stream = io.TextIOWrapper(io.BytesIO(), encoding="utf-8")
+        sink = OutputSink(stream, batch_size=3, background=True)
+        for i in range(10):
+            sink.write(i)
+        sink.close()
+        expected = "".join("{}\n".format(i) for i in range(10)).encode()
+        assert stream.buffer.getvalue() == expected
+
+    def test_interleaved_print(self):
+        with StdoutManager() as (stdin, stdout, stderr):
+            stdin.write("hi\nbye\nnye")
+            stdin.seek(0)
+            main("if l == 'bye': print('!')\nl")
+            assert stdout.getvalue() == "hi\n!\nbye\nnye\n", stdout.getvalue()
+
+    def test_interleaved_background(self):
+        with StdoutManager() as (stdin, stdout, stderr):
+            stdin.write("hi\nbye\nnye")
+            stdin.seek(0)
+            main("if l == 'bye': sys.stdout.write('!\\n')\nl", output_thread=True)
+            assert stdout.getvalue() == "hi\n!\nbye\nnye\n", stdout.getvalue()
+
+    def test_interleaved_buffer(self):
+        stdout = sys.stdout
+        stream = io.TextIOWrapper(io.BytesIO(), encoding="utf-8")
+        sys.stdout = stream
+        try:
+            with OutputSink(stream) as sink:
+                for line in ["1", "2"]:
+                    sys.stdout.buffer.write(b"raw\n")
+                    sink.write(line)
+                sys.stdout.write("text\n")
+                sys.stdout.buffer.write(b"raw\n")
+        finally:
+            sys.stdout = stdout
+        expected = b"raw\n1\nraw\n2\ntext\nraw\n"
+        assert stream.buffer.getvalue() == expected, stream.buffer.getvalue()
+
+    def test_limit(self):
+        stream = io.TextIOWrapper(io.BytesIO(), encoding="utf-8")
+        sink = OutputSink(stream, batch_size=4, limit=3)
+        sink.write(1)
+        sink.write(2)
+        with self.assertRaises(OutputLimitReached):
+            sink.write(3)
+        sink.close()
+        assert stream.buffer.getvalue() == b"1\n2\n3\n"
+
+    def test_flush_on_exception(self):
+        with StdoutManager() as (stdin, stdout, stderr):
+            stdin.write("1\n2\nx")
+            stdin.seek(0)
+            self.assertRaises(ValueError, main, "int(l)")
+            assert stdout.getvalue() == "1\n2\n", stdout.getvalue()
+            assert sys.stdout is stdout
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.old_cache_home = os.environ.get("XDG_CACHE_HOME")
+        os.environ["XDG_CACHE_HOME"] = self.tmp_dir.name
+
+    def tearDown(self):
+        if self.old_cache_home is None:
+            del os.environ["XDG_CACHE_HOME"]
+        else:
+            os.environ["XDG_CACHE_HOME"] = self.old_cache_home
+        self.tmp_dir.cleanup()
+
+    def test_cached_run(self):
+        for _ in range(2):
+            with StdoutManager() as (stdin, stdout, stderr):
+                stdin.write("hi\nbye")
+                stdin.seek(0)
+                main("x + l", variables={"x": "> "}, cache=True)
+                assert stdout.getvalue() == "> hi\n> bye\n", stdout.getvalue()
+        # The program, and the index of resolved imports.
+        assert len(os.listdir(cache_dir())) == 2
+
+    def test_cache_keys(self):
+        with StdoutManager() as (stdin, stdout, stderr):
+            main("math.sqrt(4)", cache=True)
+            main("math.sqrt(4)", cache=True, pprint_opt=True)
+            main("math.sqrt(9)", cache=True)
+            assert stdout.getvalue() == "2.0\n2.0\n3.0\n", stdout.getvalue()
+        assert len(os.listdir(cache_dir())) == 4
+
+    def test_no_cache(self):
+        with StdoutManager() as (stdin, stdout, stderr):
+            main("1")
+        assert not os.path.exists(cache_dir())
+
+    def test_corrupt_entry(self):
+        store_cached("a", (1, None))
+        with open(os.path.join(cache_dir(), "a.marshal"), "wb") as f:
+            f.write(b"garbage")
+        assert load_cached("a") is None
+
+    def test_environment_change(self):
+        with StdoutManager() as (stdin, stdout, stderr):
+            main("math.pi", cache=True)
+            sys.path.append(self.tmp_dir.name)
+            try:
+                main("math.pi", cache=True)
+            finally:
+                sys.path.remove(self.tmp_dir.name)
+        # Programs and import indexes for both environments.
+        assert len(os.listdir(cache_dir())) == 4, os.listdir(cache_dir())
+
+    def test_evict(self):
+        for i, key in enumerate("abc"):
+            store_cached(key, "x" * 100)
+            path = os.path.join(cache_dir(), key + ".marshal")
+            os.utime(path, ns=(i * 10**9, i * 10**9))
+        # Using an entry makes it the most recent.
+        assert load_cached("a") == "x" * 100
+        evict(cache_dir(), 250)
+        assert sorted(os.listdir(cache_dir())) == ["a.marshal", "c.marshal"]
+
+
+# Generous, since CI machines are slow and noisy; this is meant to
+# catch pyli importing the world again, not small regressions.
+STARTUP_IMPORT_BUDGET_US = 30000
+
+
+def import_times(args, env=None):
+    """Run pyli in a new interpreter, and return the cumulative import
+    time in microseconds of each module imported."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c"]
+        + ["import pyli; pyli.script_entry_point()"]
+        + args,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        env=env,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times
+
+
+class TestStartup(unittest.TestCase):
+    def test_version_imports(self):
+        times = import_times(["--version"])
+        for module in ["pyli.main", "ast", "logging", "asyncio"]:
+            assert module not in times, "{} imported for --version".format(module)
+        assert times["pyli"] < STARTUP_IMPORT_BUDGET_US, times["pyli"]
+
+    def test_help_imports(self):
+        times = import_times(["--help"])
+        for module in ["pyli.main", "ast", "asyncio"]:
+            assert module not in times, "{} imported for --help".format(module)
+
+    def test_cached_run_imports(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            env = dict(os.environ, XDG_CACHE_HOME=tmp_dir)
+            times = import_times(["1"], env=env)
+            assert "ast" in times
+            # The compiler isn't needed once the code is cached.
+            times = import_times(["1"], env=env)
+            for module in ["ast", "pyli.spec", "pyli.refs", "asyncio"]:
+                assert module not in times, "{} imported when cached".format(module)
+
+
+PYLI_COMMAND = [sys.executable, "-c", "import pyli; pyli.script_entry_point()"]
+
+
+@unittest.skipUnless(hasattr(os, "fork"), "needs os.fork()")
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self.tmp_dir.name, "pyli.sock")
+        package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.env = dict(
+            os.environ,
+            PYTHONPATH=package_dir,
+            XDG_CACHE_HOME=self.tmp_dir.name,
+            PYLI_SOCKET=self.socket_path,
+        )
+        self.server = subprocess.Popen(
+            PYLI_COMMAND + ["--server", "--socket", self.socket_path],
+            stderr=subprocess.DEVNULL,
+            env=self.env,
+        )
+        for _ in range(500):
+            if os.path.exists(self.socket_path):
+                break
+            time.sleep(0.01)
+
+    def tearDown(self):
+        self.server.terminate()
+        self.server.wait()
+        self.tmp_dir.cleanup()
+
+    def run_client(self, args, stdin="", **kwargs):
+        return subprocess.run(
+            PYLI_COMMAND + args,
+            input=stdin,
+            capture_output=True,
+            text=True,
+            env=self.env,
+            **kwargs,
+        )
+
+    def test_run(self):
+        result = self.run_client(["x + l", "--x=> "], stdin="hi\nbye")
+        assert result.stdout == "> hi\n> bye\n", result.stdout
+        assert result.returncode == 0
+
+    def test_runs_in_server(self):
+        result = self.run_client(["os.getppid()"])
+        assert int(result.stdout) == self.server.pid, result.stdout
+
+    def test_cwd(self):
+        result = self.run_client(["os.getcwd()"], cwd=self.tmp_dir.name)
+        assert result.stdout == self.tmp_dir.name + "\n", result.stdout
+
+    def test_exit_status(self):
+        result = self.run_client(["sys.exit(3)"])
+        assert result.returncode == 3, result.returncode
+        result = self.run_client(["1/0"])
+        assert result.returncode == 1, result.returncode
+        assert "ZeroDivisionError" in result.stderr, result.stderr
+
+    def test_encoding(self):
+        # The client's encoding, not the server's.
+        result = subprocess.run(
+            PYLI_COMMAND + ["'\\u00e9'"],
+            capture_output=True,
+            env=dict(self.env, PYTHONIOENCODING="latin-1"),
+        )
+        assert result.stdout == b"\xe9\n", result.stdout
+
+    def start_sleeping_client(self):
+        client = subprocess.Popen(
+            PYLI_COMMAND + ["print(os.getpid(), flush=True); time.sleep(30)"],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            env=self.env,
+        )
+        assert client.stdout is not None
+        return client, int(client.stdout.readline())
+
+    def wait_for_exit(self, pid):
+        for _ in range(500):
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                return
+            time.sleep(0.01)
+        self.fail("{} is still running".format(pid))
+
+    def test_interrupt(self):
+        client, pid = self.start_sleeping_client()
+        with client:
+            client.send_signal(signal.SIGINT)
+            _, stderr = client.communicate(timeout=10)
+        assert client.returncode == 1, client.returncode
+        assert "KeyboardInterrupt" in stderr, stderr
+        self.wait_for_exit(pid)
+
+    def test_client_killed(self):
+        client, pid = self.start_sleeping_client()
+        with client:
+            client.kill()
+            client.wait()
+        self.wait_for_exit(pid)
+
+    def test_no_server(self):
+        self.env["PYLI_SOCKET"] = os.path.join(self.tmp_dir.name, "missing.sock")
+        result = self.run_client(["os.getppid()"])
+        assert int(result.stdout) == os.getpid(), result.stdout
+
+
+class TestLazyImports(unittest.TestCase):
+    def test_unused_not_imported(self):
+        sys.modules.pop("colorsys", None)
+        with StdoutManager() as (stdin, stdout, stderr):
+            stdin.write("a\nb")
+            stdin.seek(0)
+            main("colorsys.rgb_to_hsv(0, 0, 0) if l == 'x' else l", lazy_imports=True)
+            assert stdout.getvalue() == "a\nb\n", stdout.getvalue()
+        assert "colorsys" not in sys.modules
+
+    def test_used_imported(self):
+        sys.modules.pop("colorsys", None)
+        with StdoutManager() as (stdin, stdout, stderr):
+            main("colorsys.rgb_to_hsv(0, 0, 0)", lazy_imports=True)
+            assert stdout.getvalue() == "(0.0, 0.0, 0)\n", stdout.getvalue()
+        assert "colorsys" in sys.modules
+
+    def test_submodules(self):
+        with StdoutManager() as (stdin, stdout, stderr):
+            main(
+                "xml.dom.minidom.parseString('<a/>').documentElement.tagName",
+                lazy_imports=True,
+            )
+            assert stdout.getvalue() == "a\n", stdout.getvalue()
+
+    def test_missing_module(self):
+        with StdoutManager() as (stdin, stdout, stderr):
+            stdin.write("a\nx")
+            stdin.seek(0)
+            self.assertRaises(
+                ModuleNotFoundError,
+                main,
+                "nosuchmodule.f() if l == 'x' else l",
+                lazy_imports=True,
+            )
+            assert stdout.getvalue() == "a\n", stdout.getvalue()
+
+
+class TestResolveImport(unittest.TestCase):
+    def test_submodule(self):
+        assert resolve_import(("os", "path", "join")) == ("os", "path")
+        assert resolve_import(("math", "sqrt")) == ("math",)
+
+    def test_no_import(self):
+        sys.modules.pop("xml.dom.pulldom", None)
+        path = ("xml", "dom", "pulldom", "parseString")
+        assert resolve_import(path) == ("xml", "dom", "pulldom")
+        assert "xml.dom.pulldom" not in sys.modules
+
+    def test_missing(self):
+        assert resolve_import(("nosuchmodule", "x")) == ("nosuchmodule",)
+
+    def test_index(self):
+        index = {}
+        assert resolve_import(("os", "path", "join"), index) == ("os", "path")
+        assert index == {"os.path.join": ("os", "path")}, index
+        # Anything in the index is trusted.
+        index["os.path.join"] = ("os",)
+        assert resolve_import(("os", "path", "join"), index) == ("os",)
+
+    def test_single_import(self):
+        with StdoutManager() as (stdin, stdout, stderr):
+            main("xml.dom.minidom.parseString('<a/>').documentElement.tagName")
+            assert stdout.getvalue() == "a\n", stdout.getvalue()
+
+
+class TestSeparators(unittest.TestCase):
+    def run_parts(self, text, program="part", **kwargs):
+        with StdoutManager() as (stdin, stdout, stderr):
+            stdin.write(text)
+            stdin.seek(0)
+            main(program, **kwargs)
+            return stdout.getvalue()
+
+    def test_default(self):
+        output = self.run_parts("a  b\n")
+        assert output == "['a', '', 'b']\n", output
+
+    def test_sep(self):
+        output = self.run_parts("a\tb c\n", sep="\t")
+        assert output == "['a', 'b c']\n", output
+
+    def test_whitespace(self):
+        output = self.run_parts(" a  b\tc \n", dialect="whitespace")
+        assert output == "['a', 'b', 'c']\n", output
+
+    def test_csv(self):
+        output = self.run_parts('a,"b,c"\n"d\ne",f', dialect="excel")
+        assert output == "['a', 'b,c']\n['d\\ne', 'f']\n", output
+
+    def test_csv_sep(self):
+        output = self.run_parts('a;"b;c"\n', dialect="excel", sep=";")
+        assert output == "['a', 'b;c']\n", output
+
+    def test_tsv_parts(self):
+        output = self.run_parts("a\tb\nc\td\n", "list(parts)", dialect="excel-tab")
+        assert output == "[['a', 'b'], ['c', 'd']]\n", output
+
+    def test_csv_jobs(self):
+        output = self.run_parts('a,"b,c"\nd,e\n', dialect="excel", jobs=2)
+        assert output == "['a', 'b,c']\n['d', 'e']\n", output
+
+
+class TestPartsMaxsplit(unittest.TestCase):
+    def maxsplit(self, code):
+        tree = ast.parse(code)
+        return parts_maxsplit(tree, find_free_references(tree))
+
+    def test_constant_indexes(self):
+        assert self.maxsplit("p[0] + part[2]") == 3
+        assert self.maxsplit("sum(int(r[1]) for r in parts)") == 2
+        assert self.maxsplit("for r in ps:\n    print(r[0])") == 1
+
+    def test_full_split(self):
+        assert self.maxsplit("p") == -1
+        assert self.maxsplit("p[-1]") == -1
+        assert self.maxsplit("p[1:]") == -1
+        assert self.maxsplit("p[i]") == -1
+        assert self.maxsplit("len(p)") == -1
+        assert self.maxsplit("p[0]; p.count('a')") == -1
+        assert self.maxsplit("dict(parts)") == -1
+        assert self.maxsplit("[a for a, b in parts]") == -1
+        assert self.maxsplit("[r for r in parts]") == -1
+        assert self.maxsplit("p += ['x']; p[3]") == -1
+
+    def test_output(self):
+        with StdoutManager() as (stdin, stdout, stderr):
+            stdin.write("a b c d\ne f g")
+            stdin.seek(0)
+            main("p[0] + p[2]")
+            assert stdout.getvalue() == "ac\neg\n", stdout.getvalue()
+
+    def test_whitespace_output(self):
+        with StdoutManager() as (stdin, stdout, stderr):
+            stdin.write("  a  b  c  \n")
+            stdin.seek(0)
+            main("[r[1] for r in parts]", dialect="whitespace")
+            assert stdout.getvalue() == "['b']\n", stdout.getvalue()
+
+    def test_too_few_parts(self):
+        with StdoutManager() as (stdin, stdout, stderr):
+            stdin.write("a b\n")
+            stdin.seek(0)
+            self.assertRaises(IndexError, main, "p[2]")
+
+    def test_jobs_output(self):
+        with StdoutManager() as (stdin, stdout, stderr):
+            stdin.write("a b c\nd e f")
+            stdin.seek(0)
+            main("p[1]", jobs=2)
+            assert stdout.getvalue() == "b\ne\n", stdout.getvalue()
+
+
+try:
+    import numpy  # type: ignore
+except ImportError:
+    numpy = None
+
+
+class TestColumns(unittest.TestCase):
+    def run_columns(self, program, text="1 2.5 a\n3 4 b\n5 6 c\n", **kwargs):
+        with StdoutManager() as (stdin, stdout, stderr):
+            stdin.write(text)
+            stdin.seek(0)
+            main(program, **kwargs)
+            return stdout.getvalue()
+
+    def test_batches(self):
+        output = self.run_columns("int(sum(cols[0]))", batch_size=2)
+        assert output == "4\n5\n", output
+
+    def test_combine(self):
+        output = self.run_columns(
+            "float(sum(cols[1]))", batch_size=2, combine="sum(results)"
+        )
+        assert output == "12.5\n", output
+
+    def test_combine_imports(self):
+        output = self.run_columns(
+            "int(sum(cols[0]))", batch_size=1, combine="statistics.mean(results)"
+        )
+        assert output == "3\n", output
+
+    def test_strings(self):
+        output = self.run_columns("''.join(cols[2])")
+        assert output == "abc\n", output
+
+    def test_short_lines(self):
+        output = self.run_columns("'|'.join(cols[1])", text="a b\nc\n")
+        assert output == "b|\n", output
+
+    @unittest.skipIf(numpy is not None, "NumPy is installed")
+    def test_arrays(self):
+        output = self.run_columns("[c.typecode for c in cols[:2]]")
+        assert output == "['q', 'd']\n", output
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_numpy(self):
+        output = self.run_columns("[c.dtype.kind for c in cols]")
+        assert output == "['i', 'f', 'U']\n", output
+
+
+class TestBeginEnd(unittest.TestCase):
+    TEXT = "1\n2\n3"
+
+    def test_sum(self):
+        output = run_main("total += int(l)", self.TEXT, begin="total = 0", end="total")
+        assert output == "6\n", output
+
+    def test_begin_imports(self):
+        output = run_main(
+            "counts[p[0]] += 1",
+            "a 1\nb 2\na 3",
+            begin="counts = collections.Counter()",
+            end="sorted(counts.items())",
+        )
+        assert output == "[('a', 2), ('b', 1)]\n", output
+
+    def test_begin_only(self):
+        output = run_main("n += 1; (n, l)", self.TEXT, begin="n = 0")
+        assert output == "(1, '1')\n(2, '2')\n(3, '3')\n", output
+
+    def test_end_only(self):
+        output = run_main("print(l)", self.TEXT, end="'done'")
+        assert output == "1\n2\n3\ndone\n", output
+
+    def test_await(self):
+        output = run_main(
+            "await asyncio.sleep(0); total += int(l)",
+            self.TEXT,
+            begin="total = 0",
+            end="total",
+        )
+        assert output == "6\n", output
+
+    def test_await_end_only(self):
+        # Names only END reads are still shared with the tasks.
+        output = run_main("await asyncio.sleep(0); last = l", self.TEXT, end="last")
+        assert output == "3\n", output
+
+    def test_jobs(self):
+        output = run_main(
+            "total += int(l)", self.TEXT, begin="total = 0", end="total", jobs=2
+        )
+        assert output == "6\n", output
+
+
+class TestRecords(unittest.TestCase):
+    TEXT = '{"a": 1, "b": [1, 2]}\n\n{"a": 2}\n'
+
+    def test_record(self):
+        output = run_main("record", self.TEXT)
+        assert output == '{"a":1,"b":[1,2]}\n{"a":2}\n', output
+
+    def test_field(self):
+        output = run_main("obj['a'] * 10", self.TEXT)
+        assert output == "10\n20\n", output
+
+    def test_unicode(self):
+        output = run_main("obj", '{"a": "\\u00e9"}\n')
+        assert output == '{"a":"\u00e9"}\n', output
+
+    def test_pprint(self):
+        output = run_main("obj", self.TEXT, pprint_opt=True)
+        assert output == "{'a': 1, 'b': [1, 2]}\n{'a': 2}\n", output
+
+    def test_end(self):
+        output = run_main(
+            "keys.update(obj)", self.TEXT, begin="keys = set()", end="sorted(keys)"
+        )
+        assert output == '["a","b"]\n', output
+
+    def test_await(self):
+        output = run_main("await asyncio.sleep(0); obj.get('b', [])", self.TEXT)
+        assert output == "[1,2]\n[]\n", output
+
+    def test_jobs(self):
+        output = run_main("obj", self.TEXT, jobs=2)
+        assert output == '{"a":1,"b":[1,2]}\n{"a":2}\n', output
+
+
+class TestFiles(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.files = []
+        for name, text in [("a.txt", "1\n2\n"), ("b.txt", "3\n4\n5\n")]:
+            path = os.path.join(self.tmp_dir.name, name)
+            with open(path, "w") as f:
+                f.write(text)
+            self.files.append(path)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_lines(self):
+        output = run_main("int(l) * 2", files=self.files)
+        assert output == "2\n4\n6\n8\n10\n", output
+
+    def test_filename(self):
+        output = run_main("os.path.basename(fn), n, l", files=self.files)
+        expected = (
+            "('a.txt', 1, '1')\n('a.txt', 2, '2')\n"
+            "('b.txt', 1, '3')\n('b.txt', 2, '4')\n('b.txt', 3, '5')\n"
+        )
+        assert output == expected, output
+
+    def test_per_file(self):
+        output = run_main("len(contents)", files=self.files)
+        assert output == "4\n6\n", output
+
+    def test_stdin(self):
+        output = run_main("fn, lineno, p", "x y\n", files=["-"])
+        assert output == "('-', 1, ['x', 'y'])\n", output
+
+    def test_no_files(self):
+        output = run_main("filename, n, l", "x\ny\n")
+        assert output == "('-', 1, 'x')\n('-', 2, 'y')\n", output
+
+    def test_missing(self):
+        # Like cat, keep going, and exit with an error at the end.
+        missing = os.path.join(self.tmp_dir.name, "missing.txt")
+        for kwargs in [{}, {"threads": 2}, {"jobs": 2}]:
+            with StdoutManager() as (stdin, stdout, stderr):
+                with self.assertRaises(SystemExit) as context:
+                    main("l", files=[self.files[0], missing, self.files[1]], **kwargs)
+                assert context.exception.code == 1, context.exception.code
+                assert stdout.getvalue() == "1\n2\n3\n4\n5\n", stdout.getvalue()
+                message = "pyli: {}: No such file or directory\n".format(missing)
+                assert stderr.getvalue() == message, stderr.getvalue()
+
+    def test_variables_win(self):
+        # Command line variables named like the special variables.
+        output = run_main("line[:int(n)], fn", "abc\n", variables={"n": "2", "fn": "x"})
+        assert output == "('ab', 'x')\n", output
+
+    def test_begin_end(self):
+        output = run_main(
+            "total += int(l)", begin="total = 0", end="total", files=self.files
+        )
+        assert output == "15\n", output
+
+    def test_jobs(self):
+        output = run_main("sum(map(int, lines))", files=self.files, jobs=2)
+        assert output == "3\n12\n", output
+
+    def test_threads(self):
+        output = run_main("str(n) + l", files=self.files, threads=2)
+        assert output == "11\n22\n13\n24\n35\n", output
+
+    def test_lineno_jobs(self):
+        output = run_main("str(n) + l", "x\ny\n", jobs=2)
+        assert output == "1x\n2y\n", output
+
+    def test_lineno_not_per_line(self):
+        # Not taken for a module.
+        for program in ["len(lines), n", "contents, lineno"]:
+            with StdoutManager():
+                with self.assertRaises(SystemExit):
+                    main(program, files=self.files)
+                with self.assertRaises(SystemExit):
+                    main(program)
+
+    def test_command_line(self):
+        output = subprocess.run(
+            PYLI_COMMAND + ["--no-cache", "os.path.basename(fn)", "--"] + self.files,
+            stdout=subprocess.PIPE,
+            text=True,
+            check=True,
+        ).stdout
+        assert output == "a.txt\nb.txt\n", output
+
+
+class TestLimit(unittest.TestCase):
+    def test_limit(self):
+        output = run_main("int(l) * 2", "1\n2\n3\n4\n", limit=2)
+        assert output == "2\n4\n", output
+
+    def test_limit_counts_results(self):
+        output = run_main("if int(l) % 2: l", "1\n2\n3\n4\n5\n", limit=2)
+        assert output == "1\n3\n", output
+
+    def test_limit_stops_reading(self):
+        with StdoutManager() as (stdin, stdout, stderr):
+            stdin.write("x\n" * 100000)
+            stdin.seek(0)
+            main("l", limit=1, block_size=64)
+            assert stdout.getvalue() == "x\n", stdout.getvalue()
+            assert stdin.tell() < 1000, stdin.tell()
+
+    def test_limit_print(self):
+        # Lines the program writes itself count too.
+        with StdoutManager() as (stdin, stdout, stderr):
+            stdin.write("x\n" * 100000)
+            stdin.seek(0)
+            main("print(l)", limit=3, block_size=64)
+            assert stdout.getvalue() == "x\n" * 3, stdout.getvalue()
+            assert stdin.tell() < 1000, stdin.tell()
+        output = run_main("print(l * 2, sep='')\nl", "1\n2\n3\n", limit=3)
+        assert output == "11\n1\n22\n", output
+        output = run_main("print(l, l, sep='\\n')", "1\n2\n", limit=3)
+        assert output == "1\n1\n2\n", output
+
+    def test_limit_zero(self):
+        output = run_main("l", "1\n2\n", limit=0)
+        assert output == "", output
+
+    def test_limit_pprint(self):
+        output = run_main("[l]", "1\n2\n3\n", limit=2, pprint_opt=True)
+        assert output == "['1']\n['2']\n", output
+
+    def test_limit_jobs(self):
+        output = run_main("l", "1\n2\n3\n", limit=2, jobs=2)
+        assert output == "1\n2\n", output
+
+    def test_limit_await(self):
+        with self.assertRaises(SystemExit):
+            run_main("await asyncio.sleep(0)", "1\n", limit=1)
+
+    def test_skip(self):
+        output = run_main("l", "1\n2\n3\n", skip=2)
+        assert output == "3\n", output
+
+    def test_skip_lineno(self):
+        output = run_main("str(n) + p[1]", "a 1\nb 2\nc 3\n", skip=1)
+        assert output == "22\n33\n", output
+
+    def test_skip_records(self):
+        output = run_main('record["a"]', 'header\n{"a": 1}\n', skip=1)
+        assert output == "1\n", output
+
+    def test_skip_limit(self):
+        output = run_main("l", "1\n2\n3\n4\n", skip=1, limit=2)
+        assert output == "2\n3\n", output
+
+    def test_broken_pipe(self):
+        with subprocess.Popen(
+            PYLI_COMMAND + ["--no-cache", "l"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        ) as process:
+            assert process.stdin is not None and process.stdout is not None
+            assert process.stderr is not None
+            process.stdout.close()
+            try:
+                process.stdin.write(b"x\n" * 1000000)
+                process.stdin.close()
+            except BrokenPipeError:
+                # It stopped reading.
+                pass
+            stderr = process.stderr.read()
+        assert process.returncode == 141, process.returncode
+        assert stderr == b"", stderr
+
+
+class TestGrep(unittest.TestCase):
+    TEXT = "INFO a\nERROR b\nINFO c\nERROR d"
+
+    def test_fixed(self):
+        output = run_main("l", self.TEXT, grep="ERROR", fixed=True)
+        assert output == "ERROR b\nERROR d\n", output
+
+    def test_regex(self):
+        output = run_main("p[1]", self.TEXT, grep="^INFO")
+        assert output == "a\nc\n", output
+
+    def test_regex_per_line(self):
+        # Matches can't run into the next line.
+        output = run_main("l", self.TEXT, grep="b\\s")
+        assert output == "", output
+
+    def test_skip(self):
+        output = run_main("l", self.TEXT, grep="b$|d$", skip=2)
+        assert output == "ERROR d\n", output
+
+    def test_records(self):
+        text = '{"a": 1}\n{"b": 2}\n'
+        output = run_main("record", text, grep='"b"', fixed=True)
+        assert output == '{"b":2}\n', output
+
+    def test_lines(self):
+        output = run_main("len(list(lines))", self.TEXT, grep="ERROR", fixed=True)
+        assert output == "2\n", output
+
+    def test_binary(self):
+        output = run_main("line", self.TEXT, grep="ERROR", fixed=True, binary=True)
+        assert output == b"ERROR b\nERROR d\n", output
+
+    def test_blocks(self):
+        text = "".join("{} {}\n".format(i, "x" * (i % 7)) for i in range(1000))
+        output = run_main("l", text, grep="xxxxx$", block_size=16)
+        expected = "".join(
+            line + "\n" for line in text.splitlines() if line.endswith("xxxxx")
+        )
+        assert output == expected, output
+
+    def test_decoded(self):
+        # Not ASCII compatible, so the lines are filtered after decoding.
+        with StdoutManager() as (stdin, stdout, stderr):
+            data = "a\nb\n".encode("utf-16")
+            sys.stdin = io.TextIOWrapper(io.BytesIO(data), encoding="utf-16")
+            main("l", grep="b")
+            assert stdout.getvalue() == "b\n", stdout.getvalue()
+
+    def test_lineno(self):
+        with StdoutManager():
+            with self.assertRaises(SystemExit):
+                main("str(n) + l", grep="ERROR")
+
+    def test_non_ascii(self):
+        # The same lines as searching the decoded lines in the program.
+        text = "café\ncafx\ncafà"
+        for pattern in ["caf.$", "caf[é]", "(?i)CAFÉ", "caf[a-z]$", "\\bcaf"]:
+            program = "l if re.search({!r}, l) else None".format(pattern)
+            expected = run_main(program, text)
+            output = run_main("l", text, grep=pattern)
+            assert output == expected, (pattern, output, expected)
+
+    def test_crlf(self):
+        text = "ERROR a\r\nINFO\r\nERROR\r\n"
+        output = run_main("l", text, grep="ERROR$")
+        assert output == "ERROR\n", output
+        output = run_main("l", text, grep="ERROR$", block_size=1)
+        assert output == "ERROR\n", output
+
+    def test_search_bytes(self):
+        assert can_search_bytes("ERROR [0-9]+$", False)
+        assert can_search_bytes("caf[]é]", True)
+        for pattern in ["a.b", "[^a]", "\\w", "\\bx", "(?i)x", "é", "x\\Z"]:
+            assert not can_search_bytes(pattern, False), pattern
+
+
+class TestOptimize(unittest.TestCase):
+    TEXT = "a 5\nb 20\nc 7"
+
+    def hoist(self, code, variable_names=set()):
+        tree = ast.parse(
+            "for PYLI_RESERVED_line in PYLI_RESERVED_lines:\n    {}".format(code)
+        )
+        count = hoist_invariants(tree, variable_names)
+        ast.fix_missing_locations(tree)
+        return count, ast.unparse(tree)
+
+    def test_output(self):
+        program = "int(p[1]) > int(t) * 2 and re.sub('[a-b]', '#', p[0])"
+        variables = {"t": "3"}
+        for optimize in [True, False]:
+            output = run_main(
+                program, self.TEXT, variables=variables, optimize=optimize
+            )
+            assert output == "False\n#\nc\n", output
+
+    def test_hoisted(self):
+        count, source = self.hoist("int(t) + len(l)", {"t"})
+        assert count == 1, source
+        assert "PYLI_RESERVED_hoisted_0 = (int(t),)" in source, source
+        count, source = self.hoist("re.search('a+', l, flags=re.I)")
+        assert count == 1, source
+        assert "re.compile('a+', re.I)" in source, source
+        assert "PYLI_RESERVED_hoisted_0[0].search(l)" in source, source
+
+    def test_not_hoisted(self):
+        # Not invariant, assigned, impure or with eval().
+        assert self.hoist("int(l)", {"t"})[0] == 0
+        assert self.hoist("t = int(t) + 1", {"t"})[0] == 0
+        assert self.hoist("int = float; int(t)", {"t"})[0] == 0
+        assert self.hoist("print(t)", {"t"})[0] == 0
+        assert self.hoist("sorted([1, 2])")[0] == 0
+        assert self.hoist("eval('x'); int(t)", {"t"})[0] == 0
+        assert self.hoist("(lambda x: int(t))(l)", {"t"})[0] == 0
+
+    def test_unbounded_operators(self):
+        # Only int() is hoisted, not the (possibly huge) result.
+        for code in ["'x' * int(t)", "2 ** int(t)", "1 << int(t)", "bytes(int(t))"]:
+            count, source = self.hoist(code, {"t"})
+            assert count == 1, source
+            assert "PYLI_RESERVED_hoisted_0 = (int(t),)" in source, source
+
+    def test_unreached_failure(self):
+        # Hoisting mustn't raise errors that wouldn't have happened.
+        program = "int(t) if p[0] == 'x' else p[1]"
+        output = run_main(program, self.TEXT, variables={"t": "x"})
+        assert output == "5\n20\n7\n", output
+
+    def test_reached_failure(self):
+        program = "int(t) if p[0] == 'b' else p[1]"
+        with StdoutManager():
+            sys.stdin = io.TextIOWrapper(io.BytesIO(self.TEXT.encode()))
+            with self.assertRaises(ValueError):
+                main(program, variables={"t": "x"})
+
+
+class TestLocals(unittest.TestCase):
+    TEXT = "a 5\nb 20\nc 7"
+
+    def localize(self, code, variable_names=set(), module_names=set()):
+        tree = ast.parse(code)
+        count = localize_loops(tree, variable_names, module_names)
+        ast.fix_missing_locations(tree)
+        return count, ast.unparse(tree)
+
+    def test_output(self):
+        programs = [
+            ("x = int(p[1]); x * 2 if x > 6 else None", {}),
+            ("t = int(t) + int(p[1]); t", {"variables": {"t": "1"}}),
+            ("c += int(p[1]); last = p[0]", {"begin": "c = 0", "end": "c, last"}),
+            ("f = lambda: l; f()", {}),
+            ("if n == 2: len = str\nlen(l)", {}),
+        ]
+        for program, kwargs in programs:
+            outputs = [
+                run_main(program, self.TEXT, optimize=optimize, **kwargs)
+                for optimize in [True, False]
+            ]
+            assert outputs[0] == outputs[1], outputs
+
+    def test_wrapped(self):
+        code = "c = 0\nfor PYLI_RESERVED_line in PYLI_RESERVED_lines:\n"
+        code += "    l = PYLI_RESERVED_line\n    c += len(l)\n    re.match(t, l)\nc"
+        count, source = self.localize(code, {"t"}, {"re"})
+        assert count == 1, source
+        assert "len=len, re=re, t=t):" in source, source
+        assert "global c\n" in source, source
+        assert "PYLI_RESERVED_loop_0()" in source, source
+
+    def test_not_wrapped(self):
+        loop = "for PYLI_RESERVED_line in PYLI_RESERVED_lines:\n    {}"
+        assert self.localize(loop.format("eval(l)"))[0] == 0
+        assert self.localize(loop.format("locals()"))[0] == 0
+        assert self.localize("def f():\n    global c\n" + loop.format("f()"))[0] == 0
+        assert self.localize(loop.format("await f(l)"))[0] == 0
+        nested = "def f():\n    " + loop.format("l").replace("\n", "\n    ")
+        assert self.localize(nested)[0] == 0